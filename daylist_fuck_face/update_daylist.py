@@ -1,12 +1,19 @@
 # update_daylist.py
+# one account, one hand-picked list. soul_daylist.py builds daylists from each
+# user's extraction and publishes them for everyone with a token
 
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from dotenv import load_dotenv
 import os
+import sys
 import time
 import random
 
+# shared helpers live one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from soul_cassette import attach_from_env
+
 # Load environment variables
 load_dotenv(dotenv_path="/Users/stuartholmberg/servers/code/spotify-soul/.env")
 
@@ -27,7 +34,7 @@ auth_manager = SpotifyOAuth(
     open_browser=True  # This will try to open a browser for you
 )
 
-sp = spotipy.Spotify(auth_manager=auth_manager)
+sp = attach_from_env(spotipy.Spotify(auth_manager=auth_manager), "daylist")
 
 # Playlist settings
 TARGET_PLAYLIST_NAME = "FINAL BOSS HP = 100"
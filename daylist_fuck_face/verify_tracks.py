@@ -4,6 +4,11 @@ import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from dotenv import load_dotenv
 import os
+import sys
+
+# shared helpers live one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from soul_cassette import attach_from_env
 
 # Load environment variables
 load_dotenv(dotenv_path="/Users/stuartholmberg/servers/code/spotify-soul/.env")
@@ -40,7 +45,7 @@ TRACK_URIS = [
 try:
     # Initialize Spotipy with OAuth
     auth_manager = SpotifyOAuth(scope=["playlist-read-private"], cache_path=".spotify_cache")
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+    sp = attach_from_env(spotipy.Spotify(auth_manager=auth_manager), "verify")
 
     print("🔍 Verifying the hardcoded track list...")
     
@@ -1,7 +1,13 @@
+import os
+import sys
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import pandas as pd
 
+# shared helpers live one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from soul_cassette import attach_from_env
+
 # Add your own Spotify credentials here
 SPOTIPY_CLIENT_ID = 'your_client_id'
 SPOTIPY_CLIENT_SECRET = 'your_client_secret'
@@ -11,7 +17,7 @@ client_credentials_manager = SpotifyClientCredentials(
     client_id=SPOTIPY_CLIENT_ID,
     client_secret=SPOTIPY_CLIENT_SECRET
 )
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+sp = attach_from_env(spotipy.Spotify(client_credentials_manager=client_credentials_manager), "vibe_check")
 
 # List of track URLs or URIs
 track_urls = [
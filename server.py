@@ -3,33 +3,37 @@
 Spotify OAuth server for soul extraction app
 """
 
+import glob
 import os
-import json
+import re
 import time
 import datetime
 import logging
 import secrets
+import threading
 from pathlib import Path
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
-from flask import Flask, redirect, request, jsonify, render_template, session, flash
+from flask import Flask, redirect, request, jsonify, render_template, session, flash, Response, stream_with_context
 from spotipy.oauth2 import SpotifyOAuth
 from spotipy.exceptions import SpotifyException
 import spotipy
 from dotenv import load_dotenv
 from werkzeug.exceptions import BadRequest, InternalServerError
 
+from soul_logging import setup_logging, dropped_records
+from soul_resilience import breakers
+from soul_jobs import ExtractionJobQueue, JobQueueConfig, QueueFullError, SUCCEEDED, FAILED
+from soul_events import EventBroker, format_sse
+from soul_export import ExportConfig, create_blueprint
+from soul_responses import ResponseCache, ResponseCacheConfig
+from soul_persist import write_json
+from soul_scheduler import ExtractionScheduler, SchedulerConfig
+
 load_dotenv()
 
-# basic logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('oauth_server.log'),
-        logging.StreamHandler()
-    ]
-)
+# logging goes through a queue - file writes happen on the listener thread
+setup_logging('oauth_server.log')
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -40,6 +44,15 @@ class ServerConfig:
     tokens_dir: str = "tokens"
     session_timeout: int = 3600  # 1 hour
     max_token_age: int = 86400   # 24 hours
+    extraction_workers: int = 2
+    extraction_queue_size: int = 50
+    jobs_db: str = "jobs/jobs.db"
+    auto_extract: bool = True  # queue an extraction as soon as a token lands
+    scheduler_enabled: bool = False  # keep every user fresh on a schedule (see soul_scheduler)
+    scheduler_db: str = "jobs/schedule.db"
+    event_stream_seconds: int = 300  # EventSource reconnects on its own after this
+    page_max_age: int = 300  # Cache-Control for rendered pages - ETags make revalidation cheap after that
+    export_data_dir: str = "data"  # extractions (and their manifest) served under /api/soul
     scope: str = "user-top-read user-read-recently-played user-library-read playlist-read-private playlist-modify-public playlist-modify-private"
 
 # Duplicate import removed: from flask import request, jsonify
@@ -74,6 +87,12 @@ class SpotifyOAuthManager:
             scope=config.scope,
             show_dialog=True
         )
+        # staging / load tests point these at a stand-in (see soul_loadtest)
+        accounts_url = os.getenv("SPOTIFY_ACCOUNTS_URL")
+        if accounts_url:
+            self.sp_oauth.OAUTH_AUTHORIZE_URL = f"{accounts_url.rstrip('/')}/authorize"
+            self.sp_oauth.OAUTH_TOKEN_URL = f"{accounts_url.rstrip('/')}/api/token"
+        self.api_url = os.getenv("SPOTIFY_API_URL")
         
         self.auth_attempts = {}
         self.successful_auths = []
@@ -86,7 +105,7 @@ class SpotifyOAuthManager:
         try:
             auth_url = self.sp_oauth.get_authorize_url(state=state)
             
-            logger.info(f"Auth URL generated for {state[:8]}...")
+            logger.info("Auth URL generated for %s...", state[:8])
             
             return {
                 'auth_url': auth_url,
@@ -96,11 +115,11 @@ class SpotifyOAuthManager:
             }
             
         except Exception as e:
-            logger.error(f"Failed to generate auth URL: {e}")
+            logger.error("Failed to generate auth URL: %s", e)
             raise
     
     def handle_callback(self, code: str, state: str) -> Dict[str, Any]:
-        logger.info(f"Processing callback for {state[:8]}...")
+        logger.info("Processing callback for %s...", state[:8])
         
         try:
             token_info = self.sp_oauth.get_access_token(code, as_dict=True, check_cache=False)
@@ -113,7 +132,7 @@ class SpotifyOAuthManager:
             
             token_file = self._save_token(token_info, user_profile)
             
-            logger.info(f"Auth completed for {user_profile.get('display_name', user_id)}")
+            logger.info("Auth completed for %s", user_profile.get('display_name', user_id), extra={'user_id': user_id})
             
             return {
                 'success': True,
@@ -125,17 +144,19 @@ class SpotifyOAuthManager:
             }
             
         except SpotifyException as e:
-            logger.error(f"Spotify error: {e}")
+            logger.error("Spotify error: %s", e)
             raise BadRequest(f"Spotify auth failed: {e}")
             
         except Exception as e:
-            logger.error(f"Callback error: {e}")
+            logger.error("Callback error: %s", e)
             raise InternalServerError(f"she dont work: {e}")
             raise InternalServerError(f"Failed to process Spotify OAuth callback: {e}")
     def _get_user_profile(self, access_token: str) -> Dict[str, Any]:
         # need this to get user info - pretty basic stuff
         try:
             sp = spotipy.Spotify(auth=access_token)
+            if self.api_url:
+                sp.prefix = f"{self.api_url.rstrip('/')}/"
             profile = sp.current_user()
             if not profile:
                 # this shouldnt happen but just in case
@@ -143,7 +164,7 @@ class SpotifyOAuthManager:
             return profile
         except Exception as e:
             # sometimes spotify is weird about this
-            logger.error(f"Failed to get user profile: {e}")
+            logger.error("Failed to get user profile: %s", e)
             raise
     
     def _save_token(self, token_info: Dict[str, Any], user_profile: Dict[str, Any]) -> Path:
@@ -153,57 +174,114 @@ class SpotifyOAuthManager:
         token_file = self.tokens_dir / f"spotify_token_{user_id}_{timestamp}.json"
         
         try:
-            with open(token_file, 'w') as f:
-                json.dump(token_info, f, indent=2, ensure_ascii=False)
-            
-            token_file.chmod(0o600)  # secure permissions
+            # 0600 from the start, and atomic so get_latest_token never sees half a token
+            write_json(token_file, token_info, mode=0o600)
             
             self._cleanup_old_tokens(user_id)
             
-            logger.info(f"Token saved: {token_file.name}")
+            logger.info("Token saved: %s", token_file.name, extra={'user_id': user_id})
             return token_file
             
         except Exception as e:
-            logger.error(f"Failed to save token: {e}")
+            logger.error("Failed to save token: %s", e, extra={'user_id': user_id})
             raise
     
     def _cleanup_old_tokens(self, user_id: str, keep_count: int = 3):
         try:
+            # exact user + timestamp match - "*bob_*" used to take jimbob's tokens too.
+            # the timestamp sorts by name, so no stat() on files another request may be deleting
+            pattern = re.compile(rf"spotify_token_{re.escape(user_id)}_\d{{8}}_\d{{6}}\.json")
             user_tokens = sorted(
-                [f for f in self.tokens_dir.glob(f"*{user_id}_*.json")],
-                key=lambda f: f.stat().st_ctime,
+                [f for f in self.tokens_dir.glob(f"spotify_token_{glob.escape(user_id)}_*.json") if pattern.fullmatch(f.name)],
+                key=lambda f: f.name,
                 reverse=True
             )
             
-            # Remove old tokens beyond keep_count
+            # Remove old tokens beyond keep_count - a concurrent callback for the same user may get there first
             for old_token in user_tokens[keep_count:]:
-                old_token.unlink()
-                logger.info(f"Cleaned up old token: {old_token.name}")
+                old_token.unlink(missing_ok=True)
+                logger.info("Cleaned up old token: %s", old_token.name)
                 
         except Exception as e:
-            logger.warning(f"Failed to cleanup old tokens: {e}")
+            logger.warning("Failed to cleanup old tokens: %s", e)
     
     def get_server_stats(self) -> Dict[str, Any]:
         """Get server statistics"""
         now = datetime.datetime.now()
         
-        token_files = list(self.tokens_dir.glob("*.json"))
-        recent_tokens = [
-            f for f in token_files 
-            if (now - datetime.datetime.fromtimestamp(f.stat().st_ctime)).seconds < 3600
-        ]
+        # token cleanup runs concurrently - files can vanish between listing and stat()
+        total_tokens = recent_tokens = 0
+        with os.scandir(self.tokens_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    created = datetime.datetime.fromtimestamp(entry.stat().st_ctime)
+                except FileNotFoundError:
+                    continue
+                total_tokens += 1
+                if (now - created).total_seconds() < 3600:
+                    recent_tokens += 1
         
         return {
             'server_start_time': self.start_time.isoformat(),
-            'total_tokens': len(token_files),
-            'recent_tokens': len(recent_tokens),
+            'total_tokens': total_tokens,
+            'recent_tokens': recent_tokens,
+            'dropped_log_records': dropped_records(),
+            'open_circuits': breakers.open_circuits(),
             'server_version': '2.0'
         }
 
 # init the OAuth manager
-config = ServerConfig()
+config = ServerConfig(auto_extract=os.getenv("SOUL_AUTO_EXTRACT", "1") != "0")
 oauth_manager = SpotifyOAuthManager(config)
 
+# live progress for the browser - replaces polling; a finished job's history goes after a while
+event_broker = EventBroker(terminal_events=('job_succeeded', 'job_failed'))
+
+def publish_job_event(job: Dict[str, Any], event: str, details: Dict[str, Any]):
+    event_broker.publish(f"jobs/{job['id']}", event, {'job_id': job['id'], **details})
+    if event in ('job_succeeded', 'job_failed'):
+        event_broker.publish("server", "stats", oauth_manager.get_server_stats())
+
+# extraction runs on a worker pool so callbacks return right away
+job_queue = ExtractionJobQueue(JobQueueConfig(
+    db_path=config.jobs_db,
+    workers=config.extraction_workers,
+    max_queued=config.extraction_queue_size,
+    token_dir=config.tokens_dir
+), listener=publish_job_event)
+
+# periodic recent/top/full-library runs share the same workers as callbacks
+scheduler = None
+if config.scheduler_enabled:
+    scheduler = ExtractionScheduler(job_queue, SchedulerConfig(
+        db_path=config.scheduler_db,
+        max_in_flight=config.extraction_workers
+    ))
+
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background():
+    """Start the worker pool and scheduler in this process, once
+
+    Never at import: the debug reloader imports us in a watcher process
+    that serves nothing, and gunicorn --preload imports in the master
+    before forking. Runs from main() in the serving process, or on the
+    first request a gunicorn worker handles.
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    if config.auto_extract or config.scheduler_enabled:
+        job_queue.start()
+    if scheduler:
+        scheduler.discover_users(config.tokens_dir)
+        scheduler.start()
+
 # init Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', secrets.token_hex(32))
@@ -211,10 +289,59 @@ app.config['SESSION_COOKIE_SECURE'] = False
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = datetime.timedelta(seconds=config.session_timeout)
 
+# /api/soul/<user_id>/... pages through extractions for downstream consumers - see soul_export
+app.register_blueprint(create_blueprint(ExportConfig(data_dir=config.export_data_dir)))
+
+@app.before_request
+def _ensure_background():
+    # cheap after the first call - covers servers that never run main()
+    if not _background_started:
+        start_background()
+
+# pages render once and go out precompressed - see soul_responses
+response_cache = ResponseCache(ResponseCacheConfig(max_age=config.page_max_age))
+
+def _template_version(name: str) -> Optional[int]:
+    # debug mode reloads templates - re-render when the file changes
+    if not app.jinja_env.auto_reload:
+        return None
+    try:
+        return Path(app.root_path, app.template_folder, name).stat().st_mtime_ns
+    except OSError:
+        return None
+
+def cached_template(name: str, key: Any = (), slots=(), **context) -> Any:
+    """Render name once per key - slots are the printed values that change per request"""
+    return response_cache.page(
+        (name, key),
+        lambda placeholders: render_template(name, **context, **placeholders),
+        slots=slots,
+        version=_template_version(name)
+    )
+
+CALLBACK_ERROR_HTML = """
+        <div style="font-family: Arial; padding: 20px; background: #1a1a1a; color: #1db954;">
+            <h1>❌ Authorization Failed</h1>
+            <p>Error: {error}</p>
+            <p>Please try again.</p>
+        </div>
+        """
+
+CALLBACK_SUCCESS_HTML = """
+        <div style="font-family: Arial; padding: 20px; background: #1a1a1a; color: #1db954;">
+            <h1>✅ Authorization Successful!</h1>
+            <p><strong>Copy this ENTIRE URL and paste it into your terminal:</strong></p>
+            <div style="background: #333; padding: 10px; border-radius: 5px; word-break: break-all; margin: 10px 0;">
+                <code style="color: #fff;">{url}</code>
+            </div>
+            <p>Then press Enter in your terminal to continue.</p>
+        </div>
+        """
+
 @app.route('/')
 def index():
-    stats = oauth_manager.get_server_stats()
-    return render_template('entrance.html', stats=stats)
+    # entrance.html doesn't print stats - live numbers come from /api/events
+    return response_cache.respond(cached_template('entrance.html'))
 
 @app.route('/health')
 def health_check():
@@ -234,7 +361,7 @@ def get_auth_url():
         return jsonify(auth_data)
         
     except Exception as e:
-        logger.error(f"Failed to generate auth URL: {e}")
+        logger.error("Failed to generate auth URL: %s", e)
         return jsonify({'error': 'auth url messed up'}), 500
 
 @app.route('/callback')
@@ -244,39 +371,36 @@ def spotify_callback():
     state = request.args.get('state')
     error = request.args.get('error')
     
+    # the URL carries the auth code - never let anything cache these
     if error:
-        return f"""
-        <div style="font-family: Arial; padding: 20px; background: #1a1a1a; color: #1db954;">
-            <h1>❌ Authorization Failed</h1>
-            <p>Error: {error}</p>
-            <p>Please try again.</p>
-        </div>
-        """, 400
+        page = response_cache.page('callback_error', CALLBACK_ERROR_HTML.format_map, slots=('error',))
+        return response_cache.respond(page, {'error': error}, status=400, cache_control='no-store')
+    
+    if code and state and state == session.get('oauth_state'):
+        # started from our own page - callback.html posts the code to /api/callback and follows
+        # the extraction over /api/events; its script reads code/state from the URL itself
+        return response_cache.respond(cached_template('callback.html'), cache_control='no-store')
     
     if code:
-        return f"""
-        <div style="font-family: Arial; padding: 20px; background: #1a1a1a; color: #1db954;">
-            <h1>✅ Authorization Successful!</h1>
-            <p><strong>Copy this ENTIRE URL and paste it into your terminal:</strong></p>
-            <div style="background: #333; padding: 10px; border-radius: 5px; word-break: break-all; margin: 10px 0;">
-                <code style="color: #fff;">{request.url}</code>
-            </div>
-            <p>Then press Enter in your terminal to continue.</p>
-        </div>
-        """
+        # someone else's auth flow (e.g. soulpull in a terminal) - hand the URL back to them
+        page = response_cache.page('callback_success', CALLBACK_SUCCESS_HTML.format_map, slots=('url',))
+        return response_cache.respond(page, {'url': request.url}, cache_control='no-store')
     
     return "No authorization code received", 400
 
+EXIT_STATUSES = ('success', 'error', 'unknown')
+
 @app.route('/exit')
 def exit_screen():
     status = request.args.get('status', 'unknown')
+    # the page only knows these three - anything else would be one more cache entry per made-up value
+    if status not in EXIT_STATUSES:
+        status = 'unknown'
     auth_success = session.get('auth_success', False)
     
-    return render_template(
-        'exit.html',
-        status=status,
-        timestamp=datetime.datetime.utcnow().isoformat()
-    )
+    # one render per status - the timestamp is filled in per request if the page prints it
+    page = cached_template('exit.html', key=status, slots=('timestamp',), status=status)
+    return response_cache.respond(page, {'timestamp': datetime.datetime.utcnow().isoformat()})
 
 @app.after_request
 def add_security_headers(response):
@@ -304,16 +428,87 @@ def handle_callback():
     try:
         result = oauth_manager.handle_callback(code, state)
         session['auth_success'] = True
+        if scheduler:
+            scheduler.add_user(result['user_id'])
+        
+        if config.auto_extract:
+            try:
+                job = job_queue.submit(result['user_id'])
+                result['job_id'] = job['id']
+                result['job_status'] = job['status']
+                event_broker.publish(f"jobs/{job['id']}", 'auth_complete', {
+                    'job_id': job['id'],
+                    'user_name': result.get('user_name')
+                })
+            except QueueFullError as e:
+                # token is saved either way - extraction can be retried later
+                logger.warning("Extraction not queued for %s: %s", result['user_id'], e)
+                result['job_id'] = None
+                result['job_status'] = 'rejected'
+        
+        event_broker.publish("server", "stats", oauth_manager.get_server_stats())
         return jsonify(result)
         
     except BadRequest as e:
-        logger.error(f"Bad request: {e}")
+        logger.error("Bad request: %s", e)
         return jsonify({'error': str(e)}), 400
         
     except InternalServerError as e:
-        logger.error(f"Internal server error: {e}")
+        logger.error("Internal server error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500 
 
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job)
+
+def _last_event_id() -> Optional[int]:
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(last_id) if last_id else None
+    except ValueError:
+        return None
+
+def _sse_response(stream) -> Response:
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # keep nginx/ngrok from buffering
+    return response
+
+@app.route('/api/events')
+def server_events():
+    """Stream server stats - sent on connect and whenever an auth or job finishes"""
+    def stream():
+        yield format_sse('stats', oauth_manager.get_server_stats())
+        # the snapshot above is newer than anything in the history
+        yield from event_broker.stream("server", _last_event_id(), max_seconds=config.event_stream_seconds,
+                                       replay_fresh=False)
+    
+    return _sse_response(stream())
+
+@app.route('/api/events/jobs/<job_id>')
+def job_events(job_id):
+    """Stream auth + extraction progress for one job until it finishes"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    
+    def stream():
+        # job already done - its history may be pruned or lost to a restart, so just report the outcome
+        if job['status'] in (SUCCEEDED, FAILED):
+            yield format_sse(f"job_{job['status']}", job)
+            return
+        yield from event_broker.stream(
+            f"jobs/{job_id}",
+            _last_event_id(),
+            max_seconds=config.event_stream_seconds,
+            until=('job_succeeded', 'job_failed')
+        )
+    
+    return _sse_response(stream())
+
 @app.route('/api/mara', methods=['POST'])
 def summon_mara():
     data = request.get_json()
@@ -335,17 +530,21 @@ def summon_mara():
     })
 @app.errorhandler(404)
 def not_found_error(error):
-    logger.warning(f"404 error: {request.url}")
+    logger.warning("404 error: %s", request.url)
     return render_template('index.html', error="page doesnt work"), 404
 
 @app.errorhandler(500)
 def server_error(error):
-    logger.error(f"❌ Server error: {error}")
+    logger.error("❌ Server error: %s", error)
     return jsonify({'error': 'Internal server error'}), 500
 
 def main():
     """Main server startup"""
     logger.info(f"Starting Spotify OAuth Server on {config.host}:{config.port}")
+
+    # with the reloader on, only the child (WERKZEUG_RUN_MAIN) serves requests
+    if not config.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background()
     
     try:
         app.run(
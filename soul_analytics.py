@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Listening analytics over extracted soul data
+
+Works on raw extractions (spotify_soul_data_*.json) and on processed
+final_landing files. Everything is computed for a whole batch of snapshots
+at once with pandas group-bys, so one user and ten thousand users go through
+the same code path.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from soul_manifest import extraction_files
+from soul_persist import write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+TIME_RANGES = ['short_term', 'medium_term', 'long_term']
+RANGE_PAIRS = [('short_term', 'medium_term'), ('medium_term', 'long_term'), ('short_term', 'long_term')]
+ANALYTICS_VERSION = "1"
+
+
+@dataclass
+class AnalyticsConfig:
+    """Configuration for the analytics engine"""
+    cache_dir: str = "analytics/cache"
+    output_dir: str = "analytics"
+    # how much each time range counts towards the recency-weighted score
+    short_term_weight: float = 0.5
+    medium_term_weight: float = 0.3
+    long_term_weight: float = 0.2
+    recent_play_weight: float = 0.3
+    recent_half_life_hours: float = 72.0
+    top_n: int = 20
+
+
+def settings_hash(config: AnalyticsConfig) -> str:
+    """Short stable hash of the settings that change results - where files go doesn't"""
+    settings = {k: v for k, v in asdict(config).items() if k not in ('cache_dir', 'output_dir')}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def load_extraction(path: Union[str, Path]) -> Tuple[Dict[str, Any], str]:
+    """Load an extraction file and its sha256 - the same hash the manifest records, and the cache key"""
+    raw = Path(path).read_bytes()
+    return json.loads(raw), hashlib.sha256(raw).hexdigest()
+
+
+def snapshot_user_id(data: Dict[str, Any]) -> Optional[str]:
+    metadata = data.get('extraction_metadata') or {}
+    profile = data.get('user_profile') or {}
+    if metadata.get('spotify_user_id'):
+        return metadata['spotify_user_id']
+    if profile.get('id'):
+        return profile['id']
+    # processed files only keep the uri
+    uri = profile.get('spotify_uri') or profile.get('uri')
+    if uri:
+        return uri.rsplit(':', 1)[-1]
+    return None
+
+
+def _items(payload: Any) -> List[Dict[str, Any]]:
+    # raw sections are {"items": [...]}, processed ones are plain lists
+    if isinstance(payload, dict):
+        return payload.get('items') or []
+    return payload or []
+
+
+def _genres(item: Dict[str, Any]) -> List[str]:
+    genres = item.get('genres') or []
+    if isinstance(genres, str):
+        # process_artist joins them into one string
+        genres = [g.strip() for g in genres.split(',')]
+    return [g for g in genres if g]
+
+
+def _track_artists(item: Dict[str, Any]) -> str:
+    if item.get('artists'):
+        return ", ".join(a.get('name', '') for a in item['artists'])
+    return item.get('artist') or ''
+
+
+def build_frames(snapshots: Dict[str, Dict[str, Any]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Flatten snapshots (keyed by hash) into a top-items frame and a recent-plays frame"""
+    item_rows = []
+    play_rows = []
+
+    for snapshot, data in snapshots.items():
+        for section, kind in (('top_artists', 'artist'), ('top_tracks', 'track')):
+            for time_range, payload in (data.get(section) or {}).items():
+                for rank, item in enumerate(_items(payload)):
+                    if not item:
+                        continue
+                    name = item.get('name')
+                    item_rows.append((
+                        snapshot,
+                        kind,
+                        time_range,
+                        rank,
+                        # processed files have no ids - fall back to the name
+                        item.get('id') or f"name:{name}",
+                        name,
+                        item.get('popularity'),
+                        # tracks only have genres once their artists have been hydrated
+                        _genres(item) if kind == 'artist' else sorted({
+                            g for artist in item.get('artists') or [] for g in _genres(artist)
+                        }),
+                        _track_artists(item) if kind == 'track' else name
+                    ))
+
+        for play in _items(data.get('recent_tracks')):
+            track = play.get('track', play) if play else None
+            if not track:
+                continue
+            play_rows.append((
+                snapshot,
+                track.get('id') or f"name:{track.get('name')}",
+                track.get('name'),
+                play.get('played_at')
+            ))
+
+    items = pd.DataFrame(item_rows, columns=[
+        'snapshot', 'kind', 'time_range', 'rank', 'item_id', 'name', 'popularity', 'genres', 'artist'
+    ])
+    plays = pd.DataFrame(play_rows, columns=['snapshot', 'item_id', 'name', 'played_at'])
+    plays['played_at'] = pd.to_datetime(plays['played_at'], utc=True, errors='coerce')
+    return items, plays
+
+
+def genre_distribution(items: pd.DataFrame) -> pd.DataFrame:
+    """Rank-weighted genre share per snapshot and time range"""
+    artists = items[items['kind'] == 'artist']
+    if artists.empty:
+        return pd.DataFrame(columns=['snapshot', 'time_range', 'genre', 'share'])
+
+    artists = artists.assign(
+        size=artists.groupby(['snapshot', 'time_range'])['rank'].transform('size')
+    )
+    # rank 0 of 50 counts 1.0, rank 49 counts 0.02
+    artists = artists.assign(weight=(artists['size'] - artists['rank']) / artists['size'])
+    exploded = artists[['snapshot', 'time_range', 'genres', 'weight']].explode('genres').dropna(subset=['genres'])
+
+    totals = exploded.groupby(['snapshot', 'time_range', 'genres'], sort=False)['weight'].sum().reset_index()
+    totals['share'] = totals['weight'] / totals.groupby(['snapshot', 'time_range'])['weight'].transform('sum')
+    return totals.rename(columns={'genres': 'genre'})[['snapshot', 'time_range', 'genre', 'share']]
+
+
+def overlap_and_churn(items: pd.DataFrame) -> pd.DataFrame:
+    """Jaccard overlap between time ranges plus churn of the short-term set"""
+    presence = (
+        items.groupby(['snapshot', 'kind', 'item_id', 'time_range'], sort=False).size()
+        .unstack(fill_value=0)
+        .clip(upper=1)
+        .reindex(columns=TIME_RANGES, fill_value=0)
+        .astype(np.int8)
+    )
+
+    grouped = {}
+    for first, second in RANGE_PAIRS:
+        a = presence[first].to_numpy()
+        b = presence[second].to_numpy()
+        frame = pd.DataFrame({'inter': a & b, 'union': a | b}, index=presence.index)
+        sums = frame.groupby(level=['snapshot', 'kind']).sum()
+        grouped[f"{first}_vs_{second}"] = sums['inter'] / sums['union'].replace(0, np.nan)
+
+    result = pd.DataFrame(grouped)
+    counts = presence.groupby(level=['snapshot', 'kind']).sum()
+    both = pd.Series(presence['short_term'].to_numpy() & presence['long_term'].to_numpy(), index=presence.index)
+    kept = both.groupby(level=['snapshot', 'kind']).sum()
+    # share of this month's favourites that aren't all-time favourites
+    result['churn'] = 1 - kept / counts['short_term'].replace(0, np.nan)
+    return result
+
+
+def rank_stability(items: pd.DataFrame) -> pd.DataFrame:
+    """How much rankings hold between ranges: overlap fraction x (1 - mean rank shift)"""
+    ranks = items.pivot_table(
+        index=['snapshot', 'kind', 'item_id'],
+        columns='time_range',
+        values='rank',
+        aggfunc='min'
+    ).reindex(columns=TIME_RANGES)
+    sizes = items.groupby(['snapshot', 'kind', 'time_range']).size().unstack().reindex(columns=TIME_RANGES)
+
+    result = {}
+    for first, second in RANGE_PAIRS:
+        shared = ranks[[first, second]].dropna()
+        delta = (shared[first] - shared[second]).abs()
+        grouped = delta.groupby(level=['snapshot', 'kind'])
+        mean_shift = grouped.mean()
+        shared_count = grouped.size()
+        denominator = sizes[[first, second]].max(axis=1).reindex(mean_shift.index)
+        result[f"{first}_vs_{second}"] = (shared_count / denominator) * (1 - mean_shift / denominator)
+
+    return pd.DataFrame(result).reindex(sizes.index)
+
+
+def recency_scores(items: pd.DataFrame, plays: pd.DataFrame, config: AnalyticsConfig) -> pd.DataFrame:
+    """Blend of time-range ranks and exponentially decayed recent plays"""
+    range_weights = pd.Series({
+        'short_term': config.short_term_weight,
+        'medium_term': config.medium_term_weight,
+        'long_term': config.long_term_weight
+    })
+
+    sized = items.assign(size=items.groupby(['snapshot', 'kind', 'time_range'])['rank'].transform('size'))
+    sized = sized.assign(
+        score=(1 - sized['rank'] / sized['size']) * sized['time_range'].map(range_weights).fillna(0)
+    )
+    scores = sized.groupby(['snapshot', 'kind', 'item_id'], sort=False).agg(
+        name=('name', 'first'),
+        artist=('artist', 'first'),
+        score=('score', 'sum')
+    )
+
+    if not plays.empty and plays['played_at'].notna().any():
+        timed = plays.dropna(subset=['played_at'])
+        # age against the newest play in the snapshot so results are reproducible
+        newest = timed.groupby('snapshot')['played_at'].transform('max')
+        age_hours = (newest - timed['played_at']).dt.total_seconds() / 3600
+        timed = timed.assign(decay=np.power(0.5, age_hours / config.recent_half_life_hours))
+        play_score = timed.groupby(['snapshot', 'item_id']).agg(name=('name', 'first'), decay=('decay', 'sum'))
+        play_score['decay'] /= play_score.groupby(level='snapshot')['decay'].transform('max')
+
+        play_index = pd.MultiIndex.from_arrays([
+            play_score.index.get_level_values('snapshot'),
+            np.full(len(play_score), 'track'),
+            play_score.index.get_level_values('item_id')
+        ], names=['snapshot', 'kind', 'item_id'])
+        recent = pd.DataFrame({
+            'name': play_score['name'].to_numpy(),
+            'artist': None,
+            'recent': play_score['decay'].to_numpy() * config.recent_play_weight
+        }, index=play_index)
+
+        scores = scores.join(recent[['recent']], how='outer')
+        scores['name'] = scores['name'].fillna(recent['name'].reindex(scores.index))
+        scores['score'] = scores['score'].fillna(0) + scores['recent'].fillna(0)
+        scores = scores.drop(columns='recent')
+
+    return scores.reset_index()
+
+
+def _round(value: Any) -> Optional[float]:
+    return None if pd.isna(value) else round(float(value), 4)
+
+
+def _pair_records(frame: pd.DataFrame) -> Dict[Tuple[str, str], Dict[str, Optional[float]]]:
+    if frame.empty:
+        return {}
+    columns = list(frame.columns)
+    return {
+        index: {column: _round(value) for column, value in zip(columns, row)}
+        for index, row in zip(frame.index, frame.itertuples(index=False, name=None))
+    }
+
+
+def _top_genres(genres: pd.DataFrame, top_n: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    # sort once, keep top_n per group - no per-snapshot filtering
+    top = (
+        genres.sort_values(['snapshot', 'time_range', 'share'], ascending=[True, True, False])
+        .groupby(['snapshot', 'time_range'], sort=False)
+        .head(top_n)
+    )
+    distribution: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for snapshot, time_range, genre, share in zip(top['snapshot'], top['time_range'], top['genre'], top['share']):
+        distribution.setdefault(snapshot, {}).setdefault(time_range, {})[genre] = round(float(share), 4)
+    return distribution
+
+
+def _top_items(scores: pd.DataFrame, top_n: int) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    top = (
+        scores.sort_values(['snapshot', 'kind', 'score'], ascending=[True, True, False])
+        .groupby(['snapshot', 'kind'], sort=False)
+        .head(top_n)
+    )
+    top_items: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    for snapshot, kind, item_id, name, artist, score in zip(
+        top['snapshot'], top['kind'], top['item_id'], top['name'], top['artist'], top['score']
+    ):
+        top_items.setdefault(snapshot, {}).setdefault(f"{kind}s", []).append(
+            {'id': item_id, 'name': name, 'artist': artist, 'score': round(float(score), 4)}
+        )
+    return top_items
+
+
+def compute_batch(snapshots: Dict[str, Dict[str, Any]], config: Optional[AnalyticsConfig] = None) -> Dict[str, Dict[str, Any]]:
+    """Analytics for every snapshot in one vectorised pass, keyed by snapshot hash"""
+    config = config or AnalyticsConfig()
+    if not snapshots:
+        return {}
+
+    items, plays = build_frames(snapshots)
+    if items.empty:
+        genres = pd.DataFrame(columns=['snapshot', 'time_range', 'genre', 'share'])
+        overlap = stability = pd.DataFrame()
+        scores = pd.DataFrame(columns=['snapshot', 'kind', 'item_id', 'name', 'artist', 'score'])
+    else:
+        genres = genre_distribution(items)
+        overlap = overlap_and_churn(items)
+        stability = rank_stability(items)
+        scores = recency_scores(items, plays, config)
+
+    distribution = _top_genres(genres, config.top_n)
+    top_items = _top_items(scores, config.top_n)
+    overlaps = _pair_records(overlap)
+    stabilities = _pair_records(stability)
+
+    results = {}
+    for snapshot, data in snapshots.items():
+        results[snapshot] = {
+            'user_id': snapshot_user_id(data),
+            'extraction_hash': snapshot,
+            'extraction_timestamp': (data.get('extraction_metadata') or {}).get('timestamp'),
+            'analytics_version': ANALYTICS_VERSION,
+            'genre_distribution': distribution.get(snapshot, {}),
+            'artist_overlap': overlaps.get((snapshot, 'artist'), {}),
+            'track_overlap': overlaps.get((snapshot, 'track'), {}),
+            'artist_stability': stabilities.get((snapshot, 'artist'), {}),
+            'track_stability': stabilities.get((snapshot, 'track'), {}),
+            'top_scores': top_items.get(snapshot, {'artists': [], 'tracks': []})
+        }
+    return results
+
+
+class AnalyticsCache:
+    """One JSON file per extraction file sha256 (the manifest's) - unchanged extractions are never recomputed"""
+
+    def __init__(self, cache_dir: str, settings: str = ""):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # results computed with other weights / top_n never come back
+        self.settings = settings
+
+    def _path(self, snapshot: str) -> Path:
+        return self.cache_dir / f"{snapshot}.v{ANALYTICS_VERSION}.{self.settings}.json"
+
+    def get(self, snapshot: str) -> Optional[Dict[str, Any]]:
+        path = self._path(snapshot)
+        if not path.exists():
+            return None
+        try:
+            return read_json(path)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Ignoring unreadable analytics cache {path.name}: {e}")
+            return None
+
+    def put(self, snapshot: str, result: Dict[str, Any]):
+        # a cache - no fsync, but still atomic so a crash can't leave a torn entry
+        write_json(self._path(snapshot), result, compact=True, fsync=False)
+
+
+class SoulAnalytics:
+    """Cached analytics for one or many extractions"""
+
+    def __init__(self, config: Optional[AnalyticsConfig] = None):
+        self.config = config or AnalyticsConfig()
+        self.cache = AnalyticsCache(self.config.cache_dir, settings_hash(self.config))
+
+    def analyze(self, data: Dict[str, Any], snapshot: str) -> Dict[str, Any]:
+        """snapshot is the extraction file's sha256, from load_extraction or the manifest"""
+        return self.analyze_many({snapshot: data})[snapshot]
+
+    def analyze_many(self, snapshots: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        misses = {}
+        for snapshot, data in snapshots.items():
+            cached = self.cache.get(snapshot)
+            if cached is not None:
+                results[snapshot] = cached
+            else:
+                misses[snapshot] = data
+
+        if misses:
+            logger.info(f"Computing analytics for {len(misses)} snapshots ({len(results)} cached)")
+            computed = compute_batch(misses, self.config)
+            for snapshot, result in computed.items():
+                self.cache.put(snapshot, result)
+            results.update(computed)
+
+        return results
+
+    def analyze_files(self, paths: List[Path]) -> Dict[str, Dict[str, Any]]:
+        snapshots = {}
+        for path in paths:
+            data, snapshot = load_extraction(path)
+            snapshots[snapshot] = data
+        return self.analyze_many(snapshots)
+
+
+def format_analytics(result: Dict[str, Any]) -> str:
+    lines = [f"=== SOUL ANALYTICS: {result.get('user_id') or 'Unknown'} ==="]
+
+    for time_range in TIME_RANGES:
+        genres = result['genre_distribution'].get(time_range)
+        if genres:
+            top = ", ".join(f"{g} {s:.0%}" for g, s in list(genres.items())[:5])
+            lines.append(f"{time_range:>12}: {top}")
+
+    churn = result['artist_overlap'].get('churn')
+    if churn is not None:
+        lines.append(f"\nArtist churn (4 weeks vs all time): {churn:.0%}")
+    for pair, value in result['artist_stability'].items():
+        if value is not None:
+            lines.append(f"Artist stability {pair}: {value:.2f}")
+
+    lines.append("\nTop artists right now:")
+    for item in result['top_scores'].get('artists', [])[:10]:
+        lines.append(f"   {item['score']:.2f}  {item['name']}")
+
+    lines.append("\nTop tracks right now:")
+    for item in result['top_scores'].get('tracks', [])[:10]:
+        lines.append(f"   {item['score']:.2f}  {item['name']} - {item['artist'] or ''}")
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute listening analytics from extracted soul data")
+    parser.add_argument("files", nargs="*", help="Extraction files (default: newest in data/raw)")
+    parser.add_argument("--quiet", action="store_true", help="Don't print per-user reports")
+    args = parser.parse_args()
+
+    paths = [Path(f) for f in args.files]
+    if not paths:
+        candidates = extraction_files("data/raw")
+        if not candidates:
+            print("No soul data found. Run 'soulpull --extract' first.")
+            return 1
+        paths = [candidates[-1]]
+
+    config = AnalyticsConfig()
+    analytics = SoulAnalytics(config)
+    results = analytics.analyze_files(paths)
+
+    output_dir = Path(config.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for snapshot, result in results.items():
+        output_file = output_dir / f"analytics_{result.get('user_id') or 'unknown'}_{snapshot[:12]}.json"
+        write_json(output_file, result)
+        if not args.quiet:
+            print(format_analytics(result))
+            print(f"\nSaved to {output_file}\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
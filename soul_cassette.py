@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Record/replay cassettes for Spotify API traffic
+"""
+
+import argparse
+import atexit
+import copy
+import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+from spotipy import Spotify
+from spotipy.exceptions import SpotifyException
+
+from soul_logging import setup_logging, LoggingConfig
+from soul_persist import atomic_write, dumps
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_DIR = "cassettes"
+CASSETTE_SUFFIX = ".jsonl.gz"
+MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(SpotifyException):
+    """Raised in replay mode when a request was never recorded"""
+
+    def __init__(self, key: str):
+        super().__init__(599, -1, f"no recorded response for {key}")
+        self.key = key
+
+
+class Cassette:
+    """Holds recorded Spotify calls, one gzipped JSON line per call"""
+
+    def __init__(self, path: Path, mode: str = "record"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+        # replay keeps a queue per key so repeated calls come back in order
+        self._replay: Dict[str, deque] = defaultdict(deque)
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._saved = False
+        self.hits = 0
+        self.misses = 0
+
+        if mode == "replay":
+            self._load()
+
+    @staticmethod
+    def make_key(method: str, url: str, payload: Any, params: Optional[Dict[str, Any]]) -> str:
+        # params and payload get sorted so dict ordering never changes the key
+        params_part = json.dumps(params or {}, sort_keys=True, default=str)
+        payload_part = json.dumps(payload, sort_keys=True, default=str) if payload else ""
+        return f"{method} {url} {params_part} {payload_part}".rstrip()
+
+    def _load(self):
+        if not self.path.exists():
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._entries.append(entry)
+                self._replay[entry['key']].append(entry)
+                self._last[entry['key']] = entry
+
+        logger.info(f"Loaded {len(self._entries)} recorded calls from {self.path.name}")
+
+    def record(self, key: str, status: int, body: Any = None, error: Optional[Dict[str, Any]] = None):
+        entry = {
+            'key': key,
+            'status': status,
+            'body': body,
+            'error': error,
+            'recorded_at': time.time()
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self._saved = False
+
+    def play(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            queue = self._replay.get(key)
+            if queue:
+                self.hits += 1
+                return queue.popleft()
+            # ran out of recorded copies - keep serving the last one
+            if key in self._last:
+                self.hits += 1
+                return self._last[key]
+            self.misses += 1
+        raise CassetteMiss(key)
+
+    def save(self) -> Optional[Path]:
+        if self.mode != "record":
+            return None
+
+        with self._lock:
+            if self._saved:
+                return self.path
+            entries = list(self._entries)
+            self._saved = True
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lines = b"".join(dumps(entry, compact=True) + b"\n" for entry in entries)
+        atomic_write(self.path, gzip.compress(lines, compresslevel=6))
+
+        logger.info(f"Cassette saved: {self.path} ({len(entries)} calls)")
+        return self.path
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def attach(sp: Spotify, cassette: Cassette) -> Spotify:
+    """Route every API call made through sp via the cassette"""
+    original_call = sp._internal_call
+    prefix = sp.prefix
+
+    def _cassette_call(method, url, payload, params):
+        full_url = url if url.startswith("http") else prefix + url
+        key = Cassette.make_key(method, full_url, payload, params)
+
+        if cassette.mode == "replay":
+            entry = cassette.play(key)
+            if entry.get('error'):
+                error = entry['error']
+                raise SpotifyException(
+                    entry['status'],
+                    error.get('code', -1),
+                    error.get('msg', ''),
+                    reason=error.get('reason')
+                )
+            # hand out a copy so callers can't mutate the recording
+            return copy.deepcopy(entry['body'])
+
+        try:
+            # spotipy strips content_type out of params, so give it its own copy
+            result = original_call(method, url, payload, dict(params or {}))
+        except SpotifyException as e:
+            cassette.record(key, e.http_status, error={
+                'code': e.code,
+                'msg': e.msg,
+                'reason': e.reason
+            })
+            raise
+        cassette.record(key, 200, body=result)
+        return result
+
+    sp._internal_call = _cassette_call
+    sp.cassette = cassette
+    return sp
+
+
+def replay_client(cassette: Cassette) -> Spotify:
+    """Spotify client that never touches the network or the token cache"""
+    return attach(Spotify(auth=None, requests_session=False), cassette)
+
+
+def default_cassette_path(name: str, cassette_dir: str = CASSETTE_DIR) -> Path:
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Path(cassette_dir) / f"{name}_{timestamp}{CASSETTE_SUFFIX}"
+
+
+def cassette_from_env(name: str) -> Optional[Cassette]:
+    """Build a cassette from SOUL_CASSETTE_MODE / SOUL_CASSETTE / SOUL_CASSETTE_DIR"""
+    mode = os.getenv("SOUL_CASSETTE_MODE", "off").lower()
+    if mode not in MODES:
+        logger.warning(f"Ignoring unknown SOUL_CASSETTE_MODE: {mode}")
+        return None
+    if mode == "off":
+        return None
+
+    path = os.getenv("SOUL_CASSETTE")
+    if mode == "replay" and not path:
+        raise ValueError("SOUL_CASSETTE must point at a cassette file in replay mode")
+
+    if path:
+        cassette_path = Path(path)
+    else:
+        cassette_path = default_cassette_path(name, os.getenv("SOUL_CASSETTE_DIR", CASSETTE_DIR))
+
+    return Cassette(cassette_path, mode)
+
+
+def attach_from_env(sp: Spotify, name: str) -> Spotify:
+    """For the small scripts - wraps sp if a cassette mode is set in the environment"""
+    cassette = cassette_from_env(name)
+    if cassette is None:
+        return sp
+    if cassette.mode == "record":
+        atexit.register(cassette.save)
+        logger.info(f"Recording Spotify calls to {cassette.path}")
+    else:
+        logger.info(f"Replaying Spotify calls from {cassette.path}")
+        sp = Spotify(auth=None, requests_session=False)
+    return attach(sp, cassette)
+
+
+def replay_extraction(cassette_path: Path, output_dir: Optional[str] = None, profile: bool = False) -> Dict[str, Any]:
+    """Run the full extraction pipeline offline against one cassette"""
+    # imported here so the cassette module stays usable without the extractor
+    from spotify_soul_extraction_base import ExtractionConfig, SpotifyDataExtractor
+
+    config = ExtractionConfig(
+        rate_limit_delay=0.0,
+        cassette_mode="replay",
+        cassette_path=str(cassette_path),
+        profile=profile
+    )
+    if output_dir:
+        config.output_dir = output_dir
+
+    start = time.perf_counter()
+    extractor = SpotifyDataExtractor(config)
+    data = extractor.extract_comprehensive_data()
+    validation_report = extractor.validate_extracted_data(data)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'cassette': str(cassette_path),
+        'user_id': data['extraction_metadata'].get('spotify_user_id'),
+        'quality_score': validation_report['data_quality_score'],
+        'seconds': elapsed,
+        'misses': extractor.cassette.misses
+    }
+    if output_dir:
+        with extractor.profiler.stage("save"):
+            result['output_file'] = str(extractor.save_data(data))
+    result['timings'] = extractor.profiler.report()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Spotify cassettes through the extractor")
+    parser.add_argument("cassettes", nargs="+", help="Cassette files or directories of cassettes")
+    parser.add_argument("--output-dir", help="Save replayed extractions here (default: don't save)")
+    parser.add_argument("--profile", action="store_true", help="cProfile each stage (needs --output-dir)")
+    parser.add_argument("--timings", action="store_true", help="Print where time went, aggregated over the batch")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.cassettes:
+        item_path = Path(item)
+        if item_path.is_dir():
+            paths.extend(sorted(item_path.glob(f"*{CASSETTE_SUFFIX}")))
+        else:
+            paths.append(item_path)
+
+    if not paths:
+        print("No cassettes found.")
+        return
+
+    batch_start = time.perf_counter()
+    failures = 0
+    timings = []
+    for cassette_path in paths:
+        try:
+            result = replay_extraction(cassette_path, args.output_dir, args.profile and bool(args.output_dir))
+            timings.append(result['timings'])
+            print(f"{cassette_path.name}: user={result['user_id']} "
+                  f"quality={result['quality_score']:.2f} "
+                  f"misses={result['misses']} {result['seconds'] * 1000:.1f} ms")
+        except Exception as e:
+            failures += 1
+            logger.error(f"Replay failed for {cassette_path.name}: {e}")
+
+    batch_time = time.perf_counter() - batch_start
+    print(f"\nReplayed {len(paths) - failures}/{len(paths)} cassettes in {batch_time:.2f} seconds "
+          f"({len(paths) / batch_time if batch_time else 0:.1f} users/sec)")
+    if args.timings and timings:
+        from soul_profiling import aggregate_timings, format_aggregate
+        print("\n" + format_aggregate(aggregate_timings(timings)))
+
+
+if __name__ == "__main__":
+    setup_logging(config=LoggingConfig(level="WARNING"))
+    main()
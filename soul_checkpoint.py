@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Checkpoints for in-progress extractions
+
+Every finished section, and every page of a paginated one, is committed to a
+per-user SQLite file as soon as it arrives. If the extraction dies (expired
+token, 429 storm, killed process) the next run for that user loads the
+finished sections, continues paging from the last stored offset and only
+calls the API for what's missing. The file is removed once the extraction
+has been saved, and ignored once it's older than max_age_hours - top items
+move, so a day-old half extraction isn't worth finishing.
+
+A daily run (50 saved tracks) and a full library run for the same user get
+separate files, and the settings a checkpoint was started with are stored
+in it. A run with different settings starts over instead of picking up
+sections fetched for another kind of run.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Iterable
+
+from soul_persist import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_SCOPE = "library"  # full library runs, kept apart from the daily ones
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sections (
+    name TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    saved_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    section TEXT NOT NULL,
+    page_offset INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (section, page_offset)
+);
+"""
+
+
+@dataclass
+class CheckpointConfig:
+    """Where checkpoints live and how long they stay resumable"""
+    checkpoint_dir: str = "checkpoints"
+    max_age_hours: float = 24.0
+
+
+def checkpoint_path(checkpoint_dir: str, user_id: str, scope: Optional[str] = None) -> Path:
+    return Path(checkpoint_dir) / f"checkpoint_{user_id}{'_' + scope if scope else ''}.db"
+
+
+class ExtractionCheckpoint:
+    """Finished sections and fetched pages of one user's running extraction"""
+
+    def __init__(self, path: Path, max_age_hours: Optional[float] = None, settings: Optional[Dict[str, Any]] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('started_at', ?)", (datetime.datetime.now().isoformat(),)
+            )
+        if max_age_hours is not None and self.age_hours() > max_age_hours:
+            logger.info(f"Checkpoint {self.path.name} is {self.age_hours():.1f}h old - starting over")
+            self.reset()
+        if settings is not None:
+            self._check_settings(settings)
+
+    @classmethod
+    def for_user(cls, user_id: str, config: Optional[CheckpointConfig] = None, scope: Optional[str] = None,
+                 settings: Optional[Dict[str, Any]] = None) -> "ExtractionCheckpoint":
+        config = config or CheckpointConfig()
+        return cls(checkpoint_path(config.checkpoint_dir, user_id, scope), config.max_age_hours, settings)
+
+    def _check_settings(self, settings: Dict[str, Any]):
+        # e.g. saved_tracks_limit - a 50-track section must never finish a full library run
+        encoded = json.dumps(settings, sort_keys=True)
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        if row and row[0] != encoded:
+            logger.info(f"Checkpoint {self.path.name} was started with {row[0]}, not {encoded} - starting over")
+            self.reset()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('settings', ?)", (encoded,))
+
+    def age_hours(self) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'started_at'").fetchone()
+        started = datetime.datetime.fromisoformat(row[0]) if row else datetime.datetime.now()
+        return (datetime.datetime.now() - started).total_seconds() / 3600
+
+    def reset(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sections")
+            self._conn.execute("DELETE FROM pages")
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('started_at', ?)",
+                               (datetime.datetime.now().isoformat(),))
+
+    # -- whole sections ----------------------------------------------------
+
+    def load_section(self, name: str) -> Optional[Any]:
+        """The stored payload for a finished section, None if it still has to be fetched"""
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM sections WHERE name = ?", (name,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def save_section(self, name: str, payload: Any):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO sections VALUES (?, ?, ?)",
+                               (name, dumps(payload, compact=True), datetime.datetime.now().isoformat()))
+            # the combined section supersedes its pages
+            self._conn.execute("DELETE FROM pages WHERE section = ?", (name,))
+
+    def completed(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM sections ORDER BY saved_at")]
+
+    def invalidate(self, names: Iterable[str]):
+        """Forget sections (and their pages) so the next run fetches them again"""
+        names = list(names)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM sections WHERE name = ?", [(n,) for n in names])
+            self._conn.executemany("DELETE FROM pages WHERE section = ?", [(n,) for n in names])
+
+    # -- pages of a paginated section --------------------------------------
+
+    def save_page(self, section: str, offset: int, page: Dict[str, Any]):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                               (section, offset, dumps(page, compact=True)))
+
+    def load_pages(self, section: str) -> List[Dict[str, Any]]:
+        """Stored pages in offset order - resume from the last one's offset + len(items)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM pages WHERE section = ? ORDER BY page_offset", (section,)
+            ).fetchall()
+        return [loads(row[0]) for row in rows]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pages = dict(self._conn.execute(
+                "SELECT section, COUNT(*) FROM pages GROUP BY section"
+            ).fetchall())
+        return {'path': str(self.path), 'age_hours': round(self.age_hours(), 2),
+                'completed_sections': self.completed(), 'pending_pages': pages}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def discard(self):
+        """Extraction saved - the checkpoint has done its job"""
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(str(self.path) + suffix).unlink(missing_ok=True)
+        logger.info(f"Checkpoint {self.path.name} removed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear extraction checkpoints")
+    parser.add_argument("--dir", default=CheckpointConfig.checkpoint_dir)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Checkpoints waiting to be resumed")
+    clear = sub.add_parser("clear", help="Drop a user's checkpoint so the next run starts fresh")
+    clear.add_argument("user_id")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for path in sorted(Path(args.dir).glob("checkpoint_*.db")):
+            checkpoint = ExtractionCheckpoint(path)
+            status = checkpoint.status()
+            checkpoint.close()
+            pages = ", ".join(f"{name}: {count} pages" for name, count in status['pending_pages'].items())
+            print(f"{path.stem[len('checkpoint_'):]:<30} {status['age_hours']:>6.1f}h  "
+                  f"{len(status['completed_sections'])} sections done{'  (' + pages + ')' if pages else ''}")
+    else:
+        paths = [checkpoint_path(args.dir, args.user_id, scope) for scope in (None, LIBRARY_SCOPE)]
+        if not any(path.exists() for path in paths):
+            print(f"No checkpoint for {args.user_id}")
+            return 1
+        for path in paths:
+            if path.exists():
+                ExtractionCheckpoint(path).discard()
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
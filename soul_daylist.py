@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+"""
+Daylists for every user, built from their extractions
+
+daylist_fuck_face/update_daylist.py publishes one hand-picked URI list to one
+browser-authenticated account. Here each user's daylist comes from their
+latest extraction (via the manifest) and its analytics. Recency-weighted
+favourites, plays from the current part of the day, current top tracks and
+recent saves are interleaved, deduped and capped per artist. It's then
+published with that user's own token from tokens/.
+
+- users are published concurrently by a thread pool, all drawing on one
+  shared RateLimiter (the app's rate limit is shared, not per user). A 429
+  pauses every worker
+- playlist writes are batched: one replace for the first 100 tracks, one add
+  per further 100, so a 50-track daylist costs two calls
+- the playlist id and a fingerprint of what was last published are kept per
+  user, so an unchanged daylist costs nothing and there's no playlist listing
+  after the first run
+- a run has a deadline. Users it didn't get to stay pending in the run table,
+  and `resume` picks them up (along with failures, up to max_attempts)
+"""
+
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice, zip_longest
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Callable, Iterable
+
+import requests
+from spotipy import Spotify
+from spotipy.oauth2 import SpotifyOAuth
+from spotipy.exceptions import SpotifyException
+
+from soul_analytics import AnalyticsConfig, SoulAnalytics
+from soul_manifest import ExtractionManifest
+from soul_persist import read_json
+from soul_reader import ExtractionReader
+from soul_resilience import (Deadline, DeadlineExceeded, CircuitOpenError, RateLimiter, breakers,
+                             is_transient, retry_after, spotify_session)
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PUBLISHED = "published"
+UNCHANGED = "unchanged"
+SKIPPED = "skipped"  # nothing to publish or no usable token - retrying won't help
+FAILED = "failed"
+
+BATCH_SIZE = 100  # most tracks one playlist write may carry
+TOKEN_PATTERN = re.compile(r"spotify_token_(.+)_\d{8}_\d{6}\.json")
+
+# (first hour, name) - plays are bucketed in the publisher's local time
+DAYPARTS = [(0, "late night"), (5, "morning"), (12, "afternoon"), (17, "evening"), (22, "late night")]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    playlist_name TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS run_users (
+    run_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    tracks INTEGER,
+    calls INTEGER,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (run_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    user_id TEXT NOT NULL,
+    playlist_name TEXT NOT NULL,
+    playlist_id TEXT NOT NULL,
+    fingerprint TEXT,
+    published_at REAL,
+    PRIMARY KEY (user_id, playlist_name)
+);
+"""
+
+
+@dataclass
+class DaylistConfig:
+    """What goes into a daylist and how a cohort gets published"""
+    playlist_name: str = "Soul daylist"
+    public: bool = False
+    size: int = 50
+    max_per_artist: int = 3
+    token_dir: str = "tokens"
+    output_dir: str = "data"  # where the extraction manifest lives
+    db_path: str = "jobs/daylist.db"
+    analytics_cache_dir: str = "analytics/cache"
+    workers: int = 8
+    requests_per_second: float = 5.0  # across all workers
+    burst: int = 5
+    deadline_seconds: Optional[float] = 900.0  # whole run, None for no limit
+    call_timeout: float = 10.0
+    max_retries: int = 3
+    backoff_seconds: float = 1.0
+    max_attempts: int = 3  # per user across resumes
+    build_chunk: int = 16  # users whose extractions are loaded and analysed together
+    force: bool = False  # rewrite playlists even when the daylist hasn't changed
+
+
+# -- building ---------------------------------------------------------------
+
+def daypart(hour: int) -> str:
+    name = DAYPARTS[0][1]
+    for first_hour, part in DAYPARTS:
+        if hour >= first_hour:
+            name = part
+    return name
+
+
+def _items(payload: Any) -> List[Dict[str, Any]]:
+    if isinstance(payload, dict):
+        return payload.get('items') or []
+    return payload or []
+
+
+def _played_hour(played_at: Optional[str]) -> Optional[int]:
+    try:
+        return datetime.datetime.fromisoformat(played_at.replace("Z", "+00:00")).astimezone().hour
+    except (AttributeError, ValueError):
+        return None
+
+
+def build_daylist(data: Dict[str, Any], analytics: Optional[Dict[str, Any]], config: DaylistConfig,
+                  now: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """Track URIs for one user's daylist - sources are interleaved so each gets a share"""
+    now = now or datetime.datetime.now()
+    part = daypart(now.hour)
+
+    tracks: Dict[str, Dict[str, Any]] = {}
+
+    def collect(items: Iterable[Dict[str, Any]]) -> List[str]:
+        ids = []
+        for item in items:
+            track = (item or {}).get('track', item) if item else None
+            if not track or not track.get('id') or track.get('is_local'):
+                continue
+            tracks.setdefault(track['id'], track)
+            ids.append(track['id'])
+        return ids
+
+    top = {time_range: collect(_items(payload)) for time_range, payload in (data.get('top_tracks') or {}).items()}
+    plays = _items(data.get('recent_tracks'))
+    recent = collect(plays)
+    this_part = collect(play for play in plays
+                        if play and (hour := _played_hour(play.get('played_at'))) is not None and daypart(hour) == part)
+    saved = collect(_items(data.get('saved_tracks')))
+    # analytics ids come from the same extraction, so they're all in tracks already
+    favourites = [item['id'] for item in ((analytics or {}).get('top_scores') or {}).get('tracks', [])
+                  if item.get('id') in tracks]
+
+    sources = [favourites, this_part, top.get('short_term', []), saved,
+               top.get('medium_term', []), recent, top.get('long_term', [])]
+    uris = []
+    seen = set()
+    per_artist: Dict[str, int] = {}
+    for track_id in (track_id for round_ in zip_longest(*sources) for track_id in round_ if track_id):
+        if track_id in seen:
+            continue
+        seen.add(track_id)
+        track = tracks[track_id]
+        artists = track.get('artists') or [{}]
+        artist = artists[0].get('id') or artists[0].get('name') or ""
+        if per_artist.get(artist, 0) >= config.max_per_artist:
+            continue
+        per_artist[artist] = per_artist.get(artist, 0) + 1
+        uris.append(track.get('uri') or f"spotify:track:{track_id}")
+        if len(uris) >= config.size:
+            break
+
+    return {
+        'uris': uris,
+        'daypart': part,
+        'description': f"Your {part} daylist, from what you've been playing - updated {now:%b %d, %H:%M}"
+    }
+
+
+def load_sources(path: str, saved_limit: int) -> Dict[str, Any]:
+    """The parts of an extraction a daylist (and its analytics) reads
+
+    Full-library extractions are mostly saved tracks and only the newest few
+    can make it in, so the rest is never decoded.
+    """
+    data: Dict[str, Any] = {}
+    with ExtractionReader(path) as reader:
+        sections = reader.sections()
+        for name in ('extraction_metadata', 'user_profile', 'top_tracks', 'top_artists', 'recent_tracks'):
+            if name in sections:
+                data[name] = reader.section(name)
+        if 'saved_tracks' in sections:
+            # saved tracks come newest first
+            data['saved_tracks'] = {'items': list(islice(reader.iter_items('saved_tracks'), saved_limit))}
+    return data
+
+
+def fingerprint(uris: List[str]) -> str:
+    return hashlib.sha256("\n".join(uris).encode('utf-8')).hexdigest()
+
+
+def latest_tokens(token_dir: str) -> Dict[str, Path]:
+    """Newest token file per user - the timestamp in the name sorts, ctime doesn't survive copies"""
+    tokens: Dict[str, Path] = {}
+    directory = Path(token_dir)
+    if not directory.exists():
+        return tokens
+    for token_file in sorted(directory.glob("spotify_token_*.json"), key=lambda path: path.name):
+        match = TOKEN_PATTERN.fullmatch(token_file.name)
+        if match:
+            tokens[match.group(1)] = token_file
+    return tokens
+
+
+def token_scopes(token_file: Path) -> set:
+    try:
+        return set((read_json(token_file).get('scope') or "").split())
+    except (OSError, ValueError):
+        return set()
+
+
+# -- state ------------------------------------------------------------------
+
+class DaylistStore:
+    """Runs, per-user progress within a run and each user's published playlist"""
+
+    def __init__(self, db_path: str):
+        path = Path(db_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def create_run(self, playlist_name: str, user_ids: List[str]) -> str:
+        run_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO runs (run_id, playlist_name, started_at) VALUES (?, ?, ?)",
+                               (run_id, playlist_name, now))
+            self._conn.executemany("INSERT INTO run_users (run_id, user_id, status, updated_at) VALUES (?, ?, ?, ?)",
+                                   [(run_id, user_id, PENDING, now) for user_id in user_ids])
+        return run_id
+
+    def run(self, run_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """A run by id, or the newest one"""
+        with self._lock:
+            if run_id:
+                row = self._conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT * FROM runs ORDER BY started_at DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+    def remaining(self, run_id: str, max_attempts: int) -> List[str]:
+        """Users still to do - never started, or failed with attempts left"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id FROM run_users WHERE run_id = ? AND (status = ? OR (status = ? AND attempts < ?)) "
+                "ORDER BY user_id", (run_id, PENDING, FAILED, max_attempts)
+            ).fetchall()
+        return [row['user_id'] for row in rows]
+
+    def finish_user(self, run_id: str, user_id: str, status: str, tracks: Optional[int] = None,
+                    calls: int = 0, error: Optional[str] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE run_users SET status = ?, attempts = attempts + 1, tracks = ?, calls = ?, error = ?, "
+                "updated_at = ? WHERE run_id = ? AND user_id = ?",
+                (status, tracks, calls, error, time.time(), run_id, user_id)
+            )
+
+    def finish_run(self, run_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def counts(self, run_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*), COALESCE(SUM(calls), 0) FROM run_users WHERE run_id = ? GROUP BY status",
+                (run_id,)
+            ).fetchall()
+        counts = {row[0]: row[1] for row in rows}
+        counts['api_calls'] = sum(row[2] for row in rows)
+        return counts
+
+    def failures(self, run_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, status, attempts, error FROM run_users WHERE run_id = ? AND status IN (?, ?) "
+                "ORDER BY user_id", (run_id, FAILED, SKIPPED)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def playlist(self, user_id: str, playlist_name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM playlists WHERE user_id = ? AND playlist_name = ?",
+                                     (user_id, playlist_name)).fetchone()
+        return dict(row) if row else None
+
+    def save_playlist(self, user_id: str, playlist_name: str, playlist_id: str, published: Optional[str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?)",
+                (user_id, playlist_name, playlist_id, published, time.time() if published else None)
+            )
+
+
+# -- publishing -------------------------------------------------------------
+
+ClientFactory = Callable[[str, Path, str, float], Spotify]
+
+
+def token_client(user_id: str, token_file: Path, scope: str, timeout: float) -> Spotify:
+    """A client on the user's own token - refreshes are written back to the same file
+
+    scope has to be covered by the token's, or spotipy decides the cached
+    token won't do and starts an interactive login.
+    """
+    sp = Spotify(auth_manager=SpotifyOAuth(
+        scope=scope,
+        client_id=os.getenv("SPOTIPY_CLIENT_ID"),
+        client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
+        redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI"),
+        cache_path=str(token_file),
+        open_browser=False,
+        requests_timeout=timeout
+    ), requests_timeout=timeout, requests_session=spotify_session())
+    if os.getenv("SPOTIFY_API_URL"):
+        # staging / rehearsals against a stand-in (see soul_loadtest)
+        sp.prefix = f"{os.getenv('SPOTIFY_API_URL').rstrip('/')}/"
+    return sp
+
+
+class DaylistPublisher:
+    """Builds and publishes daylists for a cohort of users, one resumable run at a time"""
+
+    def __init__(self, config: Optional[DaylistConfig] = None, client_factory: Optional[ClientFactory] = None):
+        self.config = config or DaylistConfig()
+        self.client_factory = client_factory or token_client
+        self.store = DaylistStore(self.config.db_path)
+        self.manifest = ExtractionManifest.for_output_dir(self.config.output_dir)
+        self.analytics = SoulAnalytics(AnalyticsConfig(cache_dir=self.config.analytics_cache_dir))
+        self.limiter = RateLimiter(self.config.requests_per_second, self.config.burst)
+        self.breaker = breakers.get("playlists")
+
+    def cohort(self, user_ids: Optional[List[str]] = None) -> List[str]:
+        """Users with both a token and an extraction"""
+        tokens = latest_tokens(self.config.token_dir)
+        candidates = user_ids if user_ids else sorted(tokens)
+        return [user_id for user_id in candidates if user_id in tokens and self.manifest.latest(user_id)]
+
+    def start(self, user_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        users = self.cohort(user_ids)
+        run_id = self.store.create_run(self.config.playlist_name, users)
+        logger.info(f"Daylist run {run_id}: {len(users)} users")
+        return self.resume(run_id)
+
+    def resume(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        run = self.store.run(run_id)
+        if not run:
+            raise ValueError(f"No daylist run {run_id or 'to resume'}")
+        run_id = run['run_id']
+        if run['playlist_name'] != self.config.playlist_name:
+            logger.info(f"Run {run_id} publishes '{run['playlist_name']}'")
+            self.config.playlist_name = run['playlist_name']
+
+        started = time.monotonic()
+        deadline = Deadline(self.config.deadline_seconds)
+        users = self.store.remaining(run_id, self.config.max_attempts)
+        tokens = latest_tokens(self.config.token_dir)
+        with ThreadPoolExecutor(max_workers=self.config.workers, thread_name_prefix="daylist") as pool:
+            for start in range(0, len(users), self.config.build_chunk):
+                if deadline.expired():
+                    break
+                # the pool publishes the previous chunk while this one is built
+                for user_id, daylist in self._build(users[start:start + self.config.build_chunk], deadline).items():
+                    pool.submit(self._publish_safely, run_id, user_id, tokens.get(user_id), daylist, deadline)
+
+        left = self.store.remaining(run_id, self.config.max_attempts)
+        if not left:
+            self.store.finish_run(run_id)
+        summary = {
+            'run_id': run_id,
+            'users': len(users),
+            'counts': self.store.counts(run_id),
+            'remaining': len(left),
+            'seconds': round(time.monotonic() - started, 1)
+        }
+        logger.info(f"Daylist run {run_id}: {summary['counts']}, {len(left)} left")
+        return summary
+
+    def _build(self, user_ids: List[str], deadline: Optional[Deadline] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Daylists for a chunk of users - one analytics pass for all of them
+
+        None for users without a usable extraction. Users left out once the
+        deadline passes aren't in the result at all, they stay pending.
+        """
+        snapshots = {}
+        built = []
+        for user_id in user_ids:
+            if deadline and deadline.expired():
+                break
+            built.append(user_id)
+            entry = self.manifest.latest(user_id)
+            if not entry:
+                continue
+            try:
+                data = load_sources(entry['path'], self.config.size)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"No usable extraction for {user_id}: {e}")
+                continue
+            # the file's sha256 - the same key soul_analytics caches the full extraction under
+            snapshots[user_id] = (entry['sha256'], data)
+        analytics = self.analytics.analyze_many({snapshot: data for snapshot, data in snapshots.values()})
+        now = datetime.datetime.now()
+        daylists: Dict[str, Optional[Dict[str, Any]]] = {}
+        for user_id in built:
+            if user_id in snapshots:
+                snapshot, data = snapshots[user_id]
+                daylists[user_id] = build_daylist(data, analytics.get(snapshot), self.config, now)
+            else:
+                daylists[user_id] = None
+        return daylists
+
+    def _publish_safely(self, run_id: str, user_id: str, token_file: Optional[Path],
+                        daylist: Optional[Dict[str, Any]], deadline: Deadline):
+        if deadline.expired():
+            return  # stays pending for the next resume
+        calls = [0]
+        try:
+            status, error = self._publish(user_id, token_file, daylist, deadline, calls)
+        except DeadlineExceeded:
+            logger.info(f"Out of time before {user_id}'s daylist was written")
+            # only counts as an attempt if something was sent
+            if calls[0]:
+                self.store.finish_user(run_id, user_id, FAILED, calls=calls[0], error="deadline")
+            return
+        except (CircuitOpenError, SpotifyException, requests.exceptions.RequestException) as e:
+            status, error = FAILED, str(e)
+        except Exception as e:
+            logger.exception(f"Daylist for {user_id} failed")
+            status, error = FAILED, f"{type(e).__name__}: {e}"
+        if status == FAILED:
+            logger.warning(f"Daylist for {user_id} failed: {error}")
+        self.store.finish_user(run_id, user_id, status, tracks=len(daylist['uris']) if daylist else None,
+                               calls=calls[0], error=error)
+
+    def _publish(self, user_id: str, token_file: Optional[Path], daylist: Optional[Dict[str, Any]],
+                 deadline: Deadline, calls: List[int]) -> tuple:
+        if not daylist or not daylist['uris']:
+            return SKIPPED, "no tracks in the extraction"
+        if token_file is None:
+            return SKIPPED, "no token"
+        scopes = token_scopes(token_file)
+        needed = "playlist-modify-public" if self.config.public else "playlist-modify-private"
+        # without it spotipy would fall back to an interactive login
+        if needed not in scopes:
+            return SKIPPED, f"token lacks {needed} - the user has to sign in again"
+
+        name = self.config.playlist_name
+        uris = daylist['uris']
+        published = fingerprint(uris)
+        known = self.store.playlist(user_id, name)
+        if known and known['fingerprint'] == published and not self.config.force:
+            return UNCHANGED, None
+
+        sp = self.client_factory(user_id, token_file, needed, self.config.call_timeout)
+
+        def call(operation: str, func):
+            return self._call(sp, operation, func, deadline, calls)
+
+        playlist_id = known['playlist_id'] if known else None
+        if not playlist_id and "playlist-read-private" in scopes:
+            playlist_id = self._find_playlist(sp, call, user_id)
+        if not playlist_id:
+            playlist_id = self._create_playlist(sp, call, user_id, daylist['description'])
+        self.store.save_playlist(user_id, name, playlist_id, None)
+
+        try:
+            call("replace", lambda: sp.playlist_replace_items(playlist_id, uris[:BATCH_SIZE]))
+        except SpotifyException as e:
+            if e.http_status != 404:
+                raise
+            # deleted (unfollowed and gone) since we last wrote it
+            logger.info(f"{user_id}'s daylist playlist {playlist_id} is gone, creating a new one")
+            playlist_id = self._create_playlist(sp, call, user_id, daylist['description'])
+            self.store.save_playlist(user_id, name, playlist_id, None)
+            call("replace", lambda: sp.playlist_replace_items(playlist_id, uris[:BATCH_SIZE]))
+        for start in range(BATCH_SIZE, len(uris), BATCH_SIZE):
+            call("add", lambda: sp.playlist_add_items(playlist_id, uris[start:start + BATCH_SIZE]))
+        call("details", lambda: sp.playlist_change_details(playlist_id, description=daylist['description']))
+        self.store.save_playlist(user_id, name, playlist_id, published)
+        logger.debug("Published %d tracks to %s for %s", len(uris), playlist_id, user_id)
+        return PUBLISHED, None
+
+    def _find_playlist(self, sp: Spotify, call, user_id: str) -> Optional[str]:
+        """An existing playlist of ours with the daylist's name (only when the store lost track of it)"""
+        page = call("list", lambda: sp.current_user_playlists(limit=50))
+        while page:
+            for item in page.get('items') or []:
+                if item and item.get('name') == self.config.playlist_name and \
+                        (item.get('owner') or {}).get('id') == user_id:
+                    return item['id']
+            if not page.get('next'):
+                return None
+            page = call("list", lambda: sp.next(page))
+        return None
+
+    def _create_playlist(self, sp: Spotify, call, user_id: str, description: str) -> str:
+        playlist = call("create", lambda: sp.user_playlist_create(
+            user_id, self.config.playlist_name, public=self.config.public, description=description))
+        logger.info(f"Created daylist playlist {playlist['id']} for {user_id}")
+        return playlist['id']
+
+    def _call(self, sp: Spotify, operation: str, func, deadline: Deadline, calls: List[int]):
+        """One playlist call through the shared limiter and breaker, retrying transient errors"""
+        for attempt in range(self.config.max_retries):
+            timeout = deadline.call_timeout(self.config.call_timeout)
+            if timeout is None or not self.limiter.acquire(deadline):
+                raise DeadlineExceeded(f"no time left for {operation}")
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"circuit {self.breaker.name} open")
+            sp.requests_timeout = timeout  # one client per user, so no other thread shares it
+            calls[0] += 1
+            try:
+                result = func()
+            except (SpotifyException, requests.exceptions.RequestException) as e:
+                transient = is_transient(e)
+                self.breaker.record(not transient)
+                if not transient or attempt == self.config.max_retries - 1:
+                    raise
+                wait = retry_after(e)
+                if wait:
+                    # the rate limit is the app's - every worker waits, not just this one
+                    logger.warning(f"Rate limited on {operation}, pausing all workers for {wait:.0f}s")
+                    self.limiter.pause(wait)
+                    continue
+                delay = self.config.backoff_seconds * 2 ** attempt
+                if delay >= deadline.remaining():
+                    raise DeadlineExceeded(f"no time left to retry {operation}")
+                logger.debug("Retrying %s in %.1fs after %s", operation, delay, e)
+                time.sleep(delay)
+                continue
+            self.breaker.record(True)
+            return result
+        raise DeadlineExceeded(f"{operation} kept failing")  # not reached - the last attempt raises
+
+    def close(self):
+        self.store.close()
+        self.manifest.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and publish daylists for every user with a token and an extraction")
+    parser.add_argument("--db", default=DaylistConfig.db_path)
+    parser.add_argument("--name", default=DaylistConfig.playlist_name, help="Playlist name")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Start a new run for the cohort")
+    run.add_argument("--users", nargs="+", help="Only these users (default: everyone with a token)")
+    run.add_argument("--limit", type=int, help="At most this many users")
+    resume = sub.add_parser("resume", help="Finish a run - pending users and failures with attempts left")
+    resume.add_argument("run_id", nargs="?", help="Defaults to the newest run")
+    for command in (run, resume):
+        command.add_argument("--workers", type=int, default=DaylistConfig.workers)
+        command.add_argument("--rate", type=float, default=DaylistConfig.requests_per_second,
+                             help="API calls per second across all workers")
+        command.add_argument("--deadline", type=float, default=DaylistConfig.deadline_seconds,
+                             help="Seconds for the whole run, 0 for no limit")
+        command.add_argument("--public", action="store_true")
+        command.add_argument("--force", action="store_true", help="Rewrite playlists that haven't changed")
+    status = sub.add_parser("status", help="Counts and failures for a run")
+    status.add_argument("run_id", nargs="?")
+    preview = sub.add_parser("preview", help="Print a user's daylist without publishing it")
+    preview.add_argument("user_id")
+    args = parser.parse_args()
+
+    config = DaylistConfig(db_path=args.db, playlist_name=args.name)
+    if args.command in ("run", "resume"):
+        config.workers = args.workers
+        config.requests_per_second = args.rate
+        config.burst = max(1, int(args.rate))
+        config.deadline_seconds = args.deadline or None
+        config.public = args.public
+        config.force = args.force
+    publisher = DaylistPublisher(config)
+
+    try:
+        if args.command == "preview":
+            daylist = publisher._build([args.user_id])[args.user_id]
+            if not daylist:
+                print(f"No extraction for {args.user_id}")
+                return 1
+            print(daylist['description'])
+            for uri in daylist['uris']:
+                print(f"  {uri}")
+            return 0
+        if args.command == "status":
+            run_info = publisher.store.run(args.run_id)
+            if not run_info:
+                print("No daylist runs yet")
+                return 1
+            summary = {'run_id': run_info['run_id'], 'counts': publisher.store.counts(run_info['run_id']),
+                       'remaining': len(publisher.store.remaining(run_info['run_id'], config.max_attempts))}
+        elif args.command == "run":
+            users = publisher.cohort(args.users)
+            summary = publisher.start(users[:args.limit] if args.limit else users)
+        else:
+            summary = publisher.resume(args.run_id)
+
+        counts = summary['counts']
+        print(f"Run {summary['run_id']}: " + ", ".join(f"{count} {status}" for status, count in counts.items()))
+        if 'seconds' in summary:
+            print(f"  {summary['users']} users attempted in {summary['seconds']}s")
+        for failure in publisher.store.failures(summary['run_id']):
+            print(f"  {failure['user_id']:<28} {failure['status']:<8} {failure['error']}")
+        if summary['remaining']:
+            print(f"{summary['remaining']} users left - `python soul_daylist.py resume {summary['run_id']}` picks them up")
+        return 0
+    finally:
+        publisher.close()
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
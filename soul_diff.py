@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Diff top-item rankings between extractions
+
+For each top_tracks / top_artists time range: rank moves, entries, exits and
+the shift in genre share. Rankings become id -> rank dicts, so a diff is
+linear in the number of items. Diffs are stored per (old, new) file hash, so
+a user's series or a whole cohort is only ever diffed once per pair, and only
+the top_* sections of each file are parsed.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Union
+
+from soul_analytics import TIME_RANGES, _items, _genres, _track_artists
+from soul_reader import ExtractionReader
+from soul_persist import write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+DIFF_VERSION = "2"
+DIFF_SECTIONS = ('top_tracks', 'top_artists')
+
+
+@dataclass
+class DiffConfig:
+    """Where diffs are stored and how much detail they keep"""
+    cache_dir: str = "analytics/diffs"
+    min_genre_shift: float = 0.005  # ignore genre share changes smaller than half a percent
+    data_dir: str = "data"
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_rankings(path: Union[str, Path]) -> Dict[str, Any]:
+    """Just the parts a diff needs, read section by section"""
+    with ExtractionReader(path) as reader:
+        sections = reader.sections()
+        snapshot = {
+            'extraction_metadata': reader.section('extraction_metadata') if 'extraction_metadata' in sections else {}
+        }
+        for section in DIFF_SECTIONS:
+            snapshot[section] = reader.section(section) if section in sections else {}
+    return snapshot
+
+
+def _item_key(item: Dict[str, Any]) -> str:
+    # processed files have no ids - fall back to the name
+    return item.get('id') or f"name:{item.get('name')}"
+
+
+def rank_map(items: List[Dict[str, Any]]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    return {_item_key(item): (rank, item) for rank, item in enumerate(items) if item}
+
+
+def _label(item: Dict[str, Any]) -> Dict[str, Any]:
+    label = {'id': _item_key(item), 'name': item.get('name')}
+    if item.get('artists') or item.get('artist'):
+        label['artist'] = _track_artists(item)
+    return label
+
+
+def diff_rankings(old_items: List[Dict[str, Any]], new_items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Entries, exits and rank moves between two ranked lists (ranks are 1-based in the output)"""
+    old_ranks = rank_map(old_items)
+    new_ranks = rank_map(new_items)
+
+    entries = []
+    moves = []
+    unchanged = 0
+    for key, (new_rank, item) in new_ranks.items():
+        previous = old_ranks.get(key)
+        if previous is None:
+            entries.append({**_label(item), 'rank': new_rank + 1})
+        elif previous[0] != new_rank:
+            # positive delta = climbed
+            moves.append({**_label(item), 'old_rank': previous[0] + 1, 'rank': new_rank + 1,
+                          'delta': previous[0] - new_rank})
+        else:
+            unchanged += 1
+
+    exits = [{**_label(item), 'old_rank': old_rank + 1}
+             for key, (old_rank, item) in old_ranks.items() if key not in new_ranks]
+    moves.sort(key=lambda move: -abs(move['delta']))
+
+    return {
+        'entries': entries,
+        'exits': exits,
+        'moves': moves,
+        'unchanged': unchanged,
+        'turnover': round(len(entries) / len(new_ranks), 4) if new_ranks else 0.0
+    }
+
+
+def genre_shares(artists: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Rank-weighted genre share, same weighting as soul_analytics"""
+    size = len(artists)
+    weights: Dict[str, float] = defaultdict(float)
+    for rank, artist in enumerate(artists):
+        if not artist:
+            continue
+        for genre in _genres(artist):
+            weights[genre] += (size - rank) / size
+    total = sum(weights.values())
+    return {genre: weight / total for genre, weight in weights.items()} if total else {}
+
+
+def genre_shift(old_artists: List[Dict[str, Any]], new_artists: List[Dict[str, Any]],
+                min_shift: float) -> Dict[str, float]:
+    old_shares = genre_shares(old_artists)
+    new_shares = genre_shares(new_artists)
+    shifts = {
+        genre: round(new_shares.get(genre, 0.0) - old_shares.get(genre, 0.0), 4)
+        for genre in old_shares.keys() | new_shares.keys()
+    }
+    return dict(sorted(
+        ((genre, shift) for genre, shift in shifts.items() if abs(shift) >= min_shift),
+        key=lambda pair: -abs(pair[1])
+    ))
+
+
+def diff_snapshots(old: Dict[str, Any], new: Dict[str, Any], config: Optional[DiffConfig] = None) -> Dict[str, Any]:
+    config = config or DiffConfig()
+    result: Dict[str, Any] = {
+        'diff_version': DIFF_VERSION,
+        'from_timestamp': (old.get('extraction_metadata') or {}).get('timestamp'),
+        'to_timestamp': (new.get('extraction_metadata') or {}).get('timestamp'),
+        'genre_shift': {}
+    }
+    for section in DIFF_SECTIONS:
+        result[section] = {}
+        for time_range in TIME_RANGES:
+            old_items = _items((old.get(section) or {}).get(time_range))
+            new_items = _items((new.get(section) or {}).get(time_range))
+            if not old_items and not new_items:
+                continue
+            result[section][time_range] = diff_rankings(old_items, new_items)
+            if section == 'top_artists':
+                result['genre_shift'][time_range] = genre_shift(old_items, new_items, config.min_genre_shift)
+    return result
+
+
+class DiffStore:
+    """One compact JSON per (old, new) pair of file hashes"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, old_hash: str, new_hash: str) -> Path:
+        return self.cache_dir / f"{old_hash[:16]}_{new_hash[:16]}.v{DIFF_VERSION}.json"
+
+    def get(self, old_hash: str, new_hash: str) -> Optional[Dict[str, Any]]:
+        path = self._path(old_hash, new_hash)
+        if not path.exists():
+            return None
+        try:
+            return read_json(path)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Ignoring unreadable diff {path.name}: {e}")
+            return None
+
+    def put(self, old_hash: str, new_hash: str, diff: Dict[str, Any]):
+        write_json(self._path(old_hash, new_hash), diff, compact=True, fsync=False)
+
+
+class SnapshotDiffer:
+    """Stored diffs for pairs, series and cohorts"""
+
+    def __init__(self, config: Optional[DiffConfig] = None):
+        self.config = config or DiffConfig()
+        self.store = DiffStore(self.config.cache_dir)
+
+    def diff_pairs(self, pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Diff (old, new) entries with 'path' and 'sha256' - each file is parsed at most once"""
+        loaded: Dict[str, Dict[str, Any]] = {}
+        # drop a parsed file once its last pair is done - series only ever need two at a time
+        remaining: Dict[str, int] = defaultdict(int)
+        for old, new in pairs:
+            remaining[old['sha256']] += 1
+            remaining[new['sha256']] += 1
+        results = []
+        computed = 0
+        for old, new in pairs:
+            diff = self.store.get(old['sha256'], new['sha256'])
+            if diff is None:
+                for entry in (old, new):
+                    if entry['sha256'] not in loaded:
+                        loaded[entry['sha256']] = load_rankings(entry['path'])
+                diff = diff_snapshots(loaded[old['sha256']], loaded[new['sha256']], self.config)
+                diff['from_hash'] = old['sha256']
+                diff['to_hash'] = new['sha256']
+                self.store.put(old['sha256'], new['sha256'], diff)
+                computed += 1
+            diff['user_id'] = new.get('user_id')
+            results.append(diff)
+            for entry in (old, new):
+                remaining[entry['sha256']] -= 1
+                if not remaining[entry['sha256']]:
+                    loaded.pop(entry['sha256'], None)
+        logger.info(f"Diffed {len(pairs)} pairs ({computed} computed, {len(pairs) - computed} stored)")
+        return results
+
+    def diff_files(self, old_path: Union[str, Path], new_path: Union[str, Path]) -> Dict[str, Any]:
+        old = {'path': str(old_path), 'sha256': file_hash(old_path)}
+        new = {'path': str(new_path), 'sha256': file_hash(new_path)}
+        return self.diff_pairs([(old, new)])[0]
+
+    def _manifest(self):
+        from soul_manifest import ExtractionManifest
+        return ExtractionManifest.for_output_dir(self.config.data_dir)
+
+    def diff_series(self, user_id: str, since: str = "") -> List[Dict[str, Any]]:
+        """Consecutive diffs across one user's extractions"""
+        entries = self._manifest().since(since, user_id)
+        return self.diff_pairs(list(zip(entries, entries[1:])))
+
+    def diff_cohort(self, since: str = "") -> Dict[str, List[Dict[str, Any]]]:
+        """Consecutive diffs for every user, in one pass over the manifest"""
+        by_user: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for entry in self._manifest().since(since):
+            by_user[entry['user_id']].append(entry)
+
+        pairs = [pair for entries in by_user.values() for pair in zip(entries, entries[1:])]
+        grouped: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for diff in self.diff_pairs(pairs):
+            grouped[diff['user_id']].append(diff)
+        return dict(grouped)
+
+
+def format_diff(diff: Dict[str, Any], limit: int = 5) -> str:
+    lines = [f"Changes {diff.get('from_timestamp') or '?'} -> {diff.get('to_timestamp') or '?'}"]
+    for section in DIFF_SECTIONS:
+        for time_range, ranking in diff.get(section, {}).items():
+            lines.append(f"\n{section} ({time_range}): {len(ranking['entries'])} new, "
+                         f"{len(ranking['exits'])} gone, {len(ranking['moves'])} moved")
+            for entry in ranking['entries'][:limit]:
+                lines.append(f"   NEW  #{entry['rank']:<3} {entry['name']}")
+            for exit_ in ranking['exits'][:limit]:
+                lines.append(f"   OUT  was #{exit_['old_rank']:<3} {exit_['name']}")
+            for move in ranking['moves'][:limit]:
+                arrow = "▲" if move['delta'] > 0 else "▼"
+                lines.append(f"   {arrow}{abs(move['delta']):<3} #{move['old_rank']} -> #{move['rank']}  {move['name']}")
+    for time_range, shifts in diff.get('genre_shift', {}).items():
+        if shifts:
+            top = ", ".join(f"{genre} {shift:+.1%}" for genre, shift in list(shifts.items())[:limit])
+            lines.append(f"\nGenre shift ({time_range}): {top}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="What changed between extractions")
+    parser.add_argument("files", nargs="*", help="Two extraction files to compare (old new)")
+    parser.add_argument("--user", help="Diff this user's series from the manifest")
+    parser.add_argument("--cohort", action="store_true", help="Diff every user's series from the manifest")
+    parser.add_argument("--since", default="", help="Only extractions at or after this ISO timestamp")
+    parser.add_argument("--json", action="store_true", help="Print raw diff JSON")
+    args = parser.parse_args()
+
+    differ = SnapshotDiffer()
+    if len(args.files) == 2:
+        diffs = [differ.diff_files(*args.files)]
+    elif args.user:
+        diffs = differ.diff_series(args.user, args.since)
+    elif args.cohort:
+        cohort = differ.diff_cohort(args.since)
+        diffs = [diff for series in cohort.values() for diff in series]
+        print(f"{len(diffs)} diffs across {len(cohort)} users")
+    else:
+        parser.error("give two files, --user or --cohort")
+        return 2
+
+    for diff in diffs:
+        if args.json:
+            print(json.dumps(diff, indent=2, ensure_ascii=False))
+        elif not args.cohort:
+            print(format_diff(diff) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
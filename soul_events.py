@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+In-process pub/sub for Server-Sent Events
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque, defaultdict
+from typing import Dict, Any, Optional, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Encode one event in text/event-stream format"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False, default=str)
+    for line in payload.splitlines() or [""]:
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """One listener's view of a channel"""
+
+    def __init__(self, channel: str, max_pending: int):
+        self.channel = channel
+        self.queue: "queue.Queue[Tuple[int, str, Any]]" = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+    def push(self, item: Tuple[int, str, Any]):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # slow browser - drop the oldest event rather than stall publishers
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(item)
+
+
+class EventBroker:
+    """Fan-out of events to SSE subscribers, with a short replay history per channel
+
+    Only covers one process - under multiple gunicorn workers a browser sees
+    events from the worker it is connected to. A channel's history is dropped
+    retain_seconds after one of terminal_events, and only the max_channels
+    most recently used channels keep one at all.
+    """
+
+    def __init__(self, history_size: int = 50, max_pending: int = 100, max_channels: int = 1000,
+                 retain_seconds: float = 300.0, terminal_events: Tuple[str, ...] = ()):
+        self.history_size = history_size
+        self.max_pending = max_pending
+        self.max_channels = max_channels
+        self.retain_seconds = retain_seconds
+        self.terminal_events = terminal_events
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._history: "OrderedDict[str, deque]" = OrderedDict()
+        # channel -> when its history goes, set by a terminal event
+        self._expires: Dict[str, float] = {}
+        self._subscribers: Dict[str, List[Subscription]] = defaultdict(list)
+
+    def _prune(self, now: float):
+        # caller holds the lock
+        for channel in [c for c, expires in self._expires.items() if expires <= now]:
+            self._history.pop(channel, None)
+            del self._expires[channel]
+        while len(self._history) > self.max_channels:
+            channel, _ = self._history.popitem(last=False)
+            self._expires.pop(channel, None)
+
+    def publish(self, channel: str, event: str, data: Any) -> int:
+        now = time.monotonic()
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            item = (event_id, event, data)
+            history = self._history.get(channel)
+            if history is None:
+                history = self._history[channel] = deque(maxlen=self.history_size)
+            self._history.move_to_end(channel)
+            history.append(item)
+            if event in self.terminal_events:
+                self._expires[channel] = now + self.retain_seconds
+            self._prune(now)
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for subscription in subscribers:
+            subscription.push(item)
+        return event_id
+
+    def subscribe(self, channel: str, last_event_id: Optional[int] = None,
+                  replay_fresh: bool = True) -> Subscription:
+        """Listen on channel - replays what a reconnecting client missed
+
+        A fresh client (no last_event_id) gets the whole history, unless
+        replay_fresh is off - for channels whose events are snapshots and the
+        caller sends the current one itself.
+        """
+        subscription = Subscription(channel, self.max_pending)
+        with self._lock:
+            self._prune(time.monotonic())
+            if last_event_id is not None or replay_fresh:
+                for item in self._history.get(channel, ()):
+                    if last_event_id is None or item[0] > last_event_id:
+                        subscription.push(item)
+            self._subscribers[channel].append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.channel, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def channel_count(self) -> int:
+        """Channels still holding history"""
+        with self._lock:
+            return len(self._history)
+
+    def stream(self, channel: str, last_event_id: Optional[int] = None,
+               heartbeat: float = 15.0, max_seconds: float = 300.0,
+               until: Tuple[str, ...] = (), replay_fresh: bool = True) -> Iterator[str]:
+        """Yield SSE text for a channel until a terminal event or max_seconds
+
+        Browsers reconnect on their own with Last-Event-ID, so closing after
+        max_seconds just frees the worker thread.
+        """
+        subscription = self.subscribe(channel, last_event_id, replay_fresh)
+        deadline = time.monotonic() + max_seconds
+        try:
+            # tell EventSource how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event_id, event, data = subscription.queue.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data, event_id)
+                if event in until:
+                    return
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Streaming export API for extracted soul data
+
+Downstream consumers used to scp whole files out of final_landing/ and
+data/raw. server.py mounts this blueprint instead, which serves straight
+from the extraction files the manifest knows about:
+
+GET /api/soul/<user_id>                          snapshot, profile and section counts
+GET /api/soul/<user_id>/<section>[/<range>]      one page of a section's items
+
+- pages are cut out of the mmapped file by byte offset (soul_reader). Only the
+  requested page is decoded, however big the extraction is
+- ?cursor= continues where the last page stopped. The cursor pins the
+  snapshot, so a new extraction landing halfway through a library doesn't
+  shift the pages under the client
+- ?fields=name,album selects fields (dotted paths, lists are mapped over).
+  Rows are processed like final_landing by default, ?view=raw gives Spotify's
+  objects
+- one JSON document streamed in chunks, or NDJSON (?format=ndjson or
+  Accept: application/x-ndjson), gzipped on the fly if the client takes it
+- ETags are the snapshot hash plus the request, so revalidating an unchanged
+  page is a manifest lookup and a 304
+- every route needs a key from SOUL_API_KEYS ("key" for every user,
+  "key:user_id" for one), sent as a Bearer token or X-API-Key
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Iterable, Iterator, Tuple
+from urllib.parse import urlencode
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context, url_for
+
+from soul_manifest import ExtractionManifest
+from soul_persist import dumps
+from soul_reader import ExtractionReader
+from soul_responses import accepted_encodings
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ('top_tracks', 'top_artists', 'recent_tracks', 'saved_tracks')
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+NDJSON = 'application/x-ndjson'
+
+
+@dataclass
+class ExportConfig:
+    """Where extractions live and how pages go out"""
+    data_dir: str = "data"  # the manifest's output dir
+    page_size: int = 100
+    max_page_size: int = 1000
+    gzip_level: int = 5  # compressed per request - speed over ratio
+    chunk_bytes: int = 64 * 1024  # buffered before a chunk is sent
+    open_readers: int = 32  # extraction files kept mapped, with their item offsets
+    api_keys: Optional[str] = None  # falls back to SOUL_API_KEYS
+
+
+def parse_api_keys(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """"key1,key2:user_id" -> {key: the one user it may read, None for all of them}"""
+    keys = {}
+    for entry in (value or "").split(","):
+        key, _, user_id = entry.strip().partition(":")
+        if key:
+            keys[key] = user_id or None
+    return keys
+
+
+# -- rows -------------------------------------------------------------------
+
+def processed_track(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Same fields as final_landing's tracks, plus ids and timestamps"""
+    track = item.get('track', item) or {}
+    artists = track.get('artists') or []
+    row = {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'artist': ", ".join(artist.get('name', '') for artist in artists),
+        'album': (track.get('album') or {}).get('name'),
+        # genres are only there once the artists have been hydrated
+        'genres': ", ".join(sorted({genre for artist in artists for genre in artist.get('genres') or []}))
+    }
+    for key in ('time_range', 'played_at', 'added_at'):
+        if key in item:
+            row[key] = item[key]
+    return row
+
+
+def processed_artist(item: Dict[str, Any]) -> Dict[str, Any]:
+    row = {'id': item.get('id'), 'name': item.get('name'), 'genres': ", ".join(item.get('genres') or [])}
+    if 'time_range' in item:
+        row['time_range'] = item['time_range']
+    return row
+
+
+def processed_profile(profile: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not profile:
+        return None
+    return {
+        'display_name': profile.get('display_name'),
+        'spotify_uri': profile.get('uri'),
+        'profile_url': (profile.get('external_urls') or {}).get('spotify')
+    }
+
+
+def field_tree(fields: str) -> Dict[str, Any]:
+    """"name,album.name" -> {'name': {}, 'album': {'name': {}}}"""
+    tree: Dict[str, Any] = {}
+    for path in fields.split(","):
+        node = tree
+        for part in filter(None, path.strip().split(".")):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def project(value: Any, tree: Dict[str, Any]) -> Any:
+    """Only the fields in tree - lists are projected item by item"""
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+
+
+# -- cursors and caching ----------------------------------------------------
+
+def encode_cursor(sha256: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{sha256[:16]}:{offset}".encode('ascii')).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """(snapshot hash prefix, offset) - ValueError for anything we didn't hand out"""
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode('ascii')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Bad cursor")
+    prefix, _, offset = decoded.partition(":")
+    if len(prefix) != 16 or not offset.isdigit() or prefix.strip("0123456789abcdef"):
+        raise ValueError("Bad cursor")
+    return prefix, int(offset)
+
+
+def make_etag(sha256: str, *variant: Any) -> str:
+    # weak - the gzipped and plain bodies are the same data
+    digest = hashlib.blake2b(repr(variant).encode('utf-8'), digest_size=8).hexdigest()
+    return f'W/"{sha256[:16]}-{digest}"'
+
+
+def _not_modified(etag: str) -> bool:
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, so W/ or not doesn't matter
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+class SoulExporter:
+    """Manifest lookups and a small cache of open extraction readers"""
+
+    def __init__(self, config: ExportConfig):
+        self.config = config
+        self.manifest = ExtractionManifest.for_output_dir(config.data_dir)
+        self._readers: "OrderedDict[str, ExtractionReader]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def snapshot(self, user_id: str, sha256_prefix: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if sha256_prefix:
+            return self.manifest.by_hash(sha256_prefix, user_id)
+        return self.manifest.latest(user_id)
+
+    def reader(self, entry: Dict[str, Any]) -> ExtractionReader:
+        """The open reader for a snapshot - item offsets are scanned once, not per page"""
+        key = entry['sha256']
+        with self._lock:
+            reader = self._readers.get(key)
+            if reader is not None:
+                self._readers.move_to_end(key)
+                return reader
+        reader = ExtractionReader(entry['path'])
+        with self._lock:
+            reader = self._readers.setdefault(key, reader)
+            while len(self._readers) > self.config.open_readers:
+                # not closed here - a response still streaming from it keeps it
+                # alive, and the map goes when the last reference does
+                self._readers.popitem(last=False)
+        return reader
+
+
+# -- bodies -----------------------------------------------------------------
+
+def _json_chunks(head: Dict[str, Any], rows: Iterable[Any], tail: Dict[str, Any], chunk_bytes: int) -> Iterator[bytes]:
+    """{**head, "items": [rows...], **tail} without ever holding more than a chunk"""
+    buffer = bytearray(dumps(head, compact=True)[:-1] + b',"items":[')
+    first = True
+    for row in rows:
+        if not first:
+            buffer += b","
+        buffer += dumps(row, compact=True)
+        first = False
+        if len(buffer) >= chunk_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]," + dumps(tail, compact=True)[1:]
+    yield bytes(buffer)
+
+
+def _ndjson_chunks(rows: Iterable[Any], chunk_bytes: int) -> Iterator[bytes]:
+    buffer = bytearray()
+    for row in rows:
+        buffer += dumps(row, compact=True) + b"\n"
+        if len(buffer) >= chunk_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _gzipped(chunks: Iterable[bytes], level: int) -> Iterator[bytes]:
+    # one gzip member, sync-flushed per chunk so the client can decode as it goes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _error(status: int, message: str) -> Response:
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def _cache_headers(response: Response, etag: str) -> Response:
+    response.headers['ETag'] = etag
+    # per-user data behind a key - clients may keep it, shared caches may not
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Authorization, X-API-Key, Accept, Accept-Encoding'
+    return response
+
+
+def create_blueprint(config: Optional[ExportConfig] = None) -> Blueprint:
+    config = config or ExportConfig()
+    exporter = SoulExporter(config)
+    keys = parse_api_keys(config.api_keys if config.api_keys is not None else os.getenv("SOUL_API_KEYS"))
+    if not keys:
+        logger.warning("SOUL_API_KEYS is not set - every /api/soul request will be refused")
+
+    blueprint = Blueprint('soul_export', __name__)
+
+    def authorize(user_id: str) -> Optional[Response]:
+        header = request.headers.get('Authorization', '')
+        presented = header[7:].strip() if header[:7].lower() == 'bearer ' else request.headers.get('X-API-Key', '')
+        for key, allowed_user in keys.items():
+            if presented and hmac.compare_digest(key.encode('utf-8'), presented.encode('utf-8')):
+                if allowed_user and allowed_user != user_id:
+                    return _error(403, "This key can't read that user")
+                return None
+        response = _error(401, "API key required")
+        response.headers['WWW-Authenticate'] = 'Bearer realm="soul"'
+        return response
+
+    @blueprint.route('/api/soul/<user_id>')
+    def soul_summary(user_id):
+        denied = authorize(user_id)
+        if denied:
+            return denied
+        entry = exporter.snapshot(user_id)
+        if not entry:
+            return _error(404, f"No extraction for {user_id}")
+        etag = make_etag(entry['sha256'], 'summary')
+        if _not_modified(etag):
+            return _cache_headers(Response(status=304), etag)
+
+        try:
+            reader = exporter.reader(entry)
+        except OSError:
+            return _error(410, "The extraction file is gone - the manifest needs a rebuild")
+        profile = reader.section('user_profile') if 'user_profile' in reader.sections() else None
+        counts = entry['sections']
+        sections = {}
+        for section in SECTIONS:
+            if section in counts:
+                sections[section] = {'count': counts[section],
+                                     'url': url_for('.soul_section', user_id=user_id, section=section)}
+            for time_range in TIME_RANGES:
+                name = f"{section}_{time_range}"
+                if name in counts:
+                    sections[name] = {'count': counts[name], 'url': url_for(
+                        '.soul_section', user_id=user_id, section=section, time_range=time_range)}
+        return _cache_headers(jsonify({
+            'user_id': user_id,
+            'snapshot': entry['sha256'],
+            'timestamp': entry['timestamp'],
+            'size': entry['size'],
+            'profile': processed_profile(profile),
+            'sections': sections
+        }), etag)
+
+    @blueprint.route('/api/soul/<user_id>/<section>')
+    @blueprint.route('/api/soul/<user_id>/<section>/<time_range>')
+    def soul_section(user_id, section, time_range=None):
+        denied = authorize(user_id)
+        if denied:
+            return denied
+        if section not in SECTIONS or (time_range and (time_range not in TIME_RANGES or not section.startswith("top_"))):
+            return _error(404, f"No section {section}{'/' + time_range if time_range else ''}")
+
+        try:
+            limit = min(max(int(request.args.get('limit', config.page_size)), 1), config.max_page_size)
+            prefix, offset = decode_cursor(request.args['cursor']) if request.args.get('cursor') else (None, 0)
+        except ValueError as e:
+            return _error(400, str(e))
+        view = request.args.get('view', 'processed')
+        if view not in ('processed', 'raw'):
+            return _error(400, "view is processed or raw")
+        fields = request.args.get('fields') or None
+        wanted = request.args.get('format')
+        ndjson = wanted == 'ndjson' or (wanted is None and NDJSON in request.headers.get('Accept', ''))
+
+        entry = exporter.snapshot(user_id, prefix)
+        if not entry:
+            if prefix:
+                # the snapshot it pointed into has been replaced or pruned
+                return _error(410, "That cursor's snapshot is gone - start again without a cursor")
+            return _error(404, f"No extraction for {user_id}")
+
+        path = f"{section}.{time_range}" if time_range else section
+        etag = make_etag(entry['sha256'], path, offset, limit, view, fields, ndjson)
+        if _not_modified(etag):
+            return _cache_headers(Response(status=304), etag)
+
+        try:
+            reader = exporter.reader(entry)
+        except OSError:
+            return _error(410, "The extraction file is gone - the manifest needs a rebuild")
+        try:
+            total = len(reader.item_spans(path))
+        except KeyError:
+            total = 0  # this extraction didn't fetch the section
+        next_cursor = encode_cursor(entry['sha256'], offset + limit) if offset + limit < total else None
+
+        transform = None
+        if view == 'processed':
+            transform = processed_artist if section == 'top_artists' else processed_track
+        tree = field_tree(fields) if fields else None
+        items = reader.items(path, offset, limit) if offset < total else iter(())
+        # null items are what the schemas quarantine - they carry nothing to export
+        rows = (project(transform(item) if transform else item, tree) for item in items if item)
+
+        if ndjson:
+            chunks = _ndjson_chunks(rows, config.chunk_bytes)
+        else:
+            head = {'user_id': user_id, 'section': path, 'snapshot': entry['sha256'], 'offset': offset, 'total': total}
+            chunks = _json_chunks(head, rows, {'next_cursor': next_cursor}, config.chunk_bytes)
+        gzip = 'gzip' in accepted_encodings(request.headers.get('Accept-Encoding'))
+        if gzip:
+            chunks = _gzipped(chunks, config.gzip_level)
+
+        response = Response(stream_with_context(chunks), mimetype=NDJSON if ndjson else 'application/json')
+        if gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['X-Total-Count'] = str(total)
+        if next_cursor:
+            query = {**request.args.to_dict(), 'cursor': next_cursor}
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{request.base_url}?{urlencode(query)}>; rel="next"'
+        return _cache_headers(response, etag)
+
+    return blueprint
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Append-only listening history
+
+recently_played only ever returns the last 50 plays, so every extraction
+appends what it saw to a per-user SQLite log. (played_at, track_id) is the
+primary key, so overlapping snapshots dedupe themselves, and the table is
+clustered on played_at (WITHOUT ROWID) so time-window queries read one
+contiguous range. A small segments table keeps per-month counts and bounds.
+"""
+
+import argparse
+import datetime
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Iterable, Union
+
+logger = logging.getLogger(__name__)
+
+TimeLike = Union[int, float, str, datetime.datetime, None]
+
+BUCKETS = {
+    'hour': '%Y-%m-%dT%H:00',
+    'day': '%Y-%m-%d',
+    'week': '%Y-W%W',
+    'month': '%Y-%m',
+    'hour_of_day': '%H',
+    'weekday': '%w'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    played_at INTEGER NOT NULL,
+    track_id TEXT NOT NULL,
+    track_name TEXT,
+    artist_id TEXT,
+    artist_name TEXT,
+    album_name TEXT,
+    duration_ms INTEGER,
+    context_uri TEXT,
+    PRIMARY KEY (played_at, track_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS plays_artist ON plays (artist_id, played_at);
+CREATE INDEX IF NOT EXISTS plays_track ON plays (track_id, played_at);
+CREATE TABLE IF NOT EXISTS segments (
+    month TEXT PRIMARY KEY,
+    plays INTEGER NOT NULL,
+    first_played INTEGER NOT NULL,
+    last_played INTEGER NOT NULL
+);
+"""
+
+
+@dataclass
+class HistoryConfig:
+    """Where the per-user play logs live"""
+    history_dir: str = "history"
+
+
+def to_epoch_ms(value: TimeLike) -> Optional[int]:
+    """Spotify played_at strings, datetimes or epoch ms -> epoch ms (UTC)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _play_row(item: Dict[str, Any]) -> Optional[tuple]:
+    # handles raw api items ({'track': {...}, 'played_at': ...}) and soulpull's processed ones
+    track = item.get('track', item)
+    played_at = item.get('played_at')
+    if not track or not played_at:
+        return None
+
+    artists = track.get('artists') or []
+    if artists and isinstance(artists[0], dict):
+        artist_id = artists[0].get('id')
+        artist_name = artists[0].get('name')
+    else:
+        artist_id = None
+        artist_name = artists[0] if artists else None
+
+    album = track.get('album')
+    album_name = album.get('name') if isinstance(album, dict) else album
+    context = item.get('context') or {}
+    track_id = track.get('id') or f"name:{track.get('name')}"
+
+    return (
+        to_epoch_ms(played_at), track_id, track.get('name'), artist_id, artist_name,
+        album_name, track.get('duration_ms'), context.get('uri')
+    )
+
+
+class ListeningHistory:
+    """One user's play log"""
+
+    def __init__(self, user_id: str, config: Optional[HistoryConfig] = None):
+        self.user_id = user_id
+        self.config = config or HistoryConfig()
+        self.path = Path(self.config.history_dir) / f"history_{user_id}.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def append(self, items: Iterable[Dict[str, Any]]) -> int:
+        """Insert plays, skipping ones already logged - returns how many were new"""
+        rows = [row for row in (_play_row(item) for item in items) if row]
+        if not rows:
+            return 0
+
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO plays VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            inserted = self._conn.total_changes - before
+            if inserted:
+                self._refresh_segments({row[0] for row in rows})
+
+        logger.info("Appended %d new plays for %s (%d seen)", inserted, self.user_id, len(rows))
+        return inserted
+
+    def append_extraction(self, data: Dict[str, Any]) -> int:
+        recent = data.get('recent_tracks') or {}
+        return self.append(recent.get('items', []) if isinstance(recent, dict) else recent)
+
+    def _refresh_segments(self, played: Iterable[int]):
+        # only the months touched by this batch get recounted, each one a primary key range scan
+        months = {datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0) for ms in played}
+        for month_start in months:
+            month_end = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            self._conn.execute("""
+                INSERT OR REPLACE INTO segments
+                SELECT ?, COUNT(*), MIN(played_at), MAX(played_at)
+                FROM plays WHERE played_at >= ? AND played_at < ?
+            """, (month_start.strftime('%Y-%m'), to_epoch_ms(month_start), to_epoch_ms(month_end)))
+
+    def _window(self, start: TimeLike, end: TimeLike, extra: str = "", params: tuple = ()) -> tuple:
+        clauses = ["played_at >= ?", "played_at < ?"]
+        values = [to_epoch_ms(start) or 0, to_epoch_ms(end) or 2 ** 62]
+        if extra:
+            clauses.append(extra)
+            values.extend(params)
+        return " AND ".join(clauses), tuple(values)
+
+    def _query(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def plays(self, start: TimeLike = None, end: TimeLike = None,
+              artist_id: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        where, params = self._window(start, end, "artist_id = ?" if artist_id else "", (artist_id,) if artist_id else ())
+        sql = f"SELECT * FROM plays WHERE {where} ORDER BY played_at"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._query(sql, params)
+
+    def counts_by(self, bucket: str = 'day', start: TimeLike = None, end: TimeLike = None,
+                  artist_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Plays (and minutes) per hour/day/week/month, or by hour_of_day/weekday"""
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket '{bucket}', expected one of {', '.join(BUCKETS)}")
+        where, params = self._window(start, end, "artist_id = ?" if artist_id else "", (artist_id,) if artist_id else ())
+        return self._query(f"""
+            SELECT strftime('{BUCKETS[bucket]}', played_at / 1000, 'unixepoch') AS bucket,
+                   COUNT(*) AS plays,
+                   ROUND(COALESCE(SUM(duration_ms), 0) / 60000.0, 1) AS minutes
+            FROM plays WHERE {where}
+            GROUP BY bucket ORDER BY bucket
+        """, params)
+
+    def top_artists(self, start: TimeLike = None, end: TimeLike = None, limit: int = 10) -> List[Dict[str, Any]]:
+        where, params = self._window(start, end)
+        return self._query(f"""
+            SELECT artist_id, artist_name, COUNT(*) AS plays, COUNT(DISTINCT track_id) AS tracks
+            FROM plays WHERE {where}
+            GROUP BY COALESCE(artist_id, artist_name) ORDER BY plays DESC LIMIT ?
+        """, params + (limit,))
+
+    def top_tracks(self, start: TimeLike = None, end: TimeLike = None, limit: int = 10) -> List[Dict[str, Any]]:
+        where, params = self._window(start, end)
+        return self._query(f"""
+            SELECT track_id, track_name, artist_name, COUNT(*) AS plays
+            FROM plays WHERE {where}
+            GROUP BY track_id ORDER BY plays DESC LIMIT ?
+        """, params + (limit,))
+
+    def segments(self) -> List[Dict[str, Any]]:
+        return self._query("SELECT * FROM segments ORDER BY month", ())
+
+    def latest_played_at(self) -> Optional[int]:
+        """Newest play in the log - usable as recently_played's `after` cursor"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(played_at) FROM plays").fetchone()
+        return row[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(plays), 0) FROM segments").fetchone()[0]
+
+
+def record_extraction(data: Dict[str, Any], config: Optional[HistoryConfig] = None) -> int:
+    """Append an extraction's recent plays to its user's log"""
+    user_id = (data.get('extraction_metadata') or {}).get('spotify_user_id') \
+        or (data.get('user_profile') or {}).get('id')
+    if not user_id:
+        logger.warning("Extraction has no user id - not recording listening history")
+        return 0
+    history = ListeningHistory(user_id, config)
+    try:
+        return history.append_extraction(data)
+    finally:
+        history.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a user's listening history")
+    parser.add_argument("user_id")
+    parser.add_argument("--by", choices=list(BUCKETS), default="day", help="Bucket for play counts")
+    parser.add_argument("--start", help="ISO date/time, inclusive")
+    parser.add_argument("--end", help="ISO date/time, exclusive")
+    parser.add_argument("--artist", help="Only count plays by this artist id")
+    parser.add_argument("--top", type=int, default=0, help="Show the top N artists and tracks instead")
+    parser.add_argument("--dir", default=HistoryConfig.history_dir)
+    args = parser.parse_args()
+
+    history = ListeningHistory(args.user_id, HistoryConfig(history_dir=args.dir))
+    print(f"{len(history)} plays logged for {args.user_id}")
+
+    if args.top:
+        print("\nTop artists:")
+        for row in history.top_artists(args.start, args.end, args.top):
+            print(f"  {row['plays']:5d}  {row['artist_name']}")
+        print("\nTop tracks:")
+        for row in history.top_tracks(args.start, args.end, args.top):
+            print(f"  {row['plays']:5d}  {row['track_name']} - {row['artist_name']}")
+    else:
+        for row in history.counts_by(args.by, args.start, args.end, args.artist):
+            print(f"  {row['bucket']}  {row['plays']:5d} plays  {row['minutes']:7.1f} min")
+    history.close()
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Artist hydration - genres and popularity for every artist in an extraction
+
+Tracks only carry simplified artist objects (no genres), so genre analysis
+used to stop at the 50 top artists. This collects every unique artist id in
+one or more extractions, answers what it can from a shared SQLite cache and
+fetches the rest with sp.artists in batches of 50, a few batches at a time.
+API cost is proportional to artists nobody has looked up recently.
+"""
+
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Iterable, Iterator, Callable, Set
+
+logger = logging.getLogger(__name__)
+
+# sp.artists accepts at most 50 ids per request
+ARTIST_BATCH_SIZE = 50
+TRACK_SECTIONS = ('top_tracks', 'recent_tracks', 'saved_tracks')
+
+
+@dataclass
+class HydrationConfig:
+    """Artist cache location and fetch settings"""
+    cache_path: str = "cache/artists.db"
+    max_age_days: int = 30  # genres drift slowly, popularity a bit faster
+    workers: int = 4
+
+
+class ArtistCache:
+    """Full artist objects shared by every extraction and user"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS artists (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    genres TEXT NOT NULL,
+                    popularity INTEGER,
+                    followers INTEGER,
+                    fetched_at TEXT NOT NULL
+                )
+            """)
+
+    def get_many(self, artist_ids: Iterable[str], max_age_days: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        artist_ids = list(artist_ids)
+        cutoff = None
+        if max_age_days is not None:
+            cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).isoformat()
+
+        found = {}
+        with self._lock:
+            # sqlite caps bound parameters, so look up in chunks
+            for i in range(0, len(artist_ids), 500):
+                chunk = artist_ids[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT id, name, genres, popularity, followers, fetched_at FROM artists WHERE id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    if cutoff and row[5] < cutoff:
+                        continue
+                    found[row[0]] = {
+                        'id': row[0], 'name': row[1], 'genres': json.loads(row[2]),
+                        'popularity': row[3], 'followers': row[4]
+                    }
+        return found
+
+    def put_many(self, artists: Iterable[Dict[str, Any]]):
+        now = datetime.datetime.now().isoformat()
+        rows = [
+            (a['id'], a.get('name'), json.dumps(a.get('genres') or []), a.get('popularity'),
+             (a.get('followers') or {}).get('total') if isinstance(a.get('followers'), dict) else a.get('followers'),
+             now)
+            for a in artists if a and a.get('id') and 'genres' in a
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO artists VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM artists").fetchone()[0]
+
+
+def _items(payload: Any) -> List[Dict[str, Any]]:
+    if isinstance(payload, dict):
+        return payload.get('items') or []
+    return payload or []
+
+
+def _section_items(data: Dict[str, Any], section: str) -> Iterator[Dict[str, Any]]:
+    payload = data.get(section)
+    if section == 'top_tracks' or section == 'top_artists':
+        for ranged in (payload or {}).values():
+            yield from _items(ranged)
+    else:
+        yield from _items(payload)
+
+
+def track_artists(data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Every simplified artist object hanging off a track in the extraction"""
+    for section in TRACK_SECTIONS:
+        for item in _section_items(data, section):
+            track = item.get('track', item) if item else None
+            for artist in (track or {}).get('artists') or []:
+                if isinstance(artist, dict):
+                    yield artist
+
+
+def collect_artist_ids(data: Dict[str, Any]) -> Set[str]:
+    return {artist['id'] for artist in track_artists(data) if artist.get('id')}
+
+
+class ArtistHydrator:
+    """Fills genres/popularity onto track artists, via the cache and batched sp.artists calls"""
+
+    def __init__(self, sp, config: Optional[HydrationConfig] = None,
+                 api_call: Optional[Callable[[Callable[[], Any], str], Any]] = None):
+        self.sp = sp
+        self.config = config or HydrationConfig()
+        self.cache = ArtistCache(self.config.cache_path)
+        # lets the extractor route calls through its retry/backoff wrapper
+        self.api_call = api_call or (lambda func, name: func())
+        self.last_stats: Dict[str, int] = {}
+
+    def _fetch_batch(self, batch: List[str]) -> List[Dict[str, Any]]:
+        response = self.api_call(lambda: self.sp.artists(batch), f"artist batch ({len(batch)} artists)")
+        return [a for a in (response or {}).get('artists', []) if a]
+
+    def fetch(self, artist_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Full artist objects for the given ids - cached ones first, the rest from the API"""
+        artist_ids = sorted(set(artist_ids))
+        known = self.cache.get_many(artist_ids, self.config.max_age_days)
+        missing = [artist_id for artist_id in artist_ids if artist_id not in known]
+        self.last_stats = {'unique_artists': len(artist_ids), 'cached': len(known), 'fetched': 0}
+        if not missing:
+            return known
+
+        batches = [missing[i:i + ARTIST_BATCH_SIZE] for i in range(0, len(missing), ARTIST_BATCH_SIZE)]
+        logger.info("Fetching %d uncached artists in %d batches", len(missing), len(batches))
+        with ThreadPoolExecutor(max_workers=min(self.config.workers, len(batches)),
+                                thread_name_prefix="artist-hydration") as pool:
+            for artists in pool.map(self._fetch_batch, batches):
+                self.cache.put_many(artists)
+                for artist in artists:
+                    known[artist['id']] = {
+                        'id': artist['id'], 'name': artist.get('name'), 'genres': artist.get('genres') or [],
+                        'popularity': artist.get('popularity'),
+                        'followers': (artist.get('followers') or {}).get('total')
+                    }
+                self.last_stats['fetched'] += len(artists)
+        return known
+
+    @staticmethod
+    def attach(data: Dict[str, Any], artists: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        """Copy genres/popularity onto every track artist in data, returns coverage counts"""
+        total = with_genres = 0
+        for artist in track_artists(data):
+            total += 1
+            full = artists.get(artist.get('id'))
+            if not full:
+                continue
+            artist['genres'] = full['genres']
+            artist['popularity'] = full['popularity']
+            if full['genres']:
+                with_genres += 1
+        return {'track_artists': total, 'track_artists_with_genres': with_genres}
+
+    def hydrate(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return self.hydrate_many([data])[0]
+
+    def hydrate_many(self, datasets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Hydrate several users' extractions with one shared lookup - returns per-dataset stats"""
+        # top artists are already full objects - free cache entries
+        for data in datasets:
+            self.cache.put_many(_section_items(data, 'top_artists'))
+
+        wanted = set()
+        for data in datasets:
+            wanted |= collect_artist_ids(data)
+        artists = self.fetch(wanted)
+
+        results = []
+        for data in datasets:
+            stats = {**self.last_stats, **self.attach(data, artists)}
+            results.append(stats)
+        logger.info(
+            "Artist hydration: %d unique artists, %d from cache, %d fetched",
+            self.last_stats['unique_artists'], self.last_stats['cached'], self.last_stats['fetched']
+        )
+        return results
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+In-process extraction job queue for the OAuth server
+"""
+
+import datetime
+import logging
+import os
+import queue
+import secrets
+import socket
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, List
+
+from soul_resilience import breakers
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+@dataclass
+class JobQueueConfig:
+    """Configuration for the extraction job queue"""
+    db_path: str = "jobs/jobs.db"
+    workers: int = 2
+    max_queued: int = 50
+    token_dir: str = "tokens"
+    output_dir: str = "data"
+    # per job kind - a stuck job gives its worker back after this, checkpoint intact
+    deadlines: Dict[str, float] = field(default_factory=lambda: {
+        "recent": 60.0,
+        "extraction": 300.0,
+        "full_library": 1800.0
+    })
+    # a job whose user already has one running waits this long before trying again
+    user_busy_retry_seconds: float = 15.0
+    # running jobs get their heartbeat touched this often by the process that owns them
+    heartbeat_seconds: float = 30.0
+    # a running job nobody has touched for this long lost its process - it goes back in the queue
+    stale_after_seconds: float = 120.0
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity - callers should retry later"""
+
+
+class JobStore:
+    """SQLite job table so status survives restarts"""
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    output_file TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    heartbeat_at TEXT
+                )
+            """)
+            # tables from before ownership tracking
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("owner", "heartbeat_at"):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_user_status ON jobs (user_id, status)")
+
+    def create(self, user_id: str, kind: str) -> Dict[str, Any]:
+        job = {
+            'id': secrets.token_hex(8),
+            'user_id': user_id,
+            'kind': kind,
+            'status': QUEUED,
+            'created_at': datetime.datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'output_file': None,
+            'error': None,
+            'owner': None,
+            'heartbeat_at': None
+        }
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, user_id, kind, status, created_at, started_at, finished_at, "
+                "output_file, error, owner, heartbeat_at) VALUES (:id, :user_id, :kind, :status, "
+                ":created_at, :started_at, :finished_at, :output_file, :error, :owner, :heartbeat_at)",
+                job
+            )
+        return job
+
+    def update(self, job_id: str, expected_status: Optional[str] = None, **fields) -> bool:
+        """Set fields on a job - only if it's still in expected_status, when given"""
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        query = f"UPDATE jobs SET {assignments} WHERE id = :id"
+        if expected_status is not None:
+            query += " AND status = :expected_status"
+        with self._lock, self._conn:
+            cursor = self._conn.execute(query, {**fields, 'id': job_id, 'expected_status': expected_status})
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """QUEUED -> RUNNING for owner, unless the user already has a job running
+
+        One statement, so it holds across every process sharing the table: a
+        job runs in one process only, and one job per user at a time whatever
+        its kind (a daily and a full library run would fight over the same
+        user's files).
+        """
+        now = datetime.datetime.now().isoformat()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ? "
+                "WHERE id = ? AND status = ? AND NOT EXISTS ("
+                "SELECT 1 FROM jobs AS other WHERE other.user_id = jobs.user_id AND other.status = ? "
+                "AND other.id != jobs.id)",
+                (RUNNING, now, owner, now, job_id, QUEUED, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, owner: str) -> int:
+        """Touch every job owner is running - returns how many"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                (datetime.datetime.now().isoformat(), owner, RUNNING)
+            )
+        return cursor.rowcount
+
+    def requeue_stale(self, stale_after_seconds: float) -> List[Dict[str, Any]]:
+        """RUNNING jobs whose owner stopped heartbeating go back to QUEUED
+
+        Each one is flipped with a conditional update, so when several
+        processes sweep at once only one of them gets a given job back.
+        """
+        cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=stale_after_seconds)).isoformat()
+        stale_clause = "status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+        requeued = []
+        with self._lock, self._conn:
+            rows = self._conn.execute(f"SELECT * FROM jobs WHERE {stale_clause}", (RUNNING, cutoff)).fetchall()
+            for row in rows:
+                cursor = self._conn.execute(
+                    f"UPDATE jobs SET status = ?, started_at = NULL, owner = NULL WHERE id = ? AND {stale_clause}",
+                    (QUEUED, row['id'], RUNNING, cutoff)
+                )
+                if cursor.rowcount == 1:
+                    requeued.append({**dict(row), 'status': QUEUED, 'started_at': None, 'owner': None})
+        return requeued
+
+    def active_for_user(self, user_id: str, kind: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? AND kind = ? AND status IN (?, ?) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (user_id, kind, *ACTIVE_STATUSES)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def busy_users(self) -> set:
+        """Users with a job queued or running, of any kind"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT user_id FROM jobs WHERE status IN (?, ?)",
+                                      ACTIVE_STATUSES).fetchall()
+        return {row[0] for row in rows}
+
+    def queued(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+
+JobListener = Callable[[Dict[str, Any], str, Dict[str, Any]], None]
+
+
+# job kinds the default runner understands
+RECENT_PLAYS = "recent"
+EXTRACTION = "extraction"
+FULL_LIBRARY = "full_library"
+JOB_KINDS = (RECENT_PLAYS, EXTRACTION, FULL_LIBRARY)
+
+
+def run_extraction_job(job: Dict[str, Any], config: JobQueueConfig,
+                       progress: Callable[[str, Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Default runner - the job's kind of extraction for its user with their newest token"""
+    from spotify_soul_extraction_base import ExtractionConfig, run_extraction, run_recent_plays
+
+    extraction_config = ExtractionConfig(
+        token_dir=config.token_dir,
+        output_dir=config.output_dir,
+        user_id=job['user_id'],
+        deadline_seconds=config.deadlines.get(job['kind'], ExtractionConfig.deadline_seconds)
+    )
+    if job['kind'] == RECENT_PLAYS:
+        return run_recent_plays(extraction_config, progress)
+    if job['kind'] == FULL_LIBRARY:
+        extraction_config.saved_tracks_limit = None
+    return run_extraction(extraction_config, progress)
+
+
+class ExtractionJobQueue:
+    """Bounded worker pool that runs extractions off the request thread
+
+    Each server process has its own pool, so under gunicorn the total
+    concurrency is workers x processes. The job table is shared: claims
+    are conditional updates on it, and a process heartbeats the jobs it
+    runs so its siblings only recover the ones whose process has died.
+    """
+
+    def __init__(self, config: Optional[JobQueueConfig] = None,
+                 runner: Optional[Callable[..., Dict[str, Any]]] = None,
+                 listener: Optional[JobListener] = None):
+        self.config = config or JobQueueConfig()
+        self.store = JobStore(self.config.db_path)
+        self.runner = runner or run_extraction_job
+        # gets (job, event, details) for job_queued / progress / job_succeeded / job_failed
+        self.listener = listener
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=self.config.max_queued)
+        # guards the dedupe check + enqueue so two callbacks can't both win
+        self._submit_lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+        self._retries: List[threading.Timer] = []
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._started = False
+        # who holds a RUNNING job in the shared table
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._stopping.clear()
+        self._recover()
+        for i in range(self.config.workers):
+            worker = threading.Thread(target=self._work, name=f"extraction-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._heartbeat = threading.Thread(target=self._beat, name="extraction-heartbeat", daemon=True)
+        self._heartbeat.start()
+        logger.info("Extraction job queue started with %d workers as %s", self.config.workers, self.owner)
+
+    def _recover(self):
+        # running jobs whose process died go back to QUEUED; everything QUEUED is
+        # offered to our workers too - if a sibling also has it, the claim picks one
+        for job in self.store.requeue_stale(self.config.stale_after_seconds):
+            logger.info("Recovered stale job %s for %s", job['id'], job['user_id'])
+        for job in self.store.queued():
+            self._enqueue_recovered(job)
+
+    def _enqueue_recovered(self, job: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(job['id'])
+            logger.info("Re-queued interrupted job %s for %s", job['id'], job['user_id'])
+        except queue.Full:
+            self.store.update(job['id'], expected_status=QUEUED, status=FAILED,
+                              error="interrupted - queue full on restart",
+                              finished_at=datetime.datetime.now().isoformat())
+
+    def _beat(self):
+        while not self._stopping.wait(self.config.heartbeat_seconds):
+            try:
+                self.store.heartbeat(self.owner)
+                # a sibling process that died mid-job shouldn't have to wait for a restart
+                for job in self.store.requeue_stale(self.config.stale_after_seconds):
+                    logger.info("Recovered stale job %s for %s", job['id'], job['user_id'])
+                    self._enqueue_recovered(job)
+            except sqlite3.Error as e:
+                logger.warning("Job heartbeat failed: %s", e)
+
+    def submit(self, user_id: str, kind: str = EXTRACTION) -> Dict[str, Any]:
+        """Queue a job for user_id, or return the one already queued/running
+
+        Raises QueueFullError when at capacity.
+        """
+        with self._submit_lock:
+            existing = self.store.active_for_user(user_id, kind)
+            if existing:
+                logger.info("Job %s already %s for %s", existing['id'], existing['status'], user_id)
+                return existing
+
+            if self._queue.full():
+                raise QueueFullError(f"Extraction queue is full ({self.config.max_queued} jobs)")
+
+            job = self.store.create(user_id, kind)
+            self._queue.put_nowait(job['id'])
+
+        logger.info("Queued %s job %s for %s", kind, job['id'], user_id)
+        self._notify(job, "job_queued", {'status': QUEUED})
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.config.workers,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.config.max_queued,
+            'jobs': self.store.counts(),
+            'circuits': breakers.states()
+        }
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                self._queue.task_done()
+                return
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _notify(self, job: Dict[str, Any], event: str, details: Dict[str, Any]):
+        if not self.listener:
+            return
+        try:
+            self.listener(job, event, details)
+        except Exception as e:
+            logger.warning("Job listener failed on %s for %s: %s", event, job['id'], e)
+
+    def _run(self, job_id: str):
+        job = self.store.get(job_id)
+        if not job:
+            return
+        if not self.store.claim(job_id, self.owner):
+            current = self.store.get(job_id)
+            if current and current['status'] == QUEUED:
+                # this user has another job running - try again once it's had time to finish
+                logger.info("Job %s waiting, %s already has a job running", job_id, job['user_id'])
+                self._retry_later(job_id)
+            return
+
+        logger.info("Running job %s for %s", job_id, job['user_id'])
+        self._notify(job, "job_started", {'status': RUNNING})
+
+        def progress(section: str, details: Dict[str, Any]):
+            self._notify(job, "progress", {'section': section, **details})
+
+        try:
+            result = self.runner(job, self.config, progress)
+            output_file = str(result.get('output_file')) if result else None
+            self.store.update(
+                job_id,
+                status=SUCCEEDED,
+                finished_at=datetime.datetime.now().isoformat(),
+                output_file=output_file
+            )
+            logger.info("Job %s finished", job_id)
+            self._notify(job, "job_succeeded", {'status': SUCCEEDED, 'output_file': output_file})
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            self.store.update(job_id, status=FAILED, error=str(e),
+                              finished_at=datetime.datetime.now().isoformat())
+            self._notify(job, "job_failed", {'status': FAILED, 'error': str(e)})
+
+    def _retry_later(self, job_id: str):
+        timer = threading.Timer(self.config.user_busy_retry_seconds, self._queue.put, args=(job_id,))
+        timer.daemon = True
+        self._retries = [t for t in self._retries if t.is_alive()] + [timer]
+        timer.start()
+
+    def shutdown(self, wait: bool = True):
+        self._stopping.set()
+        for timer in self._retries:
+            # still QUEUED in the table - the next start() recovers them
+            timer.cancel()
+        self._retries = []
+        for _ in self._workers:
+            # blocking put - the sentinel has to get in even if the queue is full
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+            if self._heartbeat:
+                self._heartbeat.join()
+        self._heartbeat = None
+        self._workers = []
+        self._started = False
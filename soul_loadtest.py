@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+Sign-up storm rehearsal for server.py
+
+Drives the whole OAuth flow for many users at once, the way a campaign link
+does:
+
+    GET /get-auth-url -> GET <auth_url> (302 back with a code)
+    -> GET /callback -> POST /api/callback
+
+Spotify is replaced by StandInSpotify, a local stand-in for
+accounts.spotify.com (/authorize, /api/token) and api.spotify.com (/v1/me)
+with configurable latency and error rate. server.py is started against it
+(SPOTIFY_ACCOUNTS_URL / SPOTIFY_API_URL) in a scratch directory, so token
+saving and _cleanup_old_tokens run for real on a real tokens/ directory.
+Alternatively, --target points at a server that's already running against a
+stand-in.
+
+The report gives throughput plus p50/p95/p99 and error rate per step. It
+then checks the tokens directory for what contention leaves behind: users
+with more than keep_count tokens, unreadable token files, leftover temp
+files and loose permissions.
+
+    python soul_loadtest.py run --users 300 --concurrency 100 --arrival-seconds 60
+    python soul_loadtest.py run --server gunicorn --workers 4 --threads 8 --logins-per-user 5
+    python soul_loadtest.py standin --port 9900
+    python soul_loadtest.py retries
+
+`retries` scripts 429s (with Retry-After) and 503s on the stand-in and checks
+that the extractor and the daylist publisher see the real status and wait
+what they were told to.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+from urllib.parse import urlparse, parse_qs, urlencode
+
+import requests
+
+from soul_persist import write_json
+
+logger = logging.getLogger(__name__)
+
+STEPS = ("auth_url", "authorize", "callback_page", "api_callback")
+SERVER_DIR = Path(__file__).resolve().parent
+
+
+@dataclass
+class StandInConfig:
+    """How slow and flaky the fake Spotify is"""
+    token_latency_ms: float = 150.0  # POST /api/token
+    profile_latency_ms: float = 80.0  # GET /v1/me
+    jitter: float = 0.5  # +/- fraction of each latency
+    error_rate: float = 0.0  # share of token exchanges answered with a 503
+    api_statuses: Tuple[int, ...] = ()  # answers for the next /v1/me/top calls, 200s after that
+    retry_after_seconds: int = 1  # sent with every scripted 429
+
+
+class _StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # a storm opens connections faster than the default backlog of 5 drains
+    # (has to be a class attribute - listen() happens in the constructor)
+    request_queue_size = 256
+
+
+class StandInSpotify:
+    """Just enough of accounts.spotify.com and api.spotify.com for the OAuth flow"""
+
+    def __init__(self, config: Optional[StandInConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StandInConfig()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._scripted = deque(self.config.api_statuses)
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                standin._handle(self, "GET")
+
+            def do_POST(self):
+                standin._handle(self, "POST")
+
+        self._server = _StandInServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInSpotify":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin-spotify", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _delay(self, milliseconds: float):
+        jitter = self.config.jitter
+        time.sleep(max(0.0, milliseconds * random.uniform(1 - jitter, 1 + jitter)) / 1000)
+
+    def script(self, *statuses: int):
+        """Queue error statuses for the next top items calls"""
+        with self._lock:
+            self._scripted.extend(statuses)
+
+    def _next_status(self) -> int:
+        with self._lock:
+            return self._scripted.popleft() if self._scripted else 200
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        url = urlparse(handler.path)
+        path = url.path.rstrip("/")  # spotipy asks for /v1/me/
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = b""
+        if method == "POST":
+            body = handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+
+        if method == "GET" and path == "/authorize":
+            # the user clicks "Agree" - the code carries which user it was
+            self._count("authorize")
+            user_id = query.get("soul_user") or f"user{secrets.token_hex(4)}"
+            code = f"{user_id}~{secrets.token_hex(8)}"
+            location = f"{query['redirect_uri']}?{urlencode({'code': code, 'state': query.get('state', '')})}"
+            return self._reply(handler, 302, b"", headers={"Location": location})
+
+        if method == "POST" and path == "/api/token":
+            self._count("token")
+            self._delay(self.config.token_latency_ms)
+            if random.random() < self.config.error_rate:
+                self._count("token_errors")
+                return self._json(handler, 503, {"error": "temporarily_unavailable"})
+            code = parse_qs(body.decode("utf-8")).get("code", [""])[0]
+            if "~" not in code:
+                return self._json(handler, 400, {"error": "invalid_grant", "error_description": "Invalid code"})
+            return self._json(handler, 200, {
+                "access_token": f"standin.{code}",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "refresh_token": secrets.token_hex(16),
+                "scope": "user-top-read user-read-recently-played user-library-read"
+            })
+
+        if method == "GET" and path == "/v1/me":
+            self._count("me")
+            self._delay(self.config.profile_latency_ms)
+            token = handler.headers.get("Authorization", "").replace("Bearer standin.", "")
+            user_id = token.split("~")[0]
+            if not user_id:
+                return self._json(handler, 401, {"error": {"status": 401, "message": "Invalid access token"}})
+            return self._json(handler, 200, {"id": user_id, "display_name": user_id.title(), "type": "user"})
+
+        if method == "GET" and path.startswith("/v1/me/top/"):
+            self._count("top")
+            status = self._next_status()
+            if status != 200:
+                self._count(f"top_{status}")
+                headers = {"Retry-After": str(self.config.retry_after_seconds)} if status == 429 else {}
+                return self._json(handler, status, {"error": {"status": status, "message": "Stand-in error"}}, headers)
+            return self._json(handler, 200, {"items": [], "total": 0, "limit": int(query.get("limit", 20)),
+                                             "offset": int(query.get("offset", 0)), "next": None})
+
+        self._json(handler, 404, {"error": {"status": 404, "message": f"Stand-in has no {method} {path}"}})
+
+    def _json(self, handler: BaseHTTPRequestHandler, status: int, payload: Dict[str, Any],
+              headers: Optional[Dict[str, str]] = None):
+        self._reply(handler, status, json.dumps(payload).encode("utf-8"), {"Content-Type": "application/json", **(headers or {})})
+
+    @staticmethod
+    def _reply(handler: BaseHTTPRequestHandler, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+@dataclass
+class LoadTestConfig:
+    """How big the storm is and what it hits"""
+    users: int = 200
+    logins_per_user: int = 1  # >1 makes the same user race themselves through token cleanup
+    concurrency: int = 50  # sign-ups in flight at once (browser tabs)
+    arrival_seconds: float = 60.0  # sign-ups start evenly over this window, 0 = all at once
+    timeout: float = 30.0
+    target: Optional[str] = None  # a running server - otherwise server.py is started here
+    server: str = "flask"  # or gunicorn, which is what production runs
+    workers: int = 1  # gunicorn only
+    threads: int = 8  # gunicorn only
+    run_dir: Optional[str] = None  # scratch dir with tokens/, jobs/ and the server log
+    keep_count: int = 3  # what _cleanup_old_tokens should leave per user
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(config: LoadTestConfig, standin_url: str, run_dir: Path) -> Tuple[subprocess.Popen, str]:
+    """server.py in run_dir, talking to the stand-in - returns the process and its base URL"""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "SPOTIPY_CLIENT_ID": "loadtest",
+        "SPOTIPY_CLIENT_SECRET": "loadtest",
+        "SPOTIPY_REDIRECT_URI": f"{base_url}/callback",
+        # every gunicorn worker has to accept the others' session cookies
+        "FLASK_SECRET_KEY": secrets.token_hex(32),
+        "SPOTIFY_ACCOUNTS_URL": standin_url,
+        "SPOTIFY_API_URL": f"{standin_url}/v1",
+        "SOUL_AUTO_EXTRACT": "0",
+        "SOUL_LOG_LEVEL": os.getenv("SOUL_LOG_LEVEL", "WARNING"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(SERVER_DIR), os.getenv("PYTHONPATH")])),
+    }
+    if config.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+                   "--workers", str(config.workers), "--threads", str(config.threads),
+                   "--backlog", "512", "server:app"]
+    else:
+        # app.run without the debug reloader - main() would fork a second copy
+        command = [sys.executable, "-c",
+                   f"import server; server.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+    log = open(run_dir / "server.log", "ab")
+    process = subprocess.Popen(command, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with {process.returncode} - see {run_dir / 'server.log'}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return process, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"server.py didn't come up on {base_url} - see {run_dir / 'server.log'}")
+
+
+def sign_up(base_url: str, user_id: str, timeout: float) -> List[Tuple[str, float, Optional[str]]]:
+    """One user's trip through the flow - (step, seconds, error or None) per step taken"""
+    steps = []
+    session = requests.Session()  # keeps the Flask session cookie like a browser would
+
+    def step(name: str, call):
+        start = time.perf_counter()
+        try:
+            response = call()
+            error = None if response.status_code < 400 else f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            response, error = None, type(e).__name__
+        steps.append((name, time.perf_counter() - start, error))
+        return response if error is None else None
+
+    try:
+        response = step("auth_url", lambda: session.get(f"{base_url}/get-auth-url", timeout=timeout))
+        if response is None:
+            return steps
+        auth = response.json()
+        response = step("authorize", lambda: session.get(
+            f"{auth['auth_url']}&{urlencode({'soul_user': user_id})}", allow_redirects=False, timeout=timeout
+        ))
+        if response is None:
+            return steps
+        redirect = urlparse(response.headers["Location"])
+        params = {key: values[0] for key, values in parse_qs(redirect.query).items()}
+        if params.get("state") != auth["state"]:
+            steps.append(("authorize", 0.0, "state mismatch"))
+            return steps
+        if step("callback_page", lambda: session.get(response.headers["Location"], timeout=timeout)) is None:
+            return steps
+        step("api_callback", lambda: session.post(
+            f"{base_url}/api/callback", json={"code": params["code"], "state": params["state"]}, timeout=timeout
+        ))
+    finally:
+        session.close()
+    return steps
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def check_tokens_dir(tokens_dir: Path, keep_count: int) -> Dict[str, Any]:
+    """What a storm left in tokens/ - every finding here is a race somebody lost"""
+    per_user = Counter()
+    corrupt, loose, temp_files = [], [], []
+    for path in tokens_dir.iterdir():
+        if path.name.endswith(".tmp"):
+            temp_files.append(path.name)
+            continue
+        if not path.name.startswith("spotify_token_") or path.suffix != ".json":
+            continue
+        # spotify_token_<user>_<YYYYmmdd>_<HHMMSS>.json
+        per_user[path.stem[len("spotify_token_"):].rsplit("_", 2)[0]] += 1
+        try:
+            if "access_token" not in json.loads(path.read_bytes()):
+                corrupt.append(path.name)
+        except (ValueError, OSError):
+            corrupt.append(path.name)
+        if path.stat().st_mode & 0o077:
+            loose.append(path.name)
+    return {
+        'token_files': sum(per_user.values()),
+        'users': len(per_user),
+        'users_over_keep_count': {user: count for user, count in per_user.items() if count > keep_count},
+        'corrupt': corrupt,
+        'loose_permissions': loose,
+        'temp_leftovers': temp_files,
+    }
+
+
+def run_load_test(config: LoadTestConfig, standin_config: Optional[StandInConfig] = None) -> Dict[str, Any]:
+    """Stand-in + server + storm - returns the report"""
+    run_dir = Path(config.run_dir or tempfile.mkdtemp(prefix="soul_loadtest_"))
+    run_dir.mkdir(parents=True, exist_ok=True)
+    standin = process = None
+    base_url = config.target
+    if not base_url:
+        standin = StandInSpotify(standin_config).start()
+        process, base_url = start_server(config, standin.url, run_dir)
+        logger.info(f"server.py ({config.server}) on {base_url}, stand-in Spotify on {standin.url}, files in {run_dir}")
+
+    # repeat logins are spread through the storm, not bunched at the end
+    run_tag = secrets.token_hex(2)
+    logins = [f"load{run_tag}u{i:05d}" for i in range(config.users)] * config.logins_per_user
+    random.shuffle(logins)
+    spacing = config.arrival_seconds / max(len(logins), 1)
+
+    results: List[List[Tuple[str, float, Optional[str]]]] = []
+    results_lock = threading.Lock()
+    started = time.monotonic()
+
+    def one(index: int, user_id: str):
+        wait = started + index * spacing - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        steps = sign_up(base_url, user_id, config.timeout)
+        with results_lock:
+            results.append(steps)
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.concurrency) as pool:
+            for index, user_id in enumerate(logins):
+                pool.submit(one, index, user_id)
+        elapsed = time.monotonic() - started
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        if standin:
+            standin.stop()
+
+    report = summarize(results, elapsed)
+    report['config'] = asdict(config)
+    report['standin'] = asdict(standin_config or StandInConfig()) if standin else None
+    report['run_dir'] = str(run_dir)
+    tokens_dir = run_dir / "tokens"
+    if tokens_dir.is_dir():
+        report['tokens_dir'] = check_tokens_dir(tokens_dir, config.keep_count)
+    return report
+
+
+def summarize(results: List[List[Tuple[str, float, Optional[str]]]], elapsed: float) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = {name: [] for name in STEPS}
+    errors: Dict[str, Counter] = {name: Counter() for name in STEPS}
+    completed = 0
+    for steps in results:
+        for name, seconds, error in steps:
+            latencies[name].append(seconds)
+            if error:
+                errors[name][error] += 1
+        if len(steps) == len(STEPS) and not any(error for _, _, error in steps):
+            completed += 1
+
+    per_step = {}
+    for name in STEPS:
+        values = latencies[name]
+        failed = sum(errors[name].values())
+        per_step[name] = {
+            'count': len(values),
+            'errors': failed,
+            'error_rate': round(failed / len(values), 4) if values else 0.0,
+            'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+            'max_ms': round(max(values, default=0.0) * 1000, 1),
+            'error_kinds': dict(errors[name].most_common(5)),
+        }
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'sign_ups': len(results),
+        'completed': completed,
+        'error_rate': round(1 - completed / len(results), 4) if results else 0.0,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_s': round(completed / elapsed, 2) if elapsed else 0.0,
+        'steps': per_step,
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{report['completed']}/{report['sign_ups']} sign-ups completed in {report['elapsed_s']}s "
+             f"({report['throughput_per_s']}/s, {report['error_rate']:.1%} failed)"]
+    lines.append(f"  {'step':<14} {'count':>6} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for name, step in report['steps'].items():
+        lines.append(f"  {name:<14} {step['count']:>6} {step['error_rate']:>6.1%} {step['p50_ms']:>8.1f} "
+                     f"{step['p95_ms']:>8.1f} {step['p99_ms']:>8.1f} {step['max_ms']:>8.1f}"
+                     + (f"  {step['error_kinds']}" if step['error_kinds'] else ""))
+    tokens = report.get('tokens_dir')
+    if tokens:
+        lines.append(f"  tokens/: {tokens['token_files']} files for {tokens['users']} users")
+        for key in ('users_over_keep_count', 'corrupt', 'loose_permissions', 'temp_leftovers'):
+            if tokens[key]:
+                found = tokens[key]
+                lines.append(f"    {key}: {len(found)} e.g. {list(found)[:3]}")
+    return "\n".join(lines)
+
+
+def check_retries(retry_after_seconds: int = 2) -> Dict[str, bool]:
+    """429s and 5xx from a real HTTP server have to reach our retry code with their status and Retry-After
+
+    Runs the extractor's _safe_api_call and the daylist publisher's _call
+    against the stand-in, with real spotipy clients built the way production
+    builds them. A client that loses the headers still gets through, just
+    without waiting - so what's checked is how long each one waited.
+    """
+    # imported here - the storm itself doesn't need the extractor
+    from spotipy import Spotify
+    from spotipy.exceptions import SpotifyException
+    from soul_daylist import DaylistConfig, DaylistPublisher, token_client
+    from soul_resilience import Deadline, is_transient, retry_after, spotify_session
+    from spotify_soul_extraction_base import ExtractionConfig, SpotifyDataExtractor
+
+    standin = StandInSpotify(StandInConfig(retry_after_seconds=retry_after_seconds, jitter=0.0)).start()
+    checks: Dict[str, bool] = {}
+    saved_env = {name: os.environ.get(name) for name in
+                 ("SPOTIFY_API_URL", "SPOTIPY_CLIENT_ID", "SPOTIPY_CLIENT_SECRET", "SPOTIPY_REDIRECT_URI")}
+    os.environ.update({"SPOTIFY_API_URL": f"{standin.url}/v1", "SPOTIPY_CLIENT_ID": "loadtest",
+                       "SPOTIPY_CLIENT_SECRET": "loadtest", "SPOTIPY_REDIRECT_URI": f"{standin.url}/callback"})
+    try:
+        with tempfile.TemporaryDirectory(prefix="soul_retries_") as scratch:
+            run_dir = Path(scratch)
+            token_file = run_dir / "tokens" / "spotify_token_retrycheck_20240101_000000.json"
+            scope = "user-top-read user-read-recently-played user-library-read"
+            token_file.parent.mkdir()
+            write_json(token_file, {"access_token": "standin.retrycheck~check", "token_type": "Bearer",
+                                    "expires_in": 3600, "expires_at": int(time.time()) + 3600,
+                                    "refresh_token": "check", "scope": scope})
+
+            sp = Spotify(auth="standin.retrycheck~check", requests_session=spotify_session())
+            sp.prefix = f"{standin.url}/v1/"
+            for status in (429, 503):
+                standin.script(status)
+                try:
+                    sp.current_user_top_tracks()
+                    checks[f"{status} raised"] = False
+                except SpotifyException as e:
+                    checks[f"{status} keeps its status"] = e.http_status == status and is_transient(e)
+                    if status == 429:
+                        checks["429 keeps Retry-After"] = retry_after(e) == retry_after_seconds
+
+            extractor = SpotifyDataExtractor(ExtractionConfig(
+                token_dir=str(run_dir / "tokens"), output_dir=str(run_dir / "data"), user_id="retrycheck",
+                rate_limit_delay=0.0, circuit_breakers=False, checkpoint_dir=None, history_dir=None))
+            standin.script(429, 503)
+            started = time.monotonic()
+            result = extractor._safe_api_call(lambda: extractor.sp.current_user_top_tracks(), "top tracks")
+            checks["extractor waits Retry-After then succeeds"] = (
+                result is not None and time.monotonic() - started >= retry_after_seconds)
+
+            publisher = DaylistPublisher(DaylistConfig(
+                token_dir=str(run_dir / "tokens"), output_dir=str(run_dir / "data"), db_path=str(run_dir / "daylist.db"),
+                analytics_cache_dir=str(run_dir / "analytics"), requests_per_second=100.0, burst=100))
+            try:
+                client = token_client("retrycheck", token_file, scope, 5.0)
+                standin.script(429)
+                started = time.monotonic()
+                publisher._call(client, "top tracks", client.current_user_top_tracks, Deadline(60.0), [0])
+                checks["daylist pauses the limiter for Retry-After"] = time.monotonic() - started >= retry_after_seconds
+            finally:
+                publisher.close()
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        standin.stop()
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rehearse an OAuth sign-up storm against server.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Start a stand-in Spotify and server.py, then drive sign-ups through them")
+    run.add_argument("--users", type=int, default=LoadTestConfig.users)
+    run.add_argument("--logins-per-user", type=int, default=LoadTestConfig.logins_per_user)
+    run.add_argument("--concurrency", type=int, default=LoadTestConfig.concurrency)
+    run.add_argument("--arrival-seconds", type=float, default=LoadTestConfig.arrival_seconds)
+    run.add_argument("--target", help="Use this running server instead of starting one")
+    run.add_argument("--server", choices=("flask", "gunicorn"), default=LoadTestConfig.server)
+    run.add_argument("--workers", type=int, default=LoadTestConfig.workers)
+    run.add_argument("--threads", type=int, default=LoadTestConfig.threads)
+    run.add_argument("--run-dir", help="Where tokens/, jobs/ and server.log go (default: a temp dir)")
+    run.add_argument("--report", help="Also write the report here as JSON")
+
+    for command in (run, sub.add_parser("standin", help="Only run the stand-in Spotify")):
+        command.add_argument("--token-latency-ms", type=float, default=StandInConfig.token_latency_ms)
+        command.add_argument("--profile-latency-ms", type=float, default=StandInConfig.profile_latency_ms)
+        command.add_argument("--jitter", type=float, default=StandInConfig.jitter)
+        command.add_argument("--error-rate", type=float, default=StandInConfig.error_rate)
+    sub.choices["standin"].add_argument("--port", type=int, default=9900)
+    retries = sub.add_parser("retries", help="Check 429/5xx status and Retry-After survive into the retry loops")
+    retries.add_argument("--retry-after", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "retries":
+        checks = check_retries(args.retry_after)
+        for name, passed in checks.items():
+            print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+        return 0 if all(checks.values()) else 1
+
+    standin_config = StandInConfig(token_latency_ms=args.token_latency_ms, profile_latency_ms=args.profile_latency_ms,
+                                   jitter=args.jitter, error_rate=args.error_rate)
+    if args.command == "standin":
+        standin = StandInSpotify(standin_config, port=args.port).start()
+        print(f"Stand-in Spotify on {standin.url} - start server.py with:")
+        print(f"  SPOTIFY_ACCOUNTS_URL={standin.url} SPOTIFY_API_URL={standin.url}/v1 SOUL_AUTO_EXTRACT=0")
+        try:
+            while True:
+                time.sleep(60)
+                print(dict(standin.counts))
+        except KeyboardInterrupt:
+            standin.stop()
+        return 0
+
+    config = LoadTestConfig(users=args.users, logins_per_user=args.logins_per_user, concurrency=args.concurrency,
+                            arrival_seconds=args.arrival_seconds, target=args.target, server=args.server,
+                            workers=args.workers, threads=args.threads, run_dir=args.run_dir)
+    report = run_load_test(config, standin_config)
+    print(format_report(report))
+    if args.report:
+        write_json(Path(args.report), report)
+    tokens = report.get('tokens_dir') or {}
+    found_races = any(tokens.get(key) for key in ('users_over_keep_count', 'corrupt', 'temp_leftovers'))
+    return 1 if report['error_rate'] or found_races else 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
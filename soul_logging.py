@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Queue-based logging for the server and extractor
+
+Callers only put records on a queue; a background listener thread does the
+formatting and all file/console I/O.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+# attributes every LogRecord has - anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+@dataclass
+class LoggingConfig:
+    """Configuration for the logging pipeline"""
+    level: str = "INFO"
+    log_file: Optional[str] = None
+    max_bytes: int = 10 * 1024 * 1024  # 10 MB per file
+    backup_count: int = 5
+    queue_size: int = 10000
+    console: bool = True
+    module_levels: Dict[str, str] = field(default_factory=dict)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, extra= fields included"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener without formatting, drops them if the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting happens on the listener thread - nothing to do here
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # never block a request on log I/O
+            self.dropped += 1
+
+
+def _parse_module_levels(spec: str) -> Dict[str, str]:
+    """Parse "werkzeug=WARNING,soul_cassette=DEBUG" into a dict"""
+    levels = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        name, level = part.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def config_from_env(log_file: Optional[str] = None) -> LoggingConfig:
+    config = LoggingConfig(
+        level=os.getenv("SOUL_LOG_LEVEL", "INFO").upper(),
+        log_file=os.getenv("SOUL_LOG_FILE", log_file),
+        module_levels=_parse_module_levels(os.getenv("SOUL_LOG_LEVELS", ""))
+    )
+    max_bytes = os.getenv("SOUL_LOG_MAX_BYTES")
+    if max_bytes:
+        config.max_bytes = int(max_bytes)
+    return config
+
+
+def setup_logging(log_file: Optional[str] = None, config: Optional[LoggingConfig] = None) -> logging.handlers.QueueListener:
+    """Route all logging through one queue and start the listener thread
+
+    Safe to call more than once - later calls only add the file handler if
+    the first caller didn't have one, and only change levels when given a config.
+    """
+    global _listener, _queue_handler
+
+    explicit = config is not None
+    config = config or config_from_env(log_file)
+
+    with _lock:
+        if _listener is not None:
+            if config.log_file and not any(
+                isinstance(h, logging.handlers.RotatingFileHandler) for h in _listener.handlers
+            ):
+                _listener.stop()
+                _listener.handlers = _listener.handlers + (_file_handler(config),)
+                _listener.start()
+            # only an explicit config overrides levels set by the first caller
+            if explicit:
+                _apply_levels(config)
+            return _listener
+
+        handlers = []
+        if config.console:
+            console = logging.StreamHandler()
+            console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            handlers.append(console)
+        if config.log_file:
+            handlers.append(_file_handler(config))
+
+        log_queue = queue.Queue(maxsize=config.queue_size)
+        _queue_handler = DroppingQueueHandler(log_queue)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        _apply_levels(config)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+        return _listener
+
+
+def _file_handler(config: LoggingConfig) -> logging.Handler:
+    handler = logging.handlers.RotatingFileHandler(
+        config.log_file,
+        maxBytes=config.max_bytes,
+        backupCount=config.backup_count,
+        encoding='utf-8'
+    )
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def _apply_levels(config: LoggingConfig):
+    logging.getLogger().setLevel(config.level)
+    for name, level in config.module_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+def shutdown_logging():
+    """Flush whatever is still queued and stop the listener"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Manifest of extraction outputs
+
+save_data records every file it writes here (path, user, timestamp, size,
+sha256, section counts) in one SQLite transaction, so "latest for user X",
+"everything since T" and status counts are index lookups instead of
+find | sort over the data directory.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Union
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.db"
+# exactly what save_data names its files - never a sidecar or backup that happens to share the prefix.
+# spotify_soul_data_<user>_<YYYYmmdd>_<HHMMSS>_<micro>.json, or the older spotify_soul_data_<YYYYmmdd>_<HHMMSS>.json
+EXTRACTION_GLOB = "spotify_soul_data_*.json"
+EXTRACTION_PATTERN = re.compile(r"spotify_soul_data_(?:(?P<user>.+)_)?(?P<stamp>\d{8}_\d{6})(?:_(?P<micro>\d{6}))?\.json")
+
+
+def extraction_filename(user_id: Optional[str], when: Optional[datetime.datetime] = None) -> str:
+    """Name for a new extraction - two users finishing in the same second mustn't share one"""
+    when = when or datetime.datetime.now()
+    safe_user = re.sub(r"[^A-Za-z0-9.-]", "-", user_id or "unknown")
+    return f"spotify_soul_data_{safe_user}_{when.strftime('%Y%m%d_%H%M%S_%f')}.json"
+
+
+def _name_timestamp(name: str) -> Optional[datetime.datetime]:
+    match = EXTRACTION_PATTERN.fullmatch(name)
+    if not match:
+        return None
+    stamp = datetime.datetime.strptime(match['stamp'], "%Y%m%d_%H%M%S")
+    return stamp.replace(microsecond=int(match['micro'])) if match['micro'] else stamp
+
+
+def extraction_files(directory: Union[str, Path]) -> List[Path]:
+    """Extraction files in directory, oldest first - names start with the user now, so not name order"""
+    files = [path for path in Path(directory).glob(EXTRACTION_GLOB) if EXTRACTION_PATTERN.fullmatch(path.name)]
+    return sorted(files, key=lambda path: (_name_timestamp(path.name), path.name))
+
+
+def extraction_timestamp(path: Union[str, Path], data: Dict[str, Any]) -> str:
+    """When the extraction ran - its metadata, else the name save_data gave it, else the file's mtime"""
+    stamp = (data.get('extraction_metadata') or {}).get('timestamp')
+    if stamp:
+        return stamp
+    path = Path(path)
+    try:
+        named = _name_timestamp(path.name)
+    except ValueError:
+        named = None
+    if named:
+        return named.isoformat()
+    return datetime.datetime.fromtimestamp(path.stat().st_mtime).isoformat()
+
+
+def section_counts(data: Dict[str, Any]) -> Dict[str, int]:
+    """Item counts per section, e.g. top_tracks_short_term: 50"""
+    counts = {}
+    for section, payload in data.items():
+        if section in ('user_profile', 'extraction_metadata'):
+            continue
+        if isinstance(payload, dict) and 'items' not in payload:
+            for time_range, ranged in payload.items():
+                items = ranged.get('items', []) if isinstance(ranged, dict) else ranged
+                counts[f"{section}_{time_range}"] = len(items or [])
+        elif isinstance(payload, dict):
+            counts[section] = len(payload.get('items') or [])
+        elif isinstance(payload, list):
+            counts[section] = len(payload)
+    return counts
+
+
+class ExtractionManifest:
+    """SQLite index over extraction output files"""
+
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS extractions (
+                    path TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    display_name TEXT,
+                    timestamp TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    sections TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS extractions_user_time ON extractions (user_id, timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS extractions_time ON extractions (timestamp)")
+
+    @classmethod
+    def for_output_dir(cls, output_dir: Union[str, Path]) -> "ExtractionManifest":
+        return cls(Path(output_dir) / MANIFEST_FILE)
+
+    def close(self):
+        self._conn.close()
+
+    def record(self, path: Union[str, Path], data: Dict[str, Any], size: int, sha256: str) -> Dict[str, Any]:
+        metadata = data.get('extraction_metadata') or {}
+        profile = data.get('user_profile') or {}
+        entry = {
+            'path': str(Path(path).resolve()),
+            'user_id': metadata.get('spotify_user_id') or profile.get('id'),
+            'display_name': profile.get('display_name'),
+            'timestamp': extraction_timestamp(path, data),
+            'size': size,
+            'sha256': sha256,
+            'sections': json.dumps(section_counts(data))
+        }
+        # single transaction - readers see the old row or the new one, never half
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES "
+                "(:path, :user_id, :display_name, :timestamp, :size, :sha256, :sections)",
+                entry
+            )
+        return self._decode(entry)
+
+    @staticmethod
+    def _decode(row: Any) -> Dict[str, Any]:
+        entry = dict(row)
+        entry['sections'] = json.loads(entry['sections'])
+        return entry
+
+    def _select(self, where: str = "1", params: tuple = (), order: str = "timestamp DESC",
+                limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        sql = f"SELECT * FROM extractions WHERE {where} ORDER BY {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [self._decode(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def latest(self, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        rows = self._select("user_id = ?", (user_id,), limit=1) if user_id else self._select(limit=1)
+        return rows[0] if rows else None
+
+    def by_hash(self, sha256: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """An extraction by (a prefix of) its sha256 - how an older snapshot is found again"""
+        pattern = sha256.replace("%", "").replace("_", "") + "%"
+        if user_id:
+            rows = self._select("sha256 LIKE ? AND user_id = ?", (pattern, user_id), limit=1)
+        else:
+            rows = self._select("sha256 LIKE ?", (pattern,), limit=1)
+        return rows[0] if rows else None
+
+    def since(self, timestamp: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        if user_id:
+            return self._select("timestamp >= ? AND user_id = ?", (timestamp, user_id), order="timestamp")
+        return self._select("timestamp >= ?", (timestamp,), order="timestamp")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            total, users, size, newest = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_id), COALESCE(SUM(size), 0), MAX(timestamp) FROM extractions"
+            ).fetchone()
+            per_user = self._conn.execute(
+                "SELECT user_id, COUNT(*), MAX(timestamp) FROM extractions GROUP BY user_id ORDER BY 3 DESC"
+            ).fetchall()
+        return {
+            'extractions': total,
+            'users': users,
+            'total_bytes': size,
+            'latest_timestamp': newest,
+            'per_user': [{'user_id': r[0], 'extractions': r[1], 'latest_timestamp': r[2]} for r in per_user]
+        }
+
+    def rebuild(self, raw_dir: Union[str, Path]) -> int:
+        """One-off scan to backfill files written before the manifest existed"""
+        # earlier rebuilds globbed loosely and indexed the reader's section sidecars too
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM extractions WHERE path LIKE '%.json.sections.json'")
+        added = 0
+        for path in extraction_files(raw_dir):
+            raw = path.read_bytes()
+            try:
+                data = json.loads(raw)
+            except ValueError as e:
+                logger.warning(f"Skipping unreadable {path}: {e}")
+                continue
+            self.record(path, data, len(raw), hashlib.sha256(raw).hexdigest())
+            added += 1
+        return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the extraction manifest")
+    parser.add_argument("--data-dir", default="data", help="Directory holding manifest.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    latest = subparsers.add_parser("latest", help="Newest extraction, optionally for one user")
+    latest.add_argument("--user")
+    latest.add_argument("--path-only", action="store_true", help="Print just the file path (for scripts)")
+
+    since = subparsers.add_parser("since", help="Extractions at or after an ISO timestamp")
+    since.add_argument("timestamp")
+    since.add_argument("--user")
+
+    subparsers.add_parser("status", help="Counts per user")
+
+    rebuild = subparsers.add_parser("rebuild", help="Backfill from files in data/raw")
+    rebuild.add_argument("--raw-dir")
+
+    args = parser.parse_args()
+    manifest = ExtractionManifest.for_output_dir(args.data_dir)
+
+    if args.command == "latest":
+        entry = manifest.latest(args.user)
+        if not entry:
+            return 1
+        print(entry['path'] if args.path_only else json.dumps(entry, indent=2))
+    elif args.command == "since":
+        for entry in manifest.since(args.timestamp, args.user):
+            print(f"{entry['timestamp'][:19]}  {entry['user_id'] or '?':<25} {entry['size']:>10,} B  {entry['path']}")
+    elif args.command == "status":
+        status = manifest.status()
+        print(f"Extractions: {status['extractions']} from {status['users']} users ({status['total_bytes']:,} bytes)")
+        print(f"Latest: {status['latest_timestamp'] or 'never'}")
+        for user in status['per_user']:
+            print(f"  {user['user_id'] or '?':<25} {user['extractions']:>5}  latest {user['latest_timestamp'][:19]}")
+    else:
+        added = manifest.rebuild(args.raw_dir or Path(args.data_dir) / "raw")
+        print(f"Indexed {added} files")
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
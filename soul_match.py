@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+"Soul match" - nearest neighbours across users' taste vectors
+
+Each user becomes one fixed-length vector: hashed genre weights, hashed
+artist weights and mean audio features, L2-normalised so a dot product is
+cosine similarity. Vectors live in a growable float32 matrix; a query is one
+matrix-vector product plus argpartition, which stays in the low milliseconds
+at 100k users. Hashing keeps the dimension fixed, so new genres and artists
+never force a rebuild and inserts are O(1).
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+import numpy as np
+
+from soul_analytics import load_extraction, snapshot_user_id, TIME_RANGES
+from soul_manifest import extraction_files
+
+logger = logging.getLogger(__name__)
+
+# same features vibe_check.py pulls, tempo gets scaled to roughly 0-1
+AUDIO_FEATURES = ['energy', 'valence', 'danceability', 'acousticness', 'instrumentalness', 'speechiness', 'liveness', 'tempo']
+TEMPO_SCALE = 200.0
+
+RANGE_WEIGHTS = {'short_term': 0.5, 'medium_term': 0.3, 'long_term': 0.2}
+
+
+@dataclass
+class MatchConfig:
+    """Configuration for taste vectors and the similarity index"""
+    index_path: str = "match/soul_match.npz"
+    genre_dims: int = 128
+    artist_dims: int = 384
+    genre_weight: float = 0.5
+    artist_weight: float = 0.35
+    audio_weight: float = 0.15
+    initial_capacity: int = 1024
+
+    @property
+    def dims(self) -> int:
+        return self.genre_dims + self.artist_dims + len(AUDIO_FEATURES)
+
+
+@lru_cache(maxsize=200000)
+def _hash_slot(token: str, dims: int) -> Tuple[int, float]:
+    # signed feature hashing - collisions cancel out on average instead of piling up
+    digest = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dims, (1.0 if (digest >> 63) & 1 else -1.0)
+
+
+def _hashed(weights: Dict[str, float], dims: int) -> np.ndarray:
+    vector = np.zeros(dims, dtype=np.float32)
+    for token, weight in weights.items():
+        slot, sign = _hash_slot(token, dims)
+        vector[slot] += sign * weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _items(payload: Any) -> List[Dict[str, Any]]:
+    if isinstance(payload, dict):
+        return payload.get('items') or []
+    return payload or []
+
+
+def taste_weights(data: Dict[str, Any]) -> Tuple[Dict[str, float], Dict[str, float], Dict[str, Dict[str, float]]]:
+    """Rank- and range-weighted genre and artist weights, plus per-artist genre weights"""
+    genres: Dict[str, float] = {}
+    artists: Dict[str, float] = {}
+    artist_genres: Dict[str, Dict[str, float]] = {}
+
+    for time_range in TIME_RANGES:
+        items = _items((data.get('top_artists') or {}).get(time_range))
+        range_weight = RANGE_WEIGHTS[time_range]
+        for rank, artist in enumerate(items):
+            if not artist:
+                continue
+            weight = range_weight * (1 - rank / max(len(items), 1))
+            artist_id = artist.get('id') or f"name:{artist.get('name')}"
+            artists[artist_id] = artists.get(artist_id, 0.0) + weight
+
+            artist_genres_list = artist.get('genres') or []
+            if isinstance(artist_genres_list, str):
+                artist_genres_list = [g.strip() for g in artist_genres_list.split(',') if g.strip()]
+            artist_genres[artist_id] = {g: 1.0 for g in artist_genres_list}
+            for genre in artist_genres_list:
+                genres[genre] = genres.get(genre, 0.0) + weight
+
+        # track artists count too, at half weight
+        tracks = _items((data.get('top_tracks') or {}).get(time_range))
+        for rank, track in enumerate(tracks):
+            if not track:
+                continue
+            weight = 0.5 * range_weight * (1 - rank / max(len(tracks), 1))
+            for artist in track.get('artists') or []:
+                artist_id = artist.get('id') or f"name:{artist.get('name')}"
+                artists[artist_id] = artists.get(artist_id, 0.0) + weight
+                # hydrated extractions carry genres on track artists too
+                for genre in artist.get('genres') or []:
+                    genres[genre] = genres.get(genre, 0.0) + weight
+
+    return genres, artists, artist_genres
+
+
+def mean_audio_features(data: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Mean of an 'audio_features' list (sp.audio_features output) if the extraction has one"""
+    features = [f for f in (data.get('audio_features') or []) if f]
+    if not features:
+        return None
+    matrix = np.array([[float(f.get(name) or 0.0) for name in AUDIO_FEATURES] for f in features], dtype=np.float32)
+    matrix[:, AUDIO_FEATURES.index('tempo')] /= TEMPO_SCALE
+    return matrix.mean(axis=0)
+
+
+def taste_vector(data: Dict[str, Any], config: MatchConfig) -> np.ndarray:
+    genres, artists, _ = taste_weights(data)
+    blocks = [
+        config.genre_weight * _hashed(genres, config.genre_dims),
+        config.artist_weight * _hashed(artists, config.artist_dims)
+    ]
+    audio = mean_audio_features(data)
+    if audio is not None:
+        norm = np.linalg.norm(audio)
+        blocks.append(config.audio_weight * (audio / norm if norm else audio))
+    else:
+        blocks.append(np.zeros(len(AUDIO_FEATURES), dtype=np.float32))
+
+    vector = np.concatenate(blocks).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """Normalised vectors in a growable matrix with id lookup and top-k queries"""
+
+    def __init__(self, dims: int, capacity: int = 1024):
+        self.dims = dims
+        self._matrix = np.zeros((capacity, dims), dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, item_id: str):
+        return item_id in self._rows
+
+    def upsert(self, item_id: str, vector: np.ndarray):
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row is None:
+                row = len(self._ids)
+                if row == self._matrix.shape[0]:
+                    # double capacity - amortised O(1) inserts
+                    grown = np.zeros((self._matrix.shape[0] * 2, self.dims), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._ids.append(item_id)
+                self._rows[item_id] = row
+            self._matrix[row] = vector
+
+    def vector(self, item_id: str) -> Optional[np.ndarray]:
+        row = self._rows.get(item_id)
+        return None if row is None else self._matrix[row]
+
+    def query(self, vector: np.ndarray, k: int = 10, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        with self._lock:
+            count = len(self._ids)
+            if count == 0:
+                return []
+            scores = self._matrix[:count] @ vector
+            if exclude is not None and exclude in self._rows:
+                scores[self._rows[exclude]] = -np.inf
+
+            k = min(k, count - (1 if exclude in self._rows else 0))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i])) for i in top]
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            return np.array(self._ids, dtype=object), self._matrix[:len(self._ids)].copy()
+
+    @classmethod
+    def from_arrays(cls, ids: Iterable[str], matrix: np.ndarray, capacity: int = 1024) -> "VectorIndex":
+        ids = list(ids)
+        index = cls(matrix.shape[1], max(capacity, len(ids)))
+        index._matrix[:len(ids)] = matrix
+        index._ids = ids
+        index._rows = {item_id: row for row, item_id in enumerate(ids)}
+        return index
+
+
+class SoulMatchIndex:
+    """User-to-user and artist-to-artist similarity"""
+
+    def __init__(self, config: Optional[MatchConfig] = None):
+        self.config = config or MatchConfig()
+        self.users = VectorIndex(self.config.dims, self.config.initial_capacity)
+        self.artists = VectorIndex(self.config.genre_dims, self.config.initial_capacity)
+        self.names: Dict[str, str] = {}
+
+    def add_extraction(self, data: Dict[str, Any], user_id: Optional[str] = None) -> Optional[str]:
+        """Insert or refresh one user (and the artists they listen to)"""
+        user_id = user_id or snapshot_user_id(data)
+        if not user_id:
+            logger.warning("Skipping extraction with no user id")
+            return None
+
+        self.users.upsert(user_id, taste_vector(data, self.config))
+        profile = data.get('user_profile') or {}
+        if profile.get('display_name'):
+            self.names[user_id] = profile['display_name']
+
+        _, _, artist_genres = taste_weights(data)
+        for artist_id, genres in artist_genres.items():
+            if genres:
+                self.artists.upsert(artist_id, _hashed(genres, self.config.genre_dims))
+        for time_range in TIME_RANGES:
+            for artist in _items((data.get('top_artists') or {}).get(time_range)):
+                if artist and artist.get('id'):
+                    self.names[artist['id']] = artist.get('name')
+        return user_id
+
+    def similar_users(self, user_id: str, k: int = 10) -> List[Dict[str, Any]]:
+        vector = self.users.vector(user_id)
+        if vector is None:
+            raise KeyError(f"Unknown user: {user_id}")
+        return [
+            {'user_id': other, 'name': self.names.get(other), 'similarity': round(score, 4)}
+            for other, score in self.users.query(vector, k, exclude=user_id)
+        ]
+
+    def similar_artists(self, artist_id: str, k: int = 10) -> List[Dict[str, Any]]:
+        vector = self.artists.vector(artist_id)
+        if vector is None:
+            raise KeyError(f"Unknown artist (or no genres): {artist_id}")
+        return [
+            {'artist_id': other, 'name': self.names.get(other), 'similarity': round(score, 4)}
+            for other, score in self.artists.query(vector, k, exclude=artist_id)
+        ]
+
+    def save(self, path: Optional[str] = None) -> Path:
+        path = Path(path or self.config.index_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        user_ids, user_matrix = self.users.arrays()
+        artist_ids, artist_matrix = self.artists.arrays()
+        # write to a temp name first so a crash never leaves half an index
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                user_ids=user_ids.astype(str),
+                user_matrix=user_matrix,
+                artist_ids=artist_ids.astype(str),
+                artist_matrix=artist_matrix,
+                names=np.array([json.dumps(self.names, ensure_ascii=False)])
+            )
+        tmp_path.replace(path)
+        logger.info(f"Saved match index: {len(self.users)} users, {len(self.artists)} artists -> {path}")
+        return path
+
+    @classmethod
+    def load(cls, config: Optional[MatchConfig] = None) -> "SoulMatchIndex":
+        config = config or MatchConfig()
+        index = cls(config)
+        path = Path(config.index_path)
+        if not path.exists():
+            return index
+
+        with np.load(path, allow_pickle=False) as stored:
+            if stored['user_matrix'].shape[1:] not in ((config.dims,), (0,)):
+                raise ValueError(f"Index at {path} was built with different dimensions - rebuild it")
+            index.users = VectorIndex.from_arrays(stored['user_ids'].tolist(), stored['user_matrix'], config.initial_capacity)
+            index.artists = VectorIndex.from_arrays(stored['artist_ids'].tolist(), stored['artist_matrix'], config.initial_capacity)
+            index.names = json.loads(str(stored['names'][0]))
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find users and artists with similar taste")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add = subparsers.add_parser("add", help="Insert extractions into the index")
+    add.add_argument("files", nargs="+")
+
+    users = subparsers.add_parser("users", help="Most similar users")
+    users.add_argument("user_id")
+    users.add_argument("-k", type=int, default=10)
+
+    artists = subparsers.add_parser("artists", help="Most similar artists")
+    artists.add_argument("artist_id")
+    artists.add_argument("-k", type=int, default=10)
+
+    args = parser.parse_args()
+    index = SoulMatchIndex.load()
+
+    if args.command == "add":
+        added = 0
+        for file in args.files:
+            paths = extraction_files(file) if Path(file).is_dir() else [Path(file)]
+            for path in paths:
+                data, _ = load_extraction(path)
+                if index.add_extraction(data):
+                    added += 1
+        index.save()
+        print(f"Indexed {added} extractions ({len(index.users)} users total)")
+        return 0
+
+    try:
+        if args.command == "users":
+            results = index.similar_users(args.user_id, args.k)
+        else:
+            results = index.similar_artists(args.artist_id, args.k)
+    except KeyError as e:
+        print(e)
+        return 1
+
+    for result in results:
+        label = result['name'] or result.get('user_id') or result.get('artist_id')
+        print(f"{result['similarity']:.3f}  {label}")
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory model for many users' extractions
+
+Raw spotipy dicts cost a dict per track, a str per key and a fresh copy of
+every id, name and genre for every user. A SoulBatch keeps:
+
+- one StringPool shared by everything, so each distinct string exists once
+  and rows hold int codes
+- one catalog row per unique track / artist (most users share most artists)
+- per-user placements (top / recent / saved, rank, played_at) as typed arrays,
+  each user's rows contiguous so reading one user back is a slice
+- audio features as a flat float array, len(AUDIO_FEATURES) per track (NaN = unknown)
+
+Conversion back to the usual JSON shapes is provided so existing code can
+keep taking dicts. It gives back what that user's extraction said: genres
+only where their extraction had them, and their values where they differ
+from what another user's extraction taught the catalog.
+"""
+
+import argparse
+import datetime
+import logging
+import math
+import tracemalloc
+from array import array
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Iterable, Iterator, Set, Tuple
+
+from soul_analytics import TIME_RANGES, load_extraction
+from soul_manifest import extraction_files
+from soul_match import AUDIO_FEATURES
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ('top_tracks', 'recent_tracks', 'saved_tracks')
+MISSING = -1
+
+
+class StringPool:
+    """Interned strings addressed by int code (-1 is None)"""
+    __slots__ = ('strings', '_codes')
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return MISSING
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self._codes[value] = code
+            self.strings.append(value)
+        return code
+
+    def find(self, value: Optional[str]) -> int:
+        """Code of an already interned string, -1 if unseen"""
+        return self._codes.get(value, MISSING)
+
+    def get(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.strings[code]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class Ragged:
+    """Variable-length int lists (track artists, artist genres) in two flat arrays"""
+    __slots__ = ('offsets', 'values')
+
+    def __init__(self):
+        self.offsets = array('q', [0])
+        self.values = array('i')
+
+    def append(self, codes: Iterable[int]) -> int:
+        self.values.extend(codes)
+        self.offsets.append(len(self.values))
+        return len(self.offsets) - 2
+
+    def replace_last(self, codes: Iterable[int]):
+        del self.values[self.offsets[-2]:]
+        self.values.extend(codes)
+        self.offsets[-1] = len(self.values)
+
+    def __getitem__(self, row: int) -> array:
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+
+class Track:
+    """Row view of one catalog track"""
+    __slots__ = ('id', 'name', 'album', 'artists', 'duration_ms', 'popularity')
+
+    def __init__(self, id, name, album, artists, duration_ms, popularity):
+        self.id = id
+        self.name = name
+        self.album = album
+        self.artists = artists
+        self.duration_ms = duration_ms
+        self.popularity = popularity
+
+
+class Artist:
+    """Row view of one catalog artist"""
+    __slots__ = ('id', 'name', 'genres', 'popularity')
+
+    def __init__(self, id, name, genres, popularity):
+        self.id = id
+        self.name = name
+        self.genres = genres
+        self.popularity = popularity
+
+
+def _epoch_ms(value: Optional[str]) -> int:
+    if not value:
+        return MISSING
+    return int(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+def _iso(ms: int) -> Optional[str]:
+    if ms < 0:
+        return None
+    stamp = datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc)
+    return stamp.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _items(payload: Any) -> List[Dict[str, Any]]:
+    if isinstance(payload, dict):
+        return payload.get('items') or []
+    return payload or []
+
+
+class SoulBatch:
+    """Struct-of-arrays store for any number of users' extractions"""
+
+    def __init__(self):
+        self.pool = StringPool()
+
+        # artist catalog - one row per artist id
+        self._artist_rows: Dict[int, int] = {}
+        self.artist_id = array('i')
+        self.artist_name = array('i')
+        self.artist_popularity = array('h')
+        self.artist_genres = Ragged()
+        # 1 once a full artist object told us the genres (maybe none), 0 for simplified-only
+        self.artist_known = array('b')
+        # genres learned after an artist's row was written - (start, end) into artist_genres.values
+        self._genre_override: Dict[int, tuple] = {}
+
+        # track catalog - one row per track id
+        self._track_rows: Dict[int, int] = {}
+        self.track_id = array('i')
+        self.track_name = array('i')
+        self.track_album = array('i')
+        self.track_duration = array('i')
+        self.track_popularity = array('h')
+        self.track_artists = Ragged()  # artist catalog rows
+        self.track_features = array('f')
+
+        # placements - one row per track appearance in a user's extraction
+        self.place_user = array('i')
+        self.place_section = array('b')
+        self.place_range = array('b')
+        self.place_rank = array('h')
+        self.place_track = array('i')
+        self.place_time = array('q')  # played_at / added_at, epoch ms
+
+        # top artists - one row per (user, range, rank)
+        self.top_user = array('i')
+        self.top_range = array('b')
+        self.top_rank = array('h')
+        self.top_artist = array('i')
+
+        # per user - artist rows whose track artists carried genres in their extraction
+        self.user_hydrated = Ragged()
+        # (user code, artist row, as top artist) -> genre codes, where the user's extraction
+        # disagrees with the catalog - top artists and track artists can disagree too
+        self._user_genres: Dict[Tuple[int, int, bool], List[int]] = {}
+        # user id -> (placement start, end, top artist start, end, user_hydrated row)
+        self._spans: Dict[str, Tuple[int, int, int, int, int]] = {}
+
+        self.users: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self.users)
+
+    # -- building ----------------------------------------------------------
+
+    def _artist_row(self, artist: Dict[str, Any]) -> int:
+        pool = self.pool
+        key = pool.code(artist.get('id') or f"name:{artist.get('name')}")
+        row = self._artist_rows.get(key)
+        genres = artist.get('genres')
+        if row is None:
+            row = len(self.artist_id)
+            self._artist_rows[key] = row
+            self.artist_id.append(key)
+            self.artist_name.append(pool.code(artist.get('name')))
+            self.artist_popularity.append(artist.get('popularity') if artist.get('popularity') is not None else MISSING)
+            self.artist_genres.append(pool.code(g) for g in genres or ())
+            self.artist_known.append('genres' in artist)
+        elif 'genres' in artist and not self.artist_known[row]:
+            # first sighting was a simplified artist - fill in what the full object knows
+            if row == len(self.artist_id) - 1:
+                self.artist_genres.replace_last(pool.code(g) for g in genres or ())
+            elif genres:
+                # rare - move the genres to the end and repoint this row
+                start = len(self.artist_genres.values)
+                self.artist_genres.values.extend(pool.code(g) for g in genres)
+                self._genre_override[row] = (start, len(self.artist_genres.values))
+            self.artist_known[row] = 1
+            if artist.get('popularity') is not None:
+                self.artist_popularity[row] = artist['popularity']
+        return row
+
+    def _user_artist(self, user: int, artist: Dict[str, Any], hydrated: Optional[Set[int]]) -> int:
+        # catalog row for an artist as this user's extraction saw it - hydrated is None for top artists
+        row = self._artist_row(artist)
+        if 'genres' in artist:
+            if hydrated is not None:
+                hydrated.add(row)
+            codes = [self.pool.code(g) for g in artist['genres'] or ()]
+            if codes != list(self._genre_codes(row)):
+                self._user_genres[(user, row, hydrated is None)] = codes
+        return row
+
+    def _track_row(self, track: Dict[str, Any]) -> int:
+        pool = self.pool
+        key = pool.code(track.get('id') or f"name:{track.get('name')}")
+        row = self._track_rows.get(key)
+        if row is None:
+            row = len(self.track_id)
+            self._track_rows[key] = row
+            album = track.get('album')
+            self.track_id.append(key)
+            self.track_name.append(pool.code(track.get('name')))
+            self.track_album.append(pool.code(album.get('name') if isinstance(album, dict) else album))
+            self.track_duration.append(track.get('duration_ms') or 0)
+            self.track_popularity.append(track.get('popularity') if track.get('popularity') is not None else MISSING)
+            self.track_artists.append([self._artist_row(a) for a in track.get('artists') or [] if isinstance(a, dict)])
+            self.track_features.extend([math.nan] * len(AUDIO_FEATURES))
+        return row
+
+    def _set_features(self, features: Dict[str, Any]):
+        row = self._track_rows.get(self.pool.find(features.get('id')))
+        if row is None:
+            return
+        base = row * len(AUDIO_FEATURES)
+        for offset, name in enumerate(AUDIO_FEATURES):
+            if features.get(name) is not None:
+                self.track_features[base + offset] = float(features[name])
+
+    def add_extraction(self, data: Dict[str, Any]) -> str:
+        """Convert one raw extraction into the batch, returns its user id"""
+        metadata = data.get('extraction_metadata') or {}
+        profile = data.get('user_profile') or {}
+        user_id = metadata.get('spotify_user_id') or profile.get('id') or f"user{len(self.users)}"
+        if user_id in self.users:
+            raise ValueError(f"{user_id} is already in this batch")
+        user = self.pool.code(user_id)
+        self.users[user_id] = {'user_profile': profile, 'extraction_metadata': metadata}
+        place_start, top_start = len(self.place_user), len(self.top_user)
+        hydrated: Set[int] = set()
+
+        for range_code, time_range in enumerate(TIME_RANGES):
+            for rank, artist in enumerate(_items((data.get('top_artists') or {}).get(time_range))):
+                if artist:
+                    self.top_user.append(user)
+                    self.top_range.append(range_code)
+                    self.top_rank.append(rank)
+                    self.top_artist.append(self._user_artist(user, artist, None))
+
+        for section_code, section in enumerate(SECTIONS):
+            payload = data.get(section) or {}
+            if section == 'top_tracks':
+                ranged = [(TIME_RANGES.index(r), _items(p)) for r, p in payload.items() if r in TIME_RANGES]
+            else:
+                ranged = [(MISSING, _items(payload))]
+            for range_code, items in ranged:
+                for rank, item in enumerate(items):
+                    track = item.get('track', item) if item else None
+                    if not track:
+                        continue
+                    self.place_user.append(user)
+                    self.place_section.append(section_code)
+                    self.place_range.append(range_code)
+                    self.place_rank.append(rank)
+                    self.place_track.append(self._track_row(track))
+                    self.place_time.append(_epoch_ms(item.get('played_at') or item.get('added_at')))
+                    # the catalog row may come from another user - note what this one's artists carried
+                    for artist in track.get('artists') or []:
+                        if isinstance(artist, dict):
+                            self._user_artist(user, artist, hydrated)
+
+        for features in data.get('audio_features') or []:
+            if features:
+                self._set_features(features)
+        self._spans[user_id] = (place_start, len(self.place_user), top_start, len(self.top_user),
+                                self.user_hydrated.append(sorted(hydrated)))
+        return user_id
+
+    def add_many(self, datasets: Iterable[Dict[str, Any]]) -> List[str]:
+        return [self.add_extraction(data) for data in datasets]
+
+    # -- reading -----------------------------------------------------------
+
+    def _genre_codes(self, row: int) -> array:
+        override = self._genre_override.get(row)
+        return self.artist_genres.values[override[0]:override[1]] if override else self.artist_genres[row]
+
+    def _genres(self, row: int, user: int = MISSING, top: bool = False) -> List[str]:
+        codes = self._user_genres.get((user, row, top))
+        if codes is None:
+            codes = self._genre_codes(row)
+        return [self.pool.strings[c] for c in codes]
+
+    def artist(self, row: int) -> Artist:
+        pool = self.pool
+        popularity = self.artist_popularity[row]
+        return Artist(pool.get(self.artist_id[row]), pool.get(self.artist_name[row]),
+                      self._genres(row), None if popularity < 0 else popularity)
+
+    def track(self, row: int) -> Track:
+        pool = self.pool
+        popularity = self.track_popularity[row]
+        return Track(pool.get(self.track_id[row]), pool.get(self.track_name[row]), pool.get(self.track_album[row]),
+                     [self.artist(a) for a in self.track_artists[row]], self.track_duration[row],
+                     None if popularity < 0 else popularity)
+
+    def features(self, row: int) -> Optional[Dict[str, float]]:
+        base = row * len(AUDIO_FEATURES)
+        values = self.track_features[base:base + len(AUDIO_FEATURES)]
+        if all(math.isnan(v) for v in values):
+            return None
+        return {name: v for name, v in zip(AUDIO_FEATURES, values) if not math.isnan(v)}
+
+    def _artist_dict(self, row: int, user: int, with_genres: bool, top: bool = False) -> Dict[str, Any]:
+        pool = self.pool
+        result = {'id': pool.get(self.artist_id[row]), 'name': pool.get(self.artist_name[row])}
+        if with_genres:
+            popularity = self.artist_popularity[row]
+            result['genres'] = self._genres(row, user, top)
+            result['popularity'] = None if popularity < 0 else popularity
+        return result
+
+    def _track_dict(self, row: int, user: int, hydrated: Set[int]) -> Dict[str, Any]:
+        track = self.track(row)
+        return {
+            'id': track.id,
+            'name': track.name,
+            'artists': [self._artist_dict(a, user, a in hydrated) for a in self.track_artists[row]],
+            'album': {'name': track.album},
+            'duration_ms': track.duration_ms,
+            'popularity': track.popularity
+        }
+
+    def to_extraction(self, user_id: str) -> Dict[str, Any]:
+        """Back to the raw extraction shape (the fields the pipeline uses)"""
+        user = self.pool.find(user_id)
+        place_start, place_end, top_start, top_end, hydrated_row = self._spans[user_id]
+        hydrated = set(self.user_hydrated[hydrated_row])
+        data: Dict[str, Any] = {
+            **self.users[user_id],
+            'top_tracks': {r: {'items': []} for r in TIME_RANGES},
+            'top_artists': {r: {'items': []} for r in TIME_RANGES},
+            'recent_tracks': {'items': []},
+            'saved_tracks': {'items': []}
+        }
+        feature_rows = set()
+        for i in range(top_start, top_end):
+            data['top_artists'][TIME_RANGES[self.top_range[i]]]['items'].append(
+                self._artist_dict(self.top_artist[i], user, True, top=True))
+        for i in range(place_start, place_end):
+            section = SECTIONS[self.place_section[i]]
+            track = self._track_dict(self.place_track[i], user, hydrated)
+            feature_rows.add(self.place_track[i])
+            if section == 'top_tracks':
+                data['top_tracks'][TIME_RANGES[self.place_range[i]]]['items'].append(track)
+            else:
+                key = 'played_at' if section == 'recent_tracks' else 'added_at'
+                data[section]['items'].append({'track': track, key: _iso(self.place_time[i])})
+
+        audio_features = []
+        for row in sorted(feature_rows):
+            features = self.features(row)
+            if features:
+                audio_features.append({'id': self.pool.get(self.track_id[row]), **features})
+        if audio_features:
+            data['audio_features'] = audio_features
+        return data
+
+    def to_processed(self, user_id: str) -> Dict[str, Any]:
+        """The shape soulpull.py's process_soul_data produces"""
+        data = self.to_extraction(user_id)
+        profile = data.get('user_profile') or {}
+
+        def processed_track(track):
+            genres = sorted({g for a in track['artists'] for g in a.get('genres', [])})
+            return {'name': track['name'], 'artist': ", ".join(a['name'] for a in track['artists']),
+                    'album': track['album']['name'], 'genres': ", ".join(genres)}
+
+        return {
+            'user_profile': {
+                'display_name': profile.get('display_name'),
+                'email': profile.get('email'),
+                'spotify_uri': profile.get('uri'),
+                'profile_url': (profile.get('external_urls') or {}).get('spotify')
+            },
+            'top_tracks': {r: [processed_track(t) for t in p['items']] for r, p in data['top_tracks'].items()},
+            'top_artists': {r: [{'name': a['name'], 'genres': ", ".join(a['genres'])} for a in p['items']]
+                            for r, p in data['top_artists'].items()},
+            'recent_tracks': [processed_track(i['track']) for i in data['recent_tracks']['items']]
+        }
+
+    def plays(self, user_id: Optional[str] = None) -> Iterator[tuple]:
+        """(user_id, track row, played_at ms) for recent plays"""
+        recent = SECTIONS.index('recent_tracks')
+        if user_id is None:
+            start, end = 0, len(self.place_user)
+        elif user_id in self._spans:
+            start, end = self._spans[user_id][:2]
+        else:
+            return
+        for i in range(start, end):
+            if self.place_section[i] == recent:
+                yield self.pool.strings[self.place_user[i]], self.place_track[i], self.place_time[i]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'users': len(self.users),
+            'strings': len(self.pool),
+            'tracks': len(self.track_id),
+            'artists': len(self.artist_id),
+            'placements': len(self.place_user),
+            'top_artist_rows': len(self.top_user),
+            'genre_overrides': len(self._user_genres)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load extractions into a compact batch and report its size")
+    parser.add_argument("paths", nargs="+", help="Extraction files or directories of them")
+    args = parser.parse_args()
+
+    files = []
+    for path in map(Path, args.paths):
+        files.extend(extraction_files(path) if path.is_dir() else [path])
+
+    tracemalloc.start()
+    batch = SoulBatch()
+    for file in files:
+        data, _ = load_extraction(file)
+        try:
+            batch.add_extraction(data)
+        except ValueError as e:
+            # one batch per user - a second extraction of theirs is skipped
+            logger.warning("Skipping %s: %s", file, e)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for name, value in batch.stats().items():
+        print(f"{name:>16}: {value}")
+    print(f"{'memory':>16}: {current / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+JSON persistence shared by every output path
+
+- orjson when it's installed (it's in requirements.txt), stdlib json otherwise
+- indented by default, compact=True for caches and machine-only files
+- atomic writes: temp file in the same directory, fsync, rename. A crash
+  mid-write leaves the previous file (or nothing), never half a JSON - so
+  get_latest_token and the manifest can't pick up a truncated file.
+
+Temp files are named .<name>.<random>.tmp so nothing globbing for *.json
+ever sees them.
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+
+def dumps(data: Any, compact: bool = False, sort_keys: bool = False) -> bytes:
+    """UTF-8 JSON bytes - indent=2 unless compact"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, default=str, option=option)
+        except TypeError:
+            # ints past 64 bits and the like - stdlib handles those
+            pass
+    if compact:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys, default=str)
+    else:
+        text = json.dumps(data, ensure_ascii=False, indent=2, sort_keys=sort_keys, default=str)
+    return text.encode('utf-8')
+
+
+def loads(payload: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def read_json(path: PathLike) -> Any:
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def atomic_write(path: PathLike, payload: bytes, mode: int = 0o644, fsync: bool = True) -> int:
+    """Replace path with payload in one step, returns bytes written"""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        # mkstemp makes it 0600 - fine for tokens, everything else wants the usual mode
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        _fsync_dir(path.parent)
+    return len(payload)
+
+
+def _fsync_dir(directory: Path):
+    # makes the rename itself durable - not possible everywhere (windows)
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_json(path: PathLike, data: Any, compact: bool = False, sort_keys: bool = False,
+               mode: int = 0o644, fsync: bool = True) -> bytes:
+    """Serialize and atomically write data, returns the bytes written (for hashing/sizes)"""
+    payload = dumps(data, compact=compact, sort_keys=sort_keys)
+    atomic_write(path, payload, mode=mode, fsync=fsync)
+    return payload
+
+
+def write_text(path: PathLike, text: str, mode: int = 0o644, fsync: bool = True) -> int:
+    return atomic_write(path, text.encode('utf-8'), mode=mode, fsync=fsync)
+
+
+def benchmark(data: Any, rounds: int = 5) -> dict:
+    """MB/s for stdlib json.dump vs this module, indented and compact"""
+    size = len(dumps(data))
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / "bench.json"
+
+        def best(func) -> float:
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        def stdlib():
+            with open(target, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+
+        results = {
+            'encoder': 'orjson' if orjson is not None else 'json',
+            'bytes': size,
+            'json.dump indent=2': best(stdlib),
+            'write_json': best(lambda: write_json(target, data)),
+            'write_json no fsync': best(lambda: write_json(target, data, fsync=False)),
+            'write_json compact': best(lambda: write_json(target, data, compact=True)),
+            'read json.load': best(lambda: json.loads(target.read_bytes())),
+            'read_json': best(lambda: read_json(target)),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure JSON write throughput on an extraction file")
+    parser.add_argument("file", help="Any JSON file, e.g. an extraction from data/raw")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    data = read_json(args.file)
+    results = benchmark(data, args.rounds)
+    megabytes = results['bytes'] / 1e6
+    print(f"{args.file}: {results['bytes']:,} bytes, encoder {results['encoder']}")
+    for name, seconds in results.items():
+        if isinstance(seconds, float):
+            print(f"  {name:<22} {seconds * 1000:>8.1f} ms  {megabytes / seconds:>7.1f} MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
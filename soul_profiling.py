@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Timing spans for the extraction pipeline
+
+A Profiler records nested spans (stage/api.top_tracks, stage/sleep.rate_limit,
+...) as count / total / max per path. That's a few dict updates per span, so
+it's always on. Spans opened on worker threads (artist hydration) hang off
+whatever the main thread has open at the time.
+
+With profile_dir set, each top-level stage also runs under cProfile and
+leaves <stage>.prof plus a readable <stage>.txt behind.
+
+Per-run span dicts are appended to timings.jsonl in the output directory;
+aggregate_timings / the CLI fold many runs into per-path means and p95s.
+"""
+
+import argparse
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, Iterable, List
+
+from soul_persist import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+TIMINGS_FILE = "timings.jsonl"
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'path', 'parent', 'start', 'cprofile')
+
+    def __init__(self, profiler: "Profiler", name: str, cprofile: bool):
+        self.profiler = profiler
+        self.name = name
+        self.cprofile = cprofile
+
+    def __enter__(self):
+        profiler = self.profiler
+        local = profiler._local
+        self.parent = getattr(local, 'path', None)
+        if self.parent is None and threading.get_ident() != profiler._main_thread:
+            # worker thread - borrow the main thread's current span as parent
+            self.parent = profiler._main_path
+        self.path = f"{self.parent}/{self.name}" if self.parent else self.name
+        local.path = self.path
+        if threading.get_ident() == profiler._main_thread:
+            profiler._main_path = self.path
+        if self.cprofile:
+            self.cprofile = profiler._start_cprofile(self.parent)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        if self.cprofile:
+            profiler._stop_cprofile(self.cprofile, self.path)
+        profiler._record(self.path, elapsed)
+        profiler._local.path = self.parent
+        if threading.get_ident() == profiler._main_thread:
+            profiler._main_path = self.parent
+        return False
+
+
+class Profiler:
+    """Nested timing spans for one pipeline run"""
+
+    def __init__(self, profile_dir: Optional[Path] = None):
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self._spans: Dict[str, List[float]] = {}  # path -> [count, total seconds, max seconds]
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main_thread = threading.get_ident()
+        self._main_path: Optional[str] = None
+        self.started = time.perf_counter()
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name, False)
+
+    def stage(self, name: str) -> _Span:
+        """A span that's also cProfiled when profile_dir is set (top level only)"""
+        return _Span(self, name, self.profile_dir is not None)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def _record(self, path: str, elapsed: float):
+        with self._lock:
+            entry = self._spans.get(path)
+            if entry is None:
+                self._spans[path] = [1, elapsed, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed > entry[2]:
+                    entry[2] = elapsed
+
+    def _start_cprofile(self, parent: Optional[str]):
+        # cProfile can't nest - only stages opened at the top level of the main thread
+        if parent is not None or threading.get_ident() != self._main_thread:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running (e.g. python -m cProfile)
+            return None
+        return profile
+
+    def _stop_cprofile(self, profile: cProfile.Profile, path: str):
+        profile.disable()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.profile_dir / path.replace("/", "_")
+        profile.dump_stats(f"{stem}.prof")
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(25)
+        Path(f"{stem}.txt").write_text(text.getvalue(), encoding='utf-8')
+
+    def report(self) -> Dict[str, Any]:
+        """Span totals so far, JSON-ready"""
+        with self._lock:
+            spans = {
+                path: {'count': count, 'total_ms': round(total * 1000, 3), 'max_ms': round(longest * 1000, 3)}
+                for path, (count, total, longest) in sorted(self._spans.items())
+            }
+            counters = dict(self._counters)
+        return {
+            'wall_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'spans': spans,
+            'counters': counters
+        }
+
+
+def format_report(report: Dict[str, Any], top: int = 20) -> str:
+    lines = [f"Wall time: {report['wall_ms'] / 1000:.2f}s"]
+    spans = sorted(report['spans'].items(), key=lambda pair: -pair[1]['total_ms'])[:top]
+    for path, span in spans:
+        lines.append(f"  {path:<52} {span['count']:>5}x {span['total_ms']:>10.1f} ms  (max {span['max_ms']:.1f})")
+    for name, value in report.get('counters', {}).items():
+        lines.append(f"  {name}: {value}")
+    return "\n".join(lines)
+
+
+def append_timings(output_dir: Path, report: Dict[str, Any], **context):
+    """One line per run in <output_dir>/timings.jsonl"""
+    path = Path(output_dir) / TIMINGS_FILE
+    with open(path, 'ab') as f:
+        f.write(dumps({**context, **report}, compact=True) + b"\n")
+
+
+def load_timings(path: Path, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    if not Path(path).exists():
+        return []
+    with open(path, 'rb') as f:
+        runs = [loads(line) for line in f if line.strip()]
+    return [run for run in runs if not user_id or run.get('user_id') == user_id]
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def aggregate_timings(reports: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fold per-run reports into per-path stats across runs"""
+    per_path: Dict[str, Dict[str, Any]] = {}
+    counters: Dict[str, int] = {}
+    walls = []
+    for report in reports:
+        walls.append(report['wall_ms'])
+        for path, span in report['spans'].items():
+            entry = per_path.setdefault(path, {'runs': 0, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'per_run': []})
+            entry['runs'] += 1
+            entry['count'] += span['count']
+            entry['total_ms'] += span['total_ms']
+            entry['max_ms'] = max(entry['max_ms'], span['max_ms'])
+            entry['per_run'].append(span['total_ms'])
+        for name, value in report.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+
+    for entry in per_path.values():
+        per_run = entry.pop('per_run')
+        entry['total_ms'] = round(entry['total_ms'], 3)
+        entry['mean_ms'] = round(entry['total_ms'] / entry['runs'], 3)
+        entry['p95_ms'] = round(_percentile(per_run, 0.95), 3)
+    return {
+        'runs': len(walls),
+        'wall_ms': round(sum(walls), 3),
+        'mean_wall_ms': round(sum(walls) / len(walls), 3) if walls else 0.0,
+        'spans': per_path,
+        'counters': counters
+    }
+
+
+def format_aggregate(aggregate: Dict[str, Any], top: int = 25) -> str:
+    lines = [f"{aggregate['runs']} runs, mean wall {aggregate['mean_wall_ms'] / 1000:.2f}s"]
+    spans = sorted(aggregate['spans'].items(), key=lambda pair: -pair[1]['total_ms'])[:top]
+    for path, span in spans:
+        lines.append(f"  {path:<52} mean {span['mean_ms']:>9.1f} ms  p95 {span['p95_ms']:>9.1f} ms  "
+                     f"{span['count'] / span['runs']:>6.1f} calls/run")
+    for name, value in aggregate['counters'].items():
+        lines.append(f"  {name}: {value} total")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Where extraction time goes, across runs")
+    parser.add_argument("--data-dir", default="data", help="Directory holding timings.jsonl")
+    parser.add_argument("--user", help="Only this user's runs")
+    parser.add_argument("--last", type=int, help="Only the last N runs")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    runs = load_timings(Path(args.data_dir) / TIMINGS_FILE, args.user)
+    if args.last:
+        runs = runs[-args.last:]
+    if not runs:
+        print("No timings recorded yet")
+        return 1
+    print(format_aggregate(aggregate_timings(runs), args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
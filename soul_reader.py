@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Streaming, section-selective reader for extraction files
+
+Full-library extractions run to tens of MB, and json.load + pprint on the
+whole thing freezes the terminal. This mmaps the file, finds the byte range of
+each top-level section without building any objects (line indentation for
+the pretty-printed files save_data writes, a token scan otherwise), and caches
+those offsets in a small sidecar under .index/ next to the file (its own
+directory, so globs over the extractions never pick it up). Reading a section then decodes one item at
+a time, so memory stays at roughly one item and output starts immediately.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import mmap
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Any, Optional, Iterator, List, Tuple, Union
+
+from soul_persist import write_json
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = ".index"
+INDEX_SUFFIX = ".sections.json"
+
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\],:]', re.DOTALL)
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_WHITESPACE = b" \t\r\n"
+
+
+def _children(buf, start: int) -> Iterator[Tuple[Optional[str], int, int]]:
+    """Yield (key, value_start, value_end) for each direct child of the object/array opening at start
+
+    Keys are None for array elements. Nested values are skipped without being
+    decoded.
+    """
+    if buf[start + 1:start + 2] == b"\n":
+        yield from _pretty_children(buf, start)
+    else:
+        yield from _compact_children(buf, start)
+
+
+def _pretty_children(buf, start: int) -> Iterator[Tuple[Optional[str], int, int]]:
+    # indented output (everything save_data writes) - a raw newline can't appear
+    # inside a JSON string, so a child starts exactly where a line is indented one
+    # level deeper than the line holding the bracket. regex does the skipping in C.
+    first_line = start + 2
+    pad = buf[first_line:first_line + 1]
+    line_start = buf.rfind(b"\n", 0, start) + 1
+    indent = len(buf[line_start:start]) - len(buf[line_start:start].lstrip(pad))
+    child_indent = len(buf[first_line:first_line + 256]) - len(buf[first_line:first_line + 256].lstrip(pad))
+    if pad not in (b" ", b"\t") or child_indent <= indent:
+        # not indented the way json.dump does it (tabs are fine) - the token scan copes with any layout
+        yield from _compact_children(buf, start)
+        return
+
+    closing = re.compile(b"\n" + pad * indent + b"[}\\]]").search(buf, start)
+    if closing is None:
+        raise ValueError(f"Unterminated container at byte {start}")
+    end = closing.start()
+
+    is_object = buf[start:start + 1] == b"{"
+    child_line = re.compile(b"\n" + pad * child_indent + b"(?![ \t}\\]])")
+    # lazy, one child of lookahead - the first item is out before the rest is scanned
+    starts = (m.end() for m in child_line.finditer(buf, start, end))
+    child_start = next(starts, None)
+    while child_start is not None:
+        next_start = next(starts, None)
+        child_end = next_start - child_indent - 1 if next_start is not None else end
+        # drop the separating comma
+        child_end = child_start + len(buf[child_start:child_end].rstrip(_WHITESPACE).rstrip(b","))
+        key = None
+        value_start = child_start
+        if is_object:
+            string = _STRING.match(buf, child_start)
+            key = json.loads(string.group())
+            value_start = buf.find(b":", string.end()) + 1
+        yield key, value_start, child_end
+        child_start = next_start
+
+
+def _compact_children(buf, start: int) -> Iterator[Tuple[Optional[str], int, int]]:
+    is_object = buf[start:start + 1] == b"{"
+    depth = 0
+    key = None
+    value_start = start + 1
+    expecting_key = is_object
+
+    for match in _TOKEN.finditer(buf, start + 1):
+        token = match.group()
+        pos = match.start()
+        if token[:1] == b'"':
+            if depth == 0 and expecting_key:
+                key = json.loads(token)
+                expecting_key = False
+        elif token in (b"{", b"["):
+            depth += 1
+        elif token in (b"}", b"]"):
+            if depth == 0:
+                if buf[value_start:pos].strip(_WHITESPACE):
+                    yield key, value_start, pos
+                return
+            depth -= 1
+        elif depth == 0:
+            if token == b":":
+                value_start = pos + 1
+            else:  # comma between children
+                yield key, value_start, pos
+                value_start = pos + 1
+                expecting_key = is_object
+    raise ValueError("Unexpected end of JSON while scanning")
+
+
+def _first_structure(buf, start: int, end: int) -> Optional[int]:
+    """Offset of the { or [ that opens the value in buf[start:end], None for scalars"""
+    index = start
+    while index < end and buf[index:index + 1] in (b" ", b"\t", b"\r", b"\n"):
+        index += 1
+    return index if buf[index:index + 1] in (b"{", b"[") else None
+
+
+class ExtractionReader:
+    """Random access to the sections of one extraction file"""
+
+    def __init__(self, path: Union[str, Path], use_index_cache: bool = True):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.use_index_cache = use_index_cache
+        self._sections: Optional[Dict[str, Tuple[int, int]]] = None
+        self._spans: Dict[str, List[Tuple[Optional[str], int, int]]] = {}
+
+    def close(self):
+        try:
+            self._buf.close()
+        except BufferError:
+            # an unfinished item iterator still points into the map - it's
+            # released when that iterator is collected
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def _index_path(self) -> Path:
+        return self.path.parent / INDEX_DIR / (self.path.stem + INDEX_SUFFIX)
+
+    def _drop_legacy_index(self):
+        # older versions wrote the sidecar right next to the file, where
+        # spotify_soul_data_*.json globs matched it
+        legacy = self.path.with_name(self.path.name + INDEX_SUFFIX)
+        try:
+            legacy.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.debug("Could not remove old section index %s: %s", legacy, e)
+
+    def sections(self) -> Dict[str, Tuple[int, int]]:
+        """Byte range of each top-level section"""
+        if self._sections is not None:
+            return self._sections
+
+        stat = self.path.stat()
+        if self.use_index_cache and self._index_path.exists():
+            try:
+                cached = json.loads(self._index_path.read_text())
+                # an empty one may be from before tab-indented files were understood - rescan it
+                if cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns and cached['sections']:
+                    self._sections = {k: tuple(v) for k, v in cached['sections'].items()}
+                    return self._sections
+            except (ValueError, KeyError, OSError):
+                pass
+
+        root = _first_structure(self._buf, 0, len(self._buf))
+        if root is None or self._buf[root:root + 1] != b"{":
+            raise ValueError(f"{self.path} is not a JSON object")
+        self._sections = {key: (start, end) for key, start, end in _children(self._buf, root)}
+        if not self._sections and self._buf[root + 1:root + 64].strip(_WHITESPACE)[:1] != b"}":
+            raise ValueError(f"{self.path}: unsupported JSON layout, found no top-level sections in a non-empty object")
+
+        if self.use_index_cache:
+            self._drop_legacy_index()
+            try:
+                self._index_path.parent.mkdir(exist_ok=True)
+                write_json(self._index_path, {
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'sections': self._sections
+                }, compact=True, fsync=False)
+            except OSError as e:
+                # read-only data dir etc - just means we rescan next time
+                logger.debug("Could not cache section index for %s: %s", self.path, e)
+        return self._sections
+
+    def section(self, name: str) -> Any:
+        """Decode one whole section"""
+        start, end = self._range(name)
+        return json.loads(self._buf[start:end])
+
+    def _range(self, path: str) -> Tuple[int, int]:
+        # dotted paths reach into nested objects, e.g. top_tracks.short_term
+        first, *rest = path.split(".")
+        sections = self.sections()
+        if first not in sections:
+            raise KeyError(f"No section '{first}' (have: {', '.join(sections)})")
+        start, end = sections[first]
+        for part in rest:
+            opening = _first_structure(self._buf, start, end)
+            if opening is None:
+                raise KeyError(f"'{part}' not found in {path}")
+            for key, child_start, child_end in _children(self._buf, opening):
+                if key == part:
+                    start, end = child_start, child_end
+                    break
+            else:
+                raise KeyError(f"'{part}' not found in {path}")
+        return start, end
+
+    def iter_items(self, path: str) -> Iterator[Any]:
+        """Decode a section's items one at a time
+
+        Works on a bare list, on a Spotify paging object (its 'items'), or on a
+        time-range dict like top_tracks (items of every range, tagged with it).
+        """
+        spans = self._spans.get(path)
+        for time_range, start, end in spans if spans is not None else self._item_spans(path):
+            yield self._decode(time_range, start, end)
+
+    def item_spans(self, path: str) -> List[Tuple[Optional[str], int, int]]:
+        """(time range or None, start, end) of every item under path - scanned once per reader"""
+        spans = self._spans.get(path)
+        if spans is None:
+            spans = self._spans[path] = list(self._item_spans(path))
+        return spans
+
+    def items(self, path: str, offset: int = 0, limit: Optional[int] = None) -> Iterator[Any]:
+        """A page of items - only the page is decoded, skipped items are never touched"""
+        spans = self.item_spans(path)
+        stop = len(spans) if limit is None else offset + limit
+        for time_range, start, end in spans[offset:stop]:
+            yield self._decode(time_range, start, end)
+
+    def _decode(self, time_range: Optional[str], start: int, end: int) -> Any:
+        item = json.loads(self._buf[start:end])
+        if time_range is not None and isinstance(item, dict):
+            item = {'time_range': time_range, **item}
+        return item
+
+    def _item_spans(self, path: str) -> Iterator[Tuple[Optional[str], int, int]]:
+        start, end = self._range(path)
+        opening = _first_structure(self._buf, start, end)
+        if opening is None:
+            yield None, start, end
+            return
+
+        if self._buf[opening:opening + 1] == b"[":
+            yield from self._range_spans(start, end)
+            return
+
+        children = {}
+        for key, child_start, child_end in _children(self._buf, opening):
+            if key == 'items':
+                # paging object - items come first, no need to scan past them
+                yield from self._range_spans(child_start, child_end)
+                return
+            children[key] = (child_start, child_end)
+        if all(_first_structure(self._buf, s, e) is not None for s, e in children.values()):
+            for key, (child_start, child_end) in children.items():
+                for _, item_start, item_end in self._range_spans(child_start, child_end):
+                    yield key, item_start, item_end
+        else:
+            yield None, start, end
+
+    def _range_spans(self, start: int, end: int) -> Iterator[Tuple[Optional[str], int, int]]:
+        opening = _first_structure(self._buf, start, end)
+        if opening is not None and self._buf[opening:opening + 1] == b"[":
+            for _, item_start, item_end in _children(self._buf, opening):
+                yield None, item_start, item_end
+        elif opening is not None:
+            # paging object inside a time range
+            for key, child_start, child_end in _children(self._buf, opening):
+                if key == 'items':
+                    yield from self._range_spans(child_start, child_end)
+        else:
+            yield None, start, end
+
+
+def _played_at(item: Any) -> Optional[datetime.datetime]:
+    if not isinstance(item, dict):
+        return None
+    value = item.get('played_at') or item.get('added_at')
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def _as_utc(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def filter_time_range(items: Iterator[Any], since: Optional[str] = None,
+                      until: Optional[str] = None) -> Iterator[Any]:
+    """Keep items whose played_at/added_at falls in [since, until)"""
+    since_dt, until_dt = _as_utc(since), _as_utc(until)
+    for item in items:
+        stamp = _played_at(item)
+        if stamp is None:
+            continue
+        if since_dt and stamp < since_dt:
+            continue
+        if until_dt and stamp >= until_dt:
+            continue
+        yield item
+
+
+def resolve_file(path: Optional[str], user_id: Optional[str], data_dir: str = "data") -> Optional[Path]:
+    """An explicit path, or the newest extraction (for a user) from the manifest"""
+    if path:
+        return Path(path)
+    from soul_manifest import ExtractionManifest
+
+    entry = ExtractionManifest.for_output_dir(data_dir).latest(user_id)
+    return Path(entry['path']) if entry else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print or export parts of an extraction file without loading all of it")
+    parser.add_argument("file", nargs="?", help="Extraction file (default: latest in the manifest)")
+    parser.add_argument("--user", help="Use the latest extraction for this user")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--section", help="Section to read, dotted for nested (e.g. top_tracks.short_term)")
+    parser.add_argument("--since", help="Only items played/added at or after this ISO time")
+    parser.add_argument("--until", help="Only items played/added before this ISO time")
+    parser.add_argument("--limit", type=int, help="Stop after N items")
+    parser.add_argument("--jsonl", action="store_true", help="One compact JSON item per line (for exporting)")
+    args = parser.parse_args()
+
+    path = resolve_file(args.file, args.user, args.data_dir)
+    if not path or not path.exists():
+        print("No extraction file found", file=sys.stderr)
+        return 1
+
+    with ExtractionReader(path) as reader:
+        if not args.section:
+            print(f"{path} ({path.stat().st_size:,} bytes)")
+            for name, (start, end) in reader.sections().items():
+                print(f"  {name:<22} {end - start:>12,} bytes")
+            return 0
+
+        try:
+            items = reader.iter_items(args.section)
+            if args.since or args.until:
+                items = filter_time_range(items, args.since, args.until)
+            for count, item in enumerate(items, 1):
+                if args.jsonl:
+                    sys.stdout.write(json.dumps(item, ensure_ascii=False) + "\n")
+                else:
+                    sys.stdout.write(json.dumps(item, indent=2, ensure_ascii=False) + "\n")
+                if args.limit and count >= args.limit:
+                    break
+        except KeyError as e:
+            print(e, file=sys.stderr)
+            return 1
+        except BrokenPipeError:
+            # piped into head/less and the reader went away
+            return 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Batch renderer for Soul Extraction client reports
+
+Turns extractions + analytics into the Markdown/HTML deliverable (same
+layout as client_product/Cricket_Final_Analysis) for any number of users,
+spread across a process pool. Users whose extraction, templates and report
+version haven't changed since the last run are skipped.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, StrictUndefined
+
+from soul_persist import write_json, write_text, read_json
+from soul_analytics import SoulAnalytics, AnalyticsConfig, TIME_RANGES, load_extraction, snapshot_user_id
+from soul_manifest import extraction_files
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = "1"
+TEMPLATE_DIR = Path(__file__).parent / "templates" / "reports"
+REPORT_TEMPLATES = {
+    'md': "soul_report.md.j2",
+    'html': "soul_report.html.j2"
+}
+
+TIMELINE_HEADINGS = {
+    'short_term': "SHORT-TERM TIMELINE ANALYSIS (1-MONTH)",
+    'medium_term': "MEDIUM-TERM TIMELINE ANALYSIS (6-MONTH)",
+    'long_term': "LONG-TERM TIMELINE ANALYSIS (ALL TIME)"
+}
+
+ARCHETYPES = {
+    'archivist': ("🌀 The Archivist of Loops", (
+        "You don't just feel things — you archive them.  \n"
+        "Your all-time favourites are still your favourites this month.  \n"
+        "The Archivist is the one who can't let go,  \n"
+        "but not out of weakness — out of reverence."
+    )),
+    'tidal': ("🌗 The Tidal Heart", (
+        "Half of you stays, half of you wanders.  \n"
+        "Old favourites keep resurfacing between new obsessions,  \n"
+        "like something the tide keeps bringing back."
+    )),
+    'seeker': ("🔥 The Restless Seeker", (
+        "Almost nothing you played this month is an all-time favourite.  \n"
+        "You burn through sounds looking for the one that finally fits.  \n"
+        "The search is the ritual."
+    )),
+    'ritualist': ("💧 The Ritual Leaker", (
+        "Your rankings barely move. The same songs hold the same places,  \n"
+        "month after month, until habit becomes ritual.  \n"
+        "What you call \"just a song\" is a chant you didn't mean to make so loud."
+    )),
+    'drifter': ("🧭 The Drifter", (
+        "Your rankings reshuffle constantly.  \n"
+        "Nothing keeps its place for long — you follow the current  \n"
+        "and let it decide where you wash up next."
+    )),
+    'specialist': ("🧬 The Devoted Specialist", (
+        "A few genres carry most of your listening.  \n"
+        "You know exactly what you are, and you go deep instead of wide."
+    )),
+    'prototype': ("🧬 The Forgotten Prototype", (
+        "Your taste refuses a single label.  \n"
+        "It spreads across more genres than most playlists can hold —  \n"
+        "the version of you that never got standardised."
+    ))
+}
+
+
+@dataclass
+class ReportConfig:
+    """Configuration for batch report rendering"""
+    output_dir: str = "reports"
+    template_dir: str = str(TEMPLATE_DIR)
+    formats: Tuple[str, ...] = ('md', 'html')
+    workers: int = max(1, (os.cpu_count() or 2) - 1)
+    chunksize: int = 8
+    items_per_section: int = 10
+    force: bool = False
+
+
+# one compiled environment per worker process
+_environment: Optional[Environment] = None
+
+
+def _build_environment(template_dir: str, cache_dir: Optional[Path] = None) -> Environment:
+    environment = Environment(
+        loader=FileSystemLoader(template_dir),
+        # bytecode cache means templates are compiled once, not once per process per run
+        bytecode_cache=FileSystemBytecodeCache(str(cache_dir)) if cache_dir else None,
+        autoescape=lambda name: bool(name) and name.endswith('.html.j2'),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        undefined=StrictUndefined
+    )
+    for template_name in REPORT_TEMPLATES.values():
+        environment.get_template(template_name)
+    return environment
+
+
+def _init_worker(template_dir: str, cache_dir: str):
+    global _environment
+    _environment = _build_environment(template_dir, Path(cache_dir))
+
+
+def template_fingerprint(template_dir: str) -> str:
+    digest = hashlib.sha256(REPORT_VERSION.encode())
+    for template_name in sorted(REPORT_TEMPLATES.values()):
+        digest.update((Path(template_dir) / template_name).read_bytes())
+    return digest.hexdigest()
+
+
+def _pick_archetypes(analytics: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    churn = analytics['artist_overlap'].get('churn')
+    if churn is None or churn < 0.5:
+        emotional = 'archivist'
+    elif churn < 0.8:
+        emotional = 'tidal'
+    else:
+        emotional = 'seeker'
+
+    stability = analytics['track_stability'].get('short_term_vs_long_term')
+    behavioral = 'ritualist' if stability is not None and stability >= 0.2 else 'drifter'
+
+    # how many genres it takes to cover half of the long-term listening
+    shares = list((analytics['genre_distribution'].get('long_term') or {}).values())
+    covered, genres_for_half = 0.0, 0
+    for share in shares:
+        if covered >= 0.5:
+            break
+        covered += share
+        genres_for_half += 1
+    identity = 'specialist' if shares and genres_for_half <= 4 else 'prototype'
+
+    return {
+        key: {'title': ARCHETYPES[name][0], 'text': ARCHETYPES[name][1]}
+        for key, name in (('emotional', emotional), ('behavioral', behavioral), ('identity', identity))
+    }
+
+
+def _section_items(data: Dict[str, Any], section: str, time_range: str) -> List[Dict[str, Any]]:
+    payload = (data.get(section) or {}).get(time_range) or {}
+    return (payload.get('items') if isinstance(payload, dict) else payload) or []
+
+
+def _track_artist(track: Dict[str, Any]) -> str:
+    if track.get('artists'):
+        return ", ".join(a.get('name', '') for a in track['artists'])
+    return track.get('artist') or ''
+
+
+def _percent(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.0%}"
+
+
+def build_context(data: Dict[str, Any], analytics: Dict[str, Any], items_per_section: int = 10) -> Dict[str, Any]:
+    """Everything the report templates need, precomputed so templates stay dumb"""
+    profile = data.get('user_profile') or {}
+    recent = data.get('recent_tracks') or {}
+    recent_items = recent.get('items', []) if isinstance(recent, dict) else recent
+
+    timelines = []
+    for time_range in TIME_RANGES:
+        genres = analytics['genre_distribution'].get(time_range) or {}
+        timelines.append({
+            'heading': TIMELINE_HEADINGS[time_range],
+            'genres': [{'name': g, 'share': f"{s:.0%}"} for g, s in list(genres.items())[:items_per_section]],
+            'artists': [a.get('name') for a in _section_items(data, 'top_artists', time_range)[:items_per_section] if a],
+            'tracks': [
+                {'name': t.get('name'), 'artist': _track_artist(t)}
+                for t in _section_items(data, 'top_tracks', time_range)[:items_per_section] if t
+            ]
+        })
+
+    stability = []
+    for pair, label in (('short_term_vs_medium_term', "4 weeks vs 6 months"),
+                        ('medium_term_vs_long_term', "6 months vs all time"),
+                        ('short_term_vs_long_term', "4 weeks vs all time")):
+        stability.append({
+            'label': label,
+            'artists': _percent(analytics['artist_stability'].get(pair)),
+            'tracks': _percent(analytics['track_stability'].get(pair))
+        })
+
+    return {
+        'name': profile.get('display_name') or analytics.get('user_id') or "Listener",
+        'counts': {
+            'top_tracks': sum(len(_section_items(data, 'top_tracks', tr)) for tr in TIME_RANGES),
+            'top_artists': sum(len(_section_items(data, 'top_artists', tr)) for tr in TIME_RANGES),
+            'recent': len(recent_items or [])
+        },
+        'archetypes': _pick_archetypes(analytics),
+        'timelines': timelines,
+        'churn': _percent(analytics['artist_overlap'].get('churn')),
+        'stability': stability,
+        'top_now': analytics['top_scores'].get('tracks', [])[:items_per_section],
+        'extraction_hash': analytics['extraction_hash'],
+        'generated_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+    }
+
+
+def render_report(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker entry point - render every format for one user"""
+    environment = _environment or _build_environment(task['template_dir'])
+    start = time.perf_counter()
+
+    data, _ = load_extraction(task['path'])
+    context = build_context(data, task['analytics'], task['items_per_section'])
+
+    outputs = []
+    for fmt in task['formats']:
+        output_file = Path(task['output_stem'] + f".{fmt}")
+        write_text(output_file, environment.get_template(REPORT_TEMPLATES[fmt]).render(context))
+        outputs.append(str(output_file))
+
+    return {
+        'path': task['path'],
+        'outputs': outputs,
+        'fingerprint': task['fingerprint'],
+        'seconds': time.perf_counter() - start
+    }
+
+
+class ReportIndex:
+    """Remembers which fingerprint produced each report so unchanged users are skipped"""
+
+    def __init__(self, output_dir: Path):
+        self.path = output_dir / ".report_index.json"
+        self.entries: Dict[str, str] = {}
+        if self.path.exists():
+            try:
+                self.entries = read_json(self.path)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"Report index unreadable, rebuilding everything: {e}")
+
+    def is_current(self, output_stem: str, fingerprint: str, formats: Tuple[str, ...]) -> bool:
+        if self.entries.get(output_stem) != fingerprint:
+            return False
+        return all(Path(f"{output_stem}.{fmt}").exists() for fmt in formats)
+
+    def save(self):
+        write_json(self.path, self.entries)
+
+
+class ReportBatch:
+    """Renders client reports for many extractions at once"""
+
+    def __init__(self, config: Optional[ReportConfig] = None, analytics: Optional[SoulAnalytics] = None):
+        self.config = config or ReportConfig()
+        self.analytics = analytics or SoulAnalytics(AnalyticsConfig())
+        self.output_dir = Path(self.config.output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.index = ReportIndex(self.output_dir)
+
+    def _plan(self, paths: List[Path]) -> Tuple[List[Dict[str, Any]], int]:
+        templates = template_fingerprint(self.config.template_dir)
+        pending: Dict[str, Dict[str, Any]] = {}
+        snapshots: Dict[str, Dict[str, Any]] = {}
+        skipped = 0
+
+        for path in paths:
+            data, snapshot = load_extraction(path)
+            user_id = snapshot_user_id(data) or path.stem
+            output_stem = str(self.output_dir / f"soul_report_{user_id}_{snapshot[:12]}")
+            fingerprint = hashlib.sha256(f"{snapshot}:{templates}".encode()).hexdigest()
+
+            if not self.config.force and self.index.is_current(output_stem, fingerprint, self.config.formats):
+                skipped += 1
+                continue
+
+            snapshots[snapshot] = data
+            pending[snapshot] = {
+                'path': str(path),
+                'output_stem': output_stem,
+                'fingerprint': fingerprint,
+                'formats': self.config.formats,
+                'template_dir': self.config.template_dir,
+                'items_per_section': self.config.items_per_section
+            }
+
+        # analytics for everything that changed, in one vectorised batch
+        results = self.analytics.analyze_many(snapshots)
+        tasks = []
+        for snapshot, task in pending.items():
+            task['analytics'] = results[snapshot]
+            tasks.append(task)
+        return tasks, skipped
+
+    def run(self, paths: List[Path]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        tasks, skipped = self._plan(paths)
+        rendered, failed = [], []
+
+        if tasks:
+            logger.info(f"Rendering {len(tasks)} reports ({skipped} unchanged) on {self.config.workers} workers")
+            cache_dir = self.output_dir / ".jinja_cache"
+            cache_dir.mkdir(exist_ok=True)
+
+            if self.config.workers <= 1 or len(tasks) == 1:
+                _init_worker(self.config.template_dir, str(cache_dir))
+                results = map(_safe_render_task, tasks)
+                rendered, failed = self._collect(results)
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=self.config.workers,
+                    initializer=_init_worker,
+                    initargs=(self.config.template_dir, str(cache_dir))
+                ) as pool:
+                    results = pool.map(_safe_render_task, tasks, chunksize=self.config.chunksize)
+                    rendered, failed = self._collect(results)
+
+            self.index.save()
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Rendered {len(rendered)} reports in {elapsed:.2f} seconds "
+                    f"({skipped} skipped, {len(failed)} failed)")
+        return {
+            'rendered': rendered,
+            'skipped': skipped,
+            'failed': failed,
+            'seconds': elapsed
+        }
+
+    def _collect(self, results) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        rendered, failed = [], []
+        for result in results:
+            if result.get('error'):
+                logger.error(f"Report failed for {result['path']}: {result['error']}")
+                failed.append(result)
+                continue
+            stem = result['outputs'][0].rsplit('.', 1)[0]
+            self.index.entries[stem] = result['fingerprint']
+            rendered.append(result)
+        return rendered, failed
+
+
+def _safe_render_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    # exceptions don't always pickle cleanly - report them as data instead
+    try:
+        return render_report(task)
+    except Exception as e:
+        return {'path': task['path'], 'error': f"{type(e).__name__}: {e}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render Soul Extraction client reports")
+    parser.add_argument("inputs", nargs="*", default=["data/raw"],
+                        help="Extraction files or directories (default: data/raw)")
+    parser.add_argument("--output-dir", default="reports", help="Where reports are written")
+    parser.add_argument("--workers", type=int, help="Process pool size")
+    parser.add_argument("--format", choices=["md", "html", "both"], default="both")
+    parser.add_argument("--force", action="store_true", help="Re-render even if nothing changed")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.inputs:
+        item_path = Path(item)
+        if item_path.is_dir():
+            paths.extend(extraction_files(item_path))
+        elif item_path.exists():
+            paths.append(item_path)
+
+    if not paths:
+        print("No extraction files found.")
+        return 1
+
+    config = ReportConfig(
+        output_dir=args.output_dir,
+        formats=('md', 'html') if args.format == "both" else (args.format,),
+        force=args.force
+    )
+    if args.workers:
+        config.workers = args.workers
+
+    summary = ReportBatch(config).run(paths)
+    print(f"Rendered {len(summary['rendered'])} reports, skipped {summary['skipped']} unchanged, "
+          f"{len(summary['failed'])} failed in {summary['seconds']:.2f} seconds")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
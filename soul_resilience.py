@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Deadlines and circuit breakers for Spotify calls
+
+A Deadline is the time budget for one whole extraction. Every call gets
+min(call_timeout, time left) as its timeout, and backoff sleeps that would
+run past the end aren't started at all. A hung request or a 429 storm costs
+one extraction its budget instead of stalling a worker indefinitely.
+
+Circuit breakers are per endpoint family (top items, library, artists, ...)
+and shared by every extraction in the process. Once the error rate over the
+last window_seconds passes failure_ratio, the circuit opens and calls fail
+immediately. After open_seconds a single probe call is let through. If it
+works, the circuit closes. If not, it stays open for twice as long, up to
+max_open_seconds. During an outage a batch of thousands of users burns
+through the affected calls in milliseconds rather than minutes each.
+
+A RateLimiter is a token bucket shared by worker threads that all call
+Spotify with the same app credentials. A 429 pauses the whole bucket for
+its Retry-After, not just the thread that got it.
+
+Clients that retry through here need spotify_session(). spotipy's own
+session retries in urllib3, and once those retries run out (immediately with
+retries=0) every 429 or 5xx comes back as a bare SpotifyException(429). The
+real status and the Retry-After header are lost.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List
+
+import requests
+from spotipy.exceptions import SpotifyException
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there's no time left for the next call"""
+
+
+class CircuitOpenError(Exception):
+    """Raised when an endpoint family's circuit is open"""
+
+
+class RetriesExhausted(Exception):
+    """Raised when an essential call still failed after every retry"""
+
+
+class Deadline:
+    """Time budget for one extraction, None for no limit"""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def call_timeout(self, per_call: float, floor: float = 1.0) -> Optional[float]:
+        """Timeout for the next call - None once less than floor seconds are left"""
+        remaining = self.remaining()
+        if remaining < floor:
+            return None
+        return min(per_call, remaining)
+
+
+@dataclass
+class CircuitBreakerConfig:
+    """When a circuit opens and how it recovers"""
+    window_seconds: float = 60.0
+    min_calls: int = 5  # don't judge an endpoint on one or two calls
+    failure_ratio: float = 0.5
+    open_seconds: float = 30.0
+    max_open_seconds: float = 300.0
+
+
+class CircuitBreaker:
+    """Closed -> open on a high error rate -> half open (one probe) -> closed or open again"""
+
+    def __init__(self, name: str, config: Optional[CircuitBreakerConfig] = None):
+        self.name = name
+        self.config = config or CircuitBreakerConfig()
+        self.state = CLOSED
+        self._outcomes = deque()  # (monotonic time, ok) within the window
+        self._opened_at = 0.0
+        self._open_for = self.config.open_seconds
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now - every True must be followed by record()"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self._open_for:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            # half open - one probe at a time, everyone else keeps failing fast
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if ok:
+                    logger.info(f"Circuit {self.name} closed - probe succeeded")
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    self._open_for = self.config.open_seconds
+                else:
+                    self._open(now, min(self._open_for * 2, self.config.max_open_seconds))
+                return
+            if self.state == OPEN:
+                # calls that were already in flight when it opened
+                return
+
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.config.window_seconds:
+                self._outcomes.popleft()
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            if len(self._outcomes) >= self.config.min_calls and failures / len(self._outcomes) >= self.config.failure_ratio:
+                self._open(now, self.config.open_seconds)
+
+    def is_open(self) -> bool:
+        """Open and not yet due a probe"""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self._opened_at < self._open_for
+
+    def _open(self, now: float, seconds: float):
+        self.state = OPEN
+        self._opened_at = now
+        self._open_for = seconds
+        logger.warning(f"Circuit {self.name} open for {seconds:.0f}s - failing fast")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self._open_for - (time.monotonic() - self._opened_at)), 1)
+            return {'state': self.state, 'recent_calls': len(self._outcomes),
+                    'recent_failures': failures, 'retry_in_seconds': retry_in}
+
+
+class BreakerRegistry:
+    """One breaker per endpoint family, created on first use"""
+
+    def __init__(self, config: Optional[CircuitBreakerConfig] = None):
+        self.config = config or CircuitBreakerConfig()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.config)
+            return breaker
+
+    def open_circuits(self) -> List[str]:
+        """Circuits failing fast right now - ones due a probe don't count, something has to make the call"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.name for breaker in breakers if breaker.is_open()]
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+class RateLimiter:
+    """Token bucket - rate calls per second on average, up to burst at once"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: Optional[Deadline] = None) -> bool:
+        """Wait for a token - False if the deadline would run out first"""
+        deadline = deadline or Deadline()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if wait >= deadline.remaining():
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Nobody gets a token for the next seconds (a 429's Retry-After)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+# shared by every extraction in the process - the job queue workers and the scheduler see the same circuits
+breakers = BreakerRegistry()
+
+
+def is_transient(error: Exception) -> bool:
+    """Errors that say the endpoint is unhealthy (worth a retry and a mark against the circuit)"""
+    if isinstance(error, SpotifyException):
+        return error.http_status == 429 or (error.http_status or 0) >= 500
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+def spotify_session() -> requests.Session:
+    """Session for Spotify(requests_session=...) that leaves every retry to the caller
+
+    A plain session has no status retries, so an error response reaches spotipy's
+    HTTPError handling and the SpotifyException keeps its status and headers.
+    """
+    return requests.Session()
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds from a 429's Retry-After header, if there is one"""
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
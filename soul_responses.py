@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Rendered-page cache with precompressed bodies for server.py
+
+Pages are rendered once with placeholder markers standing in for their
+dynamic values, then split around those markers. A page with no dynamic
+values left is compressed once (gzip, plus brotli if installed) and served
+as-is with a strong ETag per encoding, so a repeat visit is a 304 and a
+first visit is a few KB. Pages with dynamic values only pay for a join and a fast gzip.
+"""
+
+import gzip
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Callable, Hashable, Iterable, List, Tuple
+
+from flask import Response, request
+from markupsafe import escape
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_SLOT = "\x00soul-slot:{}\x00"
+_SLOT_PATTERN = re.compile("\x00soul-slot:([^\x00]+)\x00")
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Compression and caching settings for rendered pages"""
+    max_age: int = 300  # browsers revalidate with If-None-Match after this
+    gzip_level: int = 9
+    dynamic_gzip_level: int = 1  # bodies compressed per request - speed over ratio
+    brotli_quality: int = 11
+    min_compress_size: int = 512  # tiny bodies aren't worth a Content-Encoding
+    max_entries: int = 128
+
+
+def accepted_encodings(header: Optional[str]) -> List[str]:
+    """Encodings from an Accept-Encoding header, best first (q=0 dropped)"""
+    ranked = []
+    for position, part in enumerate((header or "").split(",")):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranked.append((-q, position, name))
+    return [name for _, _, name in sorted(ranked)]
+
+
+def _digest(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    # a list of tags, maybe weak (W/) - weak comparison is what If-None-Match uses
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags
+
+
+class CompressedBody:
+    """One response body in every encoding we can serve"""
+    __slots__ = ('encodings', 'digest')
+
+    def __init__(self, body: bytes, config: ResponseCacheConfig, precompress: bool = True):
+        self.digest = _digest(body)
+        self.encodings: Dict[str, bytes] = {'identity': body}
+        if len(body) < config.min_compress_size:
+            return
+        level = config.gzip_level if precompress else config.dynamic_gzip_level
+        # mtime=0 keeps the gzip bytes stable across restarts
+        self.encodings['gzip'] = gzip.compress(body, compresslevel=level, mtime=0)
+        if brotli is not None and precompress:
+            self.encodings['br'] = brotli.compress(body, quality=config.brotli_quality)
+
+    def etag(self, encoding: str) -> str:
+        """Strong validators differ per content-coding, or a cache could hand gzip bytes to an identity client"""
+        if encoding == 'identity':
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def pick(self, accept_encoding: Optional[str]) -> Tuple[str, bytes]:
+        for name in accepted_encodings(accept_encoding):
+            if name in self.encodings and name != 'identity':
+                return name, self.encodings[name]
+        return 'identity', self.encodings['identity']
+
+
+class SlottedPage:
+    """A rendered page split around its dynamic values"""
+    __slots__ = ('parts', 'slots', 'static', 'version')
+
+    def __init__(self, html: str, config: ResponseCacheConfig, version: Any = None):
+        pieces = _SLOT_PATTERN.split(html)
+        # split() alternates literal text and slot names
+        self.parts = [piece.encode('utf-8') for piece in pieces[0::2]]
+        self.slots = pieces[1::2]
+        self.version = version
+        self.static = CompressedBody(self.parts[0], config) if not self.slots else None
+
+    def fill(self, values: Dict[str, Any]) -> bytes:
+        out = [self.parts[0]]
+        for slot, part in zip(self.slots, self.parts[1:]):
+            # values skip jinja, so escape them the way autoescape would
+            out.append(str(escape(values.get(slot, ""))).encode('utf-8'))
+            out.append(part)
+        return b"".join(out)
+
+
+class ResponseCache:
+    """Render-once page cache that answers with compressed bodies and ETags"""
+
+    def __init__(self, config: Optional[ResponseCacheConfig] = None):
+        self.config = config or ResponseCacheConfig()
+        self._pages: "OrderedDict[Hashable, SlottedPage]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+        self.not_modified = 0
+
+    def page(self, key: Hashable, render: Callable[[Dict[str, str]], str],
+             slots: Iterable[str] = (), version: Any = None) -> SlottedPage:
+        """The cached page for key, rendering it if missing or its version changed
+
+        render gets a dict of placeholder strings for the slot names - use them
+        where the dynamic values are printed (not in conditions).
+        """
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.version == version:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+
+        html = render({slot: _SLOT.format(slot) for slot in slots})
+        page = SlottedPage(html, self.config, version)
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.config.max_entries:
+                self._pages.popitem(last=False)
+            self.renders += 1
+        logger.debug("Rendered %s (%d dynamic slots)", key, len(page.slots))
+        return page
+
+    def respond(self, page: SlottedPage, values: Optional[Dict[str, Any]] = None, status: int = 200,
+                cache_control: Optional[str] = None, mimetype: str = 'text/html') -> Response:
+        body = page.static or CompressedBody(page.fill(values or {}), self.config, precompress=False)
+        cache_control = cache_control or f"public, max-age={self.config.max_age}"
+
+        encoding, payload = body.pick(request.headers.get('Accept-Encoding'))
+        etag = body.etag(encoding)
+        if status == 200 and _matches(request.headers.get('If-None-Match'), etag):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(payload, status=status, mimetype=mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pages': len(self._pages),
+                'hits': self.hits,
+                'renders': self.renders,
+                'not_modified': self.not_modified,
+                'brotli': brotli is not None
+            }
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Periodic multi-user extraction scheduler
+
+Replaces cron'ing `soulpull --extract` (one user, newest token, no
+coordination). Each (user, kind) pair has a row in a SQLite schedule - by
+default hourly recent plays, daily top items and a weekly full library - and
+a tick hands due rows to the ExtractionJobQueue:
+
+- next runs get +/- jitter, and new users are spread over the first interval,
+  so a hundred users never fire in the same second against the rate limit
+- due rows go in priority order: how overdue they are x user weight x kind
+  weight (recent plays are lost after 50, so they outrank a weekly refresh)
+- a global in-flight cap (counted in the shared jobs table, so it holds across
+  processes) and an hourly API call budget, spent on the highest scores first
+- nothing is dispatched while a circuit breaker (soul_resilience) is open -
+  due rows just wait for the probe to close it
+- next_run_at and the last job id are persisted - a restart neither re-runs
+  finished work nor forgets what was queued (the job queue recovers that)
+"""
+
+import argparse
+import datetime
+import logging
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Iterable
+
+from soul_resilience import breakers
+from soul_jobs import (ExtractionJobQueue, JobQueueConfig, QueueFullError, ACTIVE_STATUSES,
+                       SUCCEEDED, FAILED, RECENT_PLAYS, EXTRACTION, FULL_LIBRARY)
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    interval_seconds REAL NOT NULL,
+    weight REAL NOT NULL DEFAULT 1.0,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    next_run_at REAL NOT NULL,
+    last_dispatched_at REAL,
+    last_success_at REAL,
+    last_job_id TEXT,
+    last_status TEXT,
+    failures INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, kind)
+);
+CREATE INDEX IF NOT EXISTS schedules_due ON schedules (enabled, next_run_at);
+"""
+
+
+@dataclass
+class SchedulerConfig:
+    """Intervals, limits and budget for scheduled extractions"""
+    db_path: str = "jobs/schedule.db"
+    intervals: Dict[str, float] = field(default_factory=lambda: {
+        RECENT_PLAYS: HOUR,
+        EXTRACTION: DAY,
+        FULL_LIBRARY: 7 * DAY
+    })
+    # recent plays fall off the 50-item window for good, the rest can be refetched later
+    kind_weights: Dict[str, float] = field(default_factory=lambda: {
+        RECENT_PLAYS: 3.0,
+        EXTRACTION: 2.0,
+        FULL_LIBRARY: 1.0
+    })
+    # rough API calls per job - what the hourly budget is charged
+    kind_costs: Dict[str, int] = field(default_factory=lambda: {
+        RECENT_PLAYS: 2,
+        EXTRACTION: 15,
+        FULL_LIBRARY: 60
+    })
+    jitter: float = 0.1  # +/- fraction of the interval
+    initial_spread: float = 600.0  # new users' first runs land somewhere in this window
+    max_in_flight: int = 2  # queued + running jobs, across every process sharing the jobs db
+    api_budget_per_hour: int = 1500
+    tick_seconds: float = 30.0
+    retry_base_seconds: float = 300.0  # failed runs back off from here, capped at the interval
+    hold_on_open_circuit: bool = True  # no new dispatches while any endpoint circuit is open
+
+
+class ExtractionScheduler:
+    """Feeds due (user, kind) schedules into an ExtractionJobQueue"""
+
+    def __init__(self, job_queue: ExtractionJobQueue, config: Optional[SchedulerConfig] = None):
+        self.job_queue = job_queue
+        self.config = config or SchedulerConfig()
+        path = Path(self.config.db_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- schedule rows -----------------------------------------------------
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * (1 + random.uniform(-self.config.jitter, self.config.jitter))
+
+    def add_user(self, user_id: str, kinds: Optional[Iterable[str]] = None, weight: float = 1.0) -> int:
+        """Schedule user_id for each kind (all by default) - existing rows are left alone"""
+        now = time.time()
+        kinds = list(kinds or self.config.intervals)
+        rows = [
+            (user_id, kind, self.config.intervals[kind], weight,
+             # spread the first runs so a batch of new users doesn't fire at once
+             now + random.uniform(0, min(self.config.initial_spread, self.config.intervals[kind])))
+            for kind in kinds
+        ]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO schedules (user_id, kind, interval_seconds, weight, next_run_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            added = self._conn.total_changes - before
+        if added:
+            logger.info(f"Scheduled {user_id} for {added} job kinds")
+        return added
+
+    def discover_users(self, token_dir: str = "tokens") -> int:
+        """Schedule every user with a token file (spotify_token_<user>_<date>_<time>.json)"""
+        added = 0
+        users = set()
+        for token_file in Path(token_dir).glob("spotify_token_*.json"):
+            parts = token_file.stem[len("spotify_token_"):].rsplit("_", 2)
+            if len(parts) == 3:
+                users.add(parts[0])
+        for user_id in sorted(users):
+            added += self.add_user(user_id)
+        return added
+
+    def set_weight(self, user_id: str, weight: float):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE schedules SET weight = ? WHERE user_id = ?", (weight, user_id))
+
+    def set_enabled(self, user_id: str, enabled: bool):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE schedules SET enabled = ? WHERE user_id = ?", (int(enabled), user_id))
+
+    def remove_user(self, user_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM schedules WHERE user_id = ?", (user_id,))
+
+    def schedules(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM schedules"
+        params: tuple = ()
+        if user_id:
+            query += " WHERE user_id = ?"
+            params = (user_id,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY next_run_at", params).fetchall()
+        return [dict(row) for row in rows]
+
+    # -- ticking -----------------------------------------------------------
+
+    def priority(self, row: Dict[str, Any], now: float) -> float:
+        """Overdue ratio x user weight x kind weight - never-succeeded rows count as one interval stale"""
+        reference = row['last_success_at'] or (now - row['interval_seconds'])
+        staleness = (now - reference) / row['interval_seconds']
+        return staleness * row['weight'] * self.config.kind_weights.get(row['kind'], 1.0)
+
+    def _reconcile(self, now: float):
+        # pick up outcomes of jobs we dispatched - straight from the job table, so this works across restarts
+        with self._lock:
+            pending = self._conn.execute(
+                "SELECT user_id, kind, interval_seconds, last_job_id, failures FROM schedules "
+                "WHERE last_job_id IS NOT NULL AND (last_status IS NULL OR last_status IN (?, ?))",
+                ACTIVE_STATUSES
+            ).fetchall()
+        for row in pending:
+            job = self.job_queue.get(row['last_job_id'])
+            status = job['status'] if job else FAILED
+            updates: Dict[str, Any] = {'last_status': status}
+            if status == SUCCEEDED:
+                updates['last_success_at'] = now
+                updates['failures'] = 0
+            elif status == FAILED:
+                failures = row['failures'] + 1
+                # retry sooner than the normal interval, backing off each time
+                retry_in = min(self.config.retry_base_seconds * 2 ** (failures - 1), row['interval_seconds'])
+                updates['failures'] = failures
+                updates['next_run_at'] = now + self._jittered(retry_in)
+                logger.warning(f"{row['kind']} for {row['user_id']} failed ({failures}x), retrying in {retry_in:.0f}s")
+            self._update(row['user_id'], row['kind'], **updates)
+
+    def _update(self, user_id: str, kind: str, **fields):
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE schedules SET {assignments} WHERE user_id = :user_id AND kind = :kind",
+                {**fields, 'user_id': user_id, 'kind': kind}
+            )
+
+    def budget_spent(self, now: float) -> int:
+        """API calls charged to jobs dispatched in the last hour"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, COUNT(*) FROM schedules WHERE last_dispatched_at > ? GROUP BY kind", (now - HOUR,)
+            ).fetchall()
+        return sum(self.config.kind_costs.get(kind, 0) * count for kind, count in rows)
+
+    def _in_flight(self) -> int:
+        counts = self.job_queue.store.counts()
+        return sum(counts.get(status, 0) for status in ACTIVE_STATUSES)
+
+    def tick(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Dispatch whatever is due and fits the caps - returns the submitted jobs"""
+        now = now if now is not None else time.time()
+        self._reconcile(now)
+
+        slots = self.config.max_in_flight - self._in_flight()
+        budget = self.config.api_budget_per_hour - self.budget_spent(now)
+        if slots <= 0 or budget <= 0:
+            return []
+        open_circuits = breakers.open_circuits()
+        if open_circuits and self.config.hold_on_open_circuit:
+            # Spotify is having a bad time - don't feed every due user into failing jobs
+            logger.info(f"Holding dispatch, open circuits: {', '.join(open_circuits)}")
+            return []
+
+        with self._lock:
+            due = [dict(row) for row in self._conn.execute(
+                "SELECT * FROM schedules WHERE enabled = 1 AND next_run_at <= ?", (now,)
+            ).fetchall()]
+        due.sort(key=lambda row: self.priority(row, now), reverse=True)
+
+        submitted = []
+        # one job per user at a time - the queue enforces it too, but a job waiting
+        # on its own user would just hold an in-flight slot
+        busy = self.job_queue.store.busy_users()
+        for row in due:
+            if slots <= 0:
+                break
+            if row['user_id'] in busy:
+                continue
+            cost = self.config.kind_costs.get(row['kind'], 0)
+            if cost > budget:
+                # something cheaper further down might still fit this hour
+                continue
+            try:
+                job = self.job_queue.submit(row['user_id'], row['kind'])
+            except QueueFullError:
+                logger.info("Job queue full - holding the rest until the next tick")
+                break
+            self._update(row['user_id'], row['kind'],
+                         next_run_at=now + self._jittered(row['interval_seconds']),
+                         last_dispatched_at=now, last_job_id=job['id'], last_status=job['status'])
+            submitted.append(job)
+            busy.add(row['user_id'])
+            slots -= 1
+            budget -= cost
+
+        if submitted:
+            logger.info(f"Dispatched {len(submitted)} of {len(due)} due jobs ({budget} API calls left this hour)")
+        return submitted
+
+    # -- background loop ---------------------------------------------------
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {e}")
+            # a little jitter on the tick too, so several processes don't line up
+            self._stop.wait(self._jittered(self.config.tick_seconds))
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="extraction-scheduler", daemon=True)
+        self._thread.start()
+        logger.info("Extraction scheduler started")
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        if wait and self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_id), SUM(enabled = 1 AND next_run_at <= ?) FROM schedules",
+                (now,)
+            ).fetchone()
+        return {
+            'schedules': row[0],
+            'users': row[1],
+            'due': row[2] or 0,
+            'in_flight': self._in_flight(),
+            'api_budget_left': self.config.api_budget_per_hour - self.budget_spent(now)
+        }
+
+
+def _when(epoch: Optional[float]) -> str:
+    return datetime.datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M") if epoch else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduled extractions for every user")
+    parser.add_argument("--db", default=SchedulerConfig.db_path)
+    parser.add_argument("--jobs-db", default=JobQueueConfig.db_path)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Run the scheduler and a worker pool until interrupted")
+    run.add_argument("--workers", type=int, default=2)
+    run.add_argument("--budget", type=int, help="API calls per hour")
+    add = sub.add_parser("add", help="Schedule a user")
+    add.add_argument("user_id")
+    add.add_argument("--weight", type=float, default=1.0)
+    add.add_argument("--kinds", nargs="+", choices=list(SchedulerConfig().intervals))
+    sub.add_parser("discover", help="Schedule every user with a token")
+    weight = sub.add_parser("weight", help="Set a user's priority weight")
+    weight.add_argument("user_id")
+    weight.add_argument("weight", type=float)
+    remove = sub.add_parser("remove", help="Stop scheduling a user")
+    remove.add_argument("user_id")
+    sub.add_parser("list", help="Show schedules")
+    args = parser.parse_args()
+
+    config = SchedulerConfig(db_path=args.db)
+    queue_config = JobQueueConfig(db_path=args.jobs_db, workers=getattr(args, 'workers', 2))
+    job_queue = ExtractionJobQueue(queue_config)
+    scheduler = ExtractionScheduler(job_queue, config)
+
+    if args.command == "run":
+        config.max_in_flight = args.workers
+        if args.budget:
+            config.api_budget_per_hour = args.budget
+        scheduler.discover_users(queue_config.token_dir)
+        job_queue.start()
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(60)
+                logger.info(f"Scheduler: {scheduler.stats()}")
+        except KeyboardInterrupt:
+            scheduler.stop()
+            job_queue.shutdown()
+    elif args.command == "add":
+        scheduler.add_user(args.user_id, args.kinds, args.weight)
+    elif args.command == "discover":
+        print(f"{scheduler.discover_users(queue_config.token_dir)} schedules added")
+    elif args.command == "weight":
+        scheduler.set_weight(args.user_id, args.weight)
+    elif args.command == "remove":
+        scheduler.remove_user(args.user_id)
+    else:
+        now = time.time()
+        for row in scheduler.schedules():
+            print(f"{row['user_id']:<28} {row['kind']:<13} x{row['weight']:<4g} next {_when(row['next_run_at'])}  "
+                  f"last ok {_when(row['last_success_at'])}  {row['last_status'] or '-':<9} "
+                  f"prio {scheduler.priority(row, now):.2f}{'' if row['enabled'] else '  (disabled)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Typed schemas for extraction sections, checked as responses arrive
+
+Each section's items are validated by one pydantic TypeAdapter call (the loop
+runs in pydantic-core, not Python) the moment the response comes back. A
+SectionLedger keeps per-section counts, the quarantined records and what
+validation needs to know. Completeness and the quality score then come out
+of the ledger instead of walking the finished extraction again.
+
+Bad records (null items, tracks without a name or artists, ...) are taken
+out of the section and quarantined with their validation errors, rather
+than tripping up whatever reads the extraction later. The schemas only
+declare the fields downstream code relies on. Everything else in a response
+is left alone, and the saved extraction keeps Spotify's raw objects.
+"""
+
+import argparse
+import gc
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
+
+from soul_persist import dumps, read_json, write_text
+
+logger = logging.getLogger(__name__)
+
+# fewer data points than this and the extraction doesn't say much about anyone
+EXPECTED_MINIMUM = 50
+
+
+class _Schema(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
+
+class SimplifiedArtist(_Schema):
+    id: Optional[str] = None
+    name: str
+
+
+class Album(_Schema):
+    id: Optional[str] = None
+    name: Optional[str] = None
+
+
+class Track(_Schema):
+    id: Optional[str] = None  # local files have none
+    name: str
+    artists: List[SimplifiedArtist]
+    album: Optional[Album] = None
+    duration_ms: Optional[int] = None
+    popularity: Optional[int] = None
+
+
+class Artist(_Schema):
+    id: str
+    name: str
+    genres: List[str] = []
+    popularity: Optional[int] = None
+
+
+class PlayHistory(_Schema):
+    track: Track
+    played_at: str
+
+
+class SavedTrack(_Schema):
+    added_at: str
+    track: Track
+
+
+class UserProfile(_Schema):
+    id: str
+    display_name: Optional[str] = None
+
+
+# built once - TypeAdapter construction is the expensive part
+_ITEM_ADAPTERS = {
+    'top_tracks': TypeAdapter(List[Track]),
+    'top_artists': TypeAdapter(List[Artist]),
+    'recent_tracks': TypeAdapter(List[PlayHistory]),
+    'saved_tracks': TypeAdapter(List[SavedTrack]),
+}
+_PROFILE_ADAPTER = TypeAdapter(UserProfile)
+
+
+def _adapter(section: str) -> TypeAdapter:
+    # "top_tracks_short_term" -> top_tracks
+    for prefix, adapter in _ITEM_ADAPTERS.items():
+        if section.startswith(prefix):
+            return adapter
+    raise KeyError(f"No schema for section {section}")
+
+
+def _describe(error: Dict[str, Any]) -> str:
+    # ("track", "artists", 0, "name") under the item index -> "track.artists.0.name: Field required"
+    field_path = ".".join(str(part) for part in error['loc'][1:])
+    return f"{field_path}: {error['msg']}" if field_path else error['msg']
+
+
+def _validate(adapter: TypeAdapter, value: Any):
+    # the validated models are thrown away and hold no cycles, but allocating
+    # them triggers collections that walk the whole extraction held in memory
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        adapter.validate_python(value)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class SectionLedger:
+    """Counts, quarantine and quality for one extraction, filled in as sections arrive"""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.quarantine: Dict[str, List[Dict[str, Any]]] = {}
+        self.profile_valid = False
+
+    def reset(self, section: str):
+        """Forget a section before it's refetched (or paged in from the start)"""
+        self.counts[section] = 0
+        self.quarantine.pop(section, None)
+
+    def ingest(self, section: str, payload: Optional[Dict[str, Any]], append: bool = False) -> Optional[Dict[str, Any]]:
+        """Validate one response's items - returns the payload without quarantined items
+
+        append adds to the section's count (one page of a paginated section),
+        otherwise the response replaces whatever the section had.
+        """
+        if not append:
+            self.reset(section)
+        if payload is None:
+            self.counts.setdefault(section, 0)
+            return None
+
+        items = payload.get('items') or []
+        try:
+            _validate(_adapter(section), items)
+        except ValidationError as e:
+            bad = self._bad_indices(e, len(items))
+            quarantined = self.quarantine.setdefault(section, [])
+            for index in sorted(bad):
+                quarantined.append({
+                    'index': index,
+                    'errors': [_describe(err) for err in e.errors() if err['loc'] and err['loc'][0] == index],
+                    'item': items[index]
+                })
+            logger.warning("Quarantined %d of %d %s items", len(bad), len(items), section)
+            items = [item for index, item in enumerate(items) if index not in bad]
+            # a copy - checkpoints and cassettes may still hold the original
+            payload = {**payload, 'items': items}
+        self.counts[section] = self.counts.get(section, 0) + len(items)
+        return payload
+
+    @staticmethod
+    def _bad_indices(error: ValidationError, size: int) -> set:
+        bad = {err['loc'][0] for err in error.errors() if err['loc'] and isinstance(err['loc'][0], int)}
+        # no item index means the list itself was wrong - nothing in it can be trusted
+        return bad or set(range(size))
+
+    def ingest_profile(self, profile: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The profile if it has what we need (an id), None otherwise"""
+        self.profile_valid = False
+        if not profile:
+            return None
+        try:
+            _validate(_PROFILE_ADAPTER, profile)
+        except ValidationError as e:
+            self.quarantine['user_profile'] = [{'index': 0, 'errors': [str(err['msg']) for err in e.errors()],
+                                                'item': profile}]
+            logger.warning("Quarantined user profile: %s", e.errors()[0]['msg'])
+            return None
+        self.profile_valid = True
+        return profile
+
+    # -- what validation and the summary used to walk the data for ---------
+
+    def completeness(self) -> Dict[str, Any]:
+        completeness = dict(self.counts)
+        completeness["overall_score"] = min(sum(self.counts.values()) / EXPECTED_MINIMUM, 1.0)
+        return completeness
+
+    def empty_sections(self) -> List[str]:
+        # saved tracks are allowed to be empty - plenty of people never save anything
+        return [name for name, count in self.counts.items() if count == 0 and not name.startswith("saved_tracks")]
+
+    def quarantined_counts(self) -> Dict[str, int]:
+        return {section: len(records) for section, records in self.quarantine.items()}
+
+    def quality_score(self) -> float:
+        score = 1.0
+        if self.empty_sections():
+            score *= 0.8
+        if not self.profile_valid:
+            score *= 0.5
+        quarantined = sum(self.quarantined_counts().values())
+        if quarantined:
+            score *= sum(self.counts.values()) / (sum(self.counts.values()) + quarantined)
+        return score
+
+    def write_quarantine(self, path: Path) -> Optional[Path]:
+        """Quarantined records as JSON lines, one per record - nothing is written if there are none"""
+        if not self.quarantine:
+            return None
+        lines = [dumps({'section': section, **record}, compact=True).decode('utf-8')
+                 for section, records in self.quarantine.items() for record in records]
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        write_text(path, "\n".join(lines) + "\n")
+        return Path(path)
+
+    @classmethod
+    def from_extraction(cls, data: Dict[str, Any]) -> Tuple["SectionLedger", Dict[str, Any]]:
+        """Check an already saved extraction after the fact - the ledger and the cleaned data"""
+        ledger = cls()
+        cleaned = dict(data)
+        cleaned['user_profile'] = ledger.ingest_profile(data.get('user_profile'))
+        for kind in ('top_tracks', 'top_artists'):
+            if kind in data:
+                cleaned[kind] = {time_range: ledger.ingest(f"{kind}_{time_range}", payload)
+                                 for time_range, payload in (data[kind] or {}).items()}
+        for section in ('recent_tracks', 'saved_tracks'):
+            if section in data:
+                cleaned[section] = ledger.ingest(section, data[section])
+        return ledger, cleaned
+
+
+def _sections(data: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """(ledger section, response) in the order an extraction fetches them"""
+    responses = []
+    for kind in ('top_tracks', 'top_artists'):
+        for time_range, payload in (data.get(kind) or {}).items():
+            responses.append((f"{kind}_{time_range}", payload))
+    for section in ('recent_tracks', 'saved_tracks'):
+        if section not in data:
+            continue
+        payload = data[section] or {}
+        if section == 'saved_tracks':
+            # saved tracks arrive 50 at a time
+            items = payload.get('items') or []
+            responses.extend((section, {**payload, 'items': items[i:i + 50]}) for i in range(0, max(len(items), 1), 50))
+        else:
+            responses.append((section, payload))
+    return responses
+
+
+def benchmark(data: Dict[str, Any], rounds: int = 5) -> Dict[str, Any]:
+    """CPU spent on validation and completeness once the last response is in, post-hoc vs fused
+
+    Post-hoc walks the finished extraction (what checking the schemas after the
+    fact costs). Fused validates each response as it comes back - that part is
+    reported separately since it overlaps the network wait - and leaves only
+    the ledger reads for the end of the run.
+    """
+    responses = _sections(data)
+
+    def best(func) -> float:
+        timings = []
+        for _ in range(rounds):
+            start = time.process_time()
+            func()
+            timings.append(time.process_time() - start)
+        return min(timings)
+
+    def posthoc():
+        ledger, _ = SectionLedger.from_extraction(data)
+        ledger.completeness(), ledger.empty_sections(), ledger.quality_score()
+
+    def ingest() -> SectionLedger:
+        ledger = SectionLedger()
+        ledger.ingest_profile(data.get('user_profile'))
+        for section, payload in responses:
+            ledger.ingest(section, payload, append=section in ledger.counts)
+        return ledger
+
+    ingest_seconds = best(ingest)
+    ledger = ingest()
+    return {
+        'items': sum(ledger.counts.values()),
+        'quarantined': sum(ledger.quarantined_counts().values()),
+        'responses': len(responses),
+        'post-hoc after the run': best(posthoc),
+        'fused after the run': best(lambda: (ledger.completeness(), ledger.empty_sections(), ledger.quality_score())),
+        'fused while responses arrive': ingest_seconds,
+        'per response': ingest_seconds / max(len(responses), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate a saved extraction against the section schemas")
+    parser.add_argument("file", help="An extraction from data/raw")
+    parser.add_argument("--quarantine", help="Write quarantined records here (JSON lines)")
+    parser.add_argument("--benchmark", action="store_true", help="Time post-hoc vs fused validation on this file")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    data = read_json(args.file)
+    if args.benchmark:
+        results = benchmark(data, args.rounds)
+        print(f"{args.file}: {results['items']:,} items in {results['responses']} responses, "
+              f"{results['quarantined']} quarantined")
+        for name, seconds in results.items():
+            if isinstance(seconds, float):
+                print(f"  {name:<30} {seconds * 1000:>9.3f} ms CPU")
+        return 0
+
+    ledger, _ = SectionLedger.from_extraction(data)
+    for section, count in ledger.completeness().items():
+        print(f"  {section:<28} {count}")
+    for section, count in ledger.quarantined_counts().items():
+        print(f"  quarantined {section:<16} {count}")
+    print(f"Quality score: {ledger.quality_score():.2f}")
+    if args.quarantine:
+        ledger.write_quarantine(Path(args.quarantine))
+    return 0
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    raise SystemExit(main())
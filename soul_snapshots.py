@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Content-addressed snapshot store for extractions and backups
+
+Payloads are hashed (sha256 of canonical JSON) and stored once, compressed,
+under objects/<aa>/<hash>. Every put appends a line to manifest.jsonl, so a
+snapshot that didn't change costs one manifest line, not another copy.
+extraction_metadata (timestamps etc) lives in the manifest entry instead of
+the object - otherwise no two hourly snapshots would ever dedupe.
+"""
+
+import argparse
+import datetime
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Union
+
+from soul_persist import atomic_write, write_json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# kept out of the hashed payload, stored per snapshot in the manifest
+VOLATILE_KEYS = ('extraction_metadata',)
+
+
+@dataclass
+class SnapshotConfig:
+    """Where snapshots live and how they're compressed"""
+    root: str = "data/snapshots"  # the extractor's output_dir/snapshots - one store for everything
+    compression: str = "zstd" if zstandard else "gzip"
+    level: int = 6
+
+
+def canonical_bytes(payload: Any) -> bytes:
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _compress(raw: bytes, compression: str, level: int) -> bytes:
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(raw)
+    # mtime=0 so the same payload always compresses to the same bytes
+    return gzip.compress(raw, compresslevel=level, mtime=0)
+
+
+def _decompress(blob: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        if not zstandard:
+            raise RuntimeError("Snapshot is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+def _parse_entry(line: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        logger.warning("Skipping unreadable snapshot manifest line")
+        return None
+
+
+class SnapshotStore:
+    """Deduplicating, compressed snapshot store with an append-only manifest"""
+
+    SUFFIXES = {"gzip": ".json.gz", "zstd": ".json.zst"}
+
+    def __init__(self, config: Optional[SnapshotConfig] = None):
+        self.config = config or SnapshotConfig()
+        self.root = Path(self.config.root)
+        self.objects = self.root / "objects"
+        self.manifest_path = self.root / "manifest.jsonl"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.root / ".lock"
+
+    @contextmanager
+    def _locked(self):
+        # file lock so the server, cron and the CLI can all write safely
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _object_path(self, digest: str, compression: str) -> Path:
+        return self.objects / digest[:2] / f"{digest}{self.SUFFIXES[compression]}"
+
+    def _find_object(self, digest: str) -> Optional[Path]:
+        for compression in self.SUFFIXES:
+            path = self._object_path(digest, compression)
+            if path.exists():
+                return path
+        return None
+
+    def last_entry(self) -> Optional[Dict[str, Any]]:
+        """Newest readable manifest entry, read from the end of the file - O(1) in manifest size"""
+        if not self.manifest_path.exists():
+            return None
+        with open(self.manifest_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            chunk = b""
+            while position > 0:
+                step = min(4096, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + chunk).split(b"\n")
+                # the first piece may start mid-line until we reach the start of the file
+                chunk = lines.pop(0) if position > 0 else b""
+                for line in reversed(lines):
+                    entry = _parse_entry(line)
+                    if entry is not None:
+                        return entry
+        return None
+
+    def _repair_tail(self):
+        # a crash mid-append leaves a line with no newline - drop it so the
+        # next entry doesn't get glued onto it
+        if not self.manifest_path.exists():
+            return
+        with open(self.manifest_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            position = size
+            while position > 0:
+                step = min(4096, position)
+                position -= step
+                f.seek(position)
+                newline = f.read(step).rfind(b"\n")
+                if newline >= 0:
+                    position += newline + 1
+                    break
+            logger.warning(f"Dropping torn last line of {self.manifest_path} ({size - position} bytes)")
+            f.truncate(position)
+
+    def put(self, data: Dict[str, Any], label: str, source: Optional[str] = None) -> Dict[str, Any]:
+        """Snapshot data under label - returns the manifest entry ('deduped' if the content was already stored)"""
+        payload = {k: v for k, v in data.items() if k not in VOLATILE_KEYS} if isinstance(data, dict) else data
+        raw = canonical_bytes(payload)
+        digest = hashlib.sha256(raw).hexdigest()
+
+        with self._locked():
+            existing = self._find_object(digest)
+            deduped = existing is not None
+            if not deduped:
+                path = self._object_path(digest, self.config.compression)
+                path.parent.mkdir(exist_ok=True)
+                atomic_write(path, _compress(raw, self.config.compression, self.config.level))
+                existing = path
+
+            self._repair_tail()
+            last = self.last_entry()
+            entry = {
+                'seq': (last['seq'] + 1) if last else 1,
+                'label': label,
+                'hash': digest,
+                'created_at': datetime.datetime.now().isoformat(),
+                'size': len(raw),
+                'stored_size': existing.stat().st_size,
+                'object': str(existing.relative_to(self.root)),
+                'deduped': deduped,
+                'source': source,
+                'metadata': {k: data[k] for k in VOLATILE_KEYS if isinstance(data, dict) and k in data}
+            }
+            with open(self.manifest_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        logger.info(f"Snapshot #{entry['seq']} ({label}) -> {digest[:12]}"
+                    f"{' (unchanged, deduped)' if entry['deduped'] else ''}")
+        return entry
+
+    def put_file(self, path: Union[str, Path], label: str) -> Dict[str, Any]:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return self.put(data, label, source=str(path))
+
+    def entries(self, label: Optional[str] = None) -> List[Dict[str, Any]]:
+        if not self.manifest_path.exists():
+            return []
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            entries = [entry for entry in map(_parse_entry, f) if entry is not None]
+        return [e for e in entries if label is None or e['label'] == label]
+
+    def entry(self, seq: int) -> Optional[Dict[str, Any]]:
+        for entry in self.entries():
+            if entry['seq'] == seq:
+                return entry
+        return None
+
+    def load_object(self, digest: str) -> Any:
+        path = self._find_object(digest)
+        if path is None:
+            raise FileNotFoundError(f"No snapshot object {digest}")
+        compression = "zstd" if path.name.endswith(self.SUFFIXES["zstd"]) else "gzip"
+        return json.loads(_decompress(path.read_bytes(), compression))
+
+    def get(self, entry: Union[int, Dict[str, Any]]) -> Any:
+        """Full snapshot (payload + its own metadata) for a seq number or manifest entry"""
+        if isinstance(entry, int):
+            seq = entry
+            entry = self.entry(seq)
+            if entry is None:
+                raise KeyError(f"No snapshot #{seq}")
+        data = self.load_object(entry['hash'])
+        if isinstance(data, dict):
+            data.update(entry.get('metadata') or {})
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self.entries()
+        objects = {e['hash']: e['stored_size'] for e in entries}
+        return {
+            'snapshots': len(entries),
+            'unique_objects': len(objects),
+            'logical_bytes': sum(e['size'] for e in entries),
+            'stored_bytes': sum(objects.values())
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot store for soul data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    put = subparsers.add_parser("put", help="Snapshot a JSON file")
+    put.add_argument("file")
+    put.add_argument("--label", default="backup")
+
+    listing = subparsers.add_parser("list", help="List snapshots")
+    listing.add_argument("--label")
+
+    restore = subparsers.add_parser("restore", help="Write a snapshot back out as JSON")
+    restore.add_argument("seq", type=int)
+    restore.add_argument("output")
+
+    subparsers.add_parser("stats", help="Show dedupe / compression stats")
+
+    parser.add_argument("--root", default=SnapshotConfig.root)
+    args = parser.parse_args()
+    store = SnapshotStore(SnapshotConfig(root=args.root))
+
+    if args.command == "put":
+        entry = store.put_file(args.file, args.label)
+        print(f"Snapshot #{entry['seq']} {entry['hash'][:12]}{' (unchanged)' if entry['deduped'] else ''}")
+    elif args.command == "list":
+        for entry in store.entries(args.label):
+            print(f"#{entry['seq']:<5} {entry['created_at'][:19]}  {entry['label']:<20} {entry['hash'][:12]}  "
+                  f"{entry['stored_size']:>9,} B{'  (dup)' if entry['deduped'] else ''}")
+    elif args.command == "restore":
+        write_json(args.output, store.get(args.seq))
+        print(f"Restored snapshot #{args.seq} to {args.output}")
+    else:
+        stats = store.stats()
+        print(f"{stats['snapshots']} snapshots, {stats['unique_objects']} unique objects")
+        print(f"{stats['logical_bytes']:,} bytes logical -> {stats['stored_bytes']:,} bytes on disk")
+
+
+if __name__ == "__main__":
+    from soul_logging import setup_logging
+    setup_logging()
+    main()
@@ -1,22 +1,31 @@
 #!/usr/bin/env python3
 
-import json
+import atexit
+import datetime
+import hashlib
 import os
-import shutil
 import sys
-import datetime
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyOAuth
 from pprint import pprint
 from dotenv import load_dotenv
 from flask import Flask, request, redirect
+from soul_cassette import cassette_from_env, replay_client, attach
+from soul_history import record_extraction
+from soul_hydration import ArtistHydrator
+from soul_manifest import ExtractionManifest
+from soul_persist import write_json, read_json
+from soul_profiling import Profiler, append_timings, format_report
+from soul_reader import ExtractionReader
+from soul_schemas import SectionLedger
+from soul_snapshots import SnapshotStore, SnapshotConfig
 # Load environment variables from .env file
 load_dotenv()
 
 from pathlib import Path
 
 # Paths
-raw_path = Path('path/raw_soul_data.json')
+raw_path = Path(os.getenv("SOUL_RAW_PATH", 'path/raw_soul_data.json'))
 landing_folder = Path('final_landing')
 
 # Spotify auth
@@ -24,30 +33,39 @@ landing_folder = Path('final_landing')
 SPOTIPY_CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID")
 SPOTIPY_CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET")
 SPOTIPY_REDIRECT_URI = os.getenv("SPOTIPY_REDIRECT_URI")
-
-tokens_dir = Path("tokens")
-if not tokens_dir.exists() or not any(tokens_dir.iterdir()):
-    print(f"No token files found in '{tokens_dir}' directory.")
-    print("Please run the authentication flow first (e.g., by running server.py).")
-    sys.exit(1)
-token_files = list(tokens_dir.glob('*.json'))
-if not token_files:
-    print(f"No token files found in '{tokens_dir}' directory.")
-    print("Please run the authentication flow first (e.g., by running server.py).")
-    sys.exit(1)
 # Define the scopes used for Spotify authentication
 SPOTIFY_SCOPE = "user-top-read user-read-recently-played"
 
-# Find the latest token file for cache_path
-latest_file = max(token_files, key=os.path.getctime)
+tokens_dir = Path("tokens")
+cassette = cassette_from_env("soulpull")
+
+if cassette and cassette.mode == "replay":
+    # replaying a recorded session - no tokens or network needed
+    sp = replay_client(cassette)
+else:
+    if not tokens_dir.exists() or not any(tokens_dir.iterdir()):
+        print(f"No token files found in '{tokens_dir}' directory.")
+        print("Please run the authentication flow first (e.g., by running server.py).")
+        sys.exit(1)
+    token_files = list(tokens_dir.glob('*.json'))
+    if not token_files:
+        print(f"No token files found in '{tokens_dir}' directory.")
+        print("Please run the authentication flow first (e.g., by running server.py).")
+        sys.exit(1)
 
-sp = Spotify(auth_manager=SpotifyOAuth(
-    scope=SPOTIFY_SCOPE,
-    client_id=SPOTIPY_CLIENT_ID,
-    client_secret=SPOTIPY_CLIENT_SECRET,
-    redirect_uri=SPOTIPY_REDIRECT_URI,
-    cache_path=str(latest_file)
-))
+    # Find the latest token file for cache_path
+    latest_file = max(token_files, key=os.path.getctime)
+
+    sp = Spotify(auth_manager=SpotifyOAuth(
+        scope=SPOTIFY_SCOPE,
+        client_id=SPOTIPY_CLIENT_ID,
+        client_secret=SPOTIPY_CLIENT_SECRET,
+        redirect_uri=SPOTIPY_REDIRECT_URI,
+        cache_path=str(latest_file)
+    ))
+    if cassette:
+        attach(sp, cassette)
+        atexit.register(cassette.save)
 
 # Initialize the OAuth instance (if needed for callback flows)
 sp_oauth_instance_for_callback = SpotifyOAuth(
@@ -59,23 +77,37 @@ sp_oauth_instance_for_callback = SpotifyOAuth(
 
 cache_path = ".cache"
 
+def snapshot_store():
+    # same store the extractor uses - opened on demand, not on import
+    return SnapshotStore(SnapshotConfig(root=str(Path("data") / "snapshots")))
+
 if "--backup" in sys.argv:
-    os.makedirs("backups", exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    source_file = "path/raw_soul_data.json"
-    if os.path.exists(source_file):
-        shutil.copy(source_file, f"backups/soul_{timestamp}.json")
+    if raw_path.exists():
+        entry = snapshot_store().put_file(raw_path, label="soulpull_raw")
+        print(f"Backed up {raw_path} as snapshot #{entry['seq']}{' (unchanged)' if entry['deduped'] else ''}")
     else:
-        print(f"Backup failed: '{source_file}' does not exist.")
+        print(f"Backup failed: '{raw_path}' does not exist.")
+def best_effort_call(func, name):
+    # genres are nice to have - a 429 or a dropped connection on one batch skips it
+    # rather than losing the extraction it belongs to
+    try:
+        return func()
+    except Exception as e:
+        print(f"Skipping {name}: {e}")
+        return None
+
 def process_track(track_item):
     track = track_item.get('track', track_item) # For recent tracks, 'track' is nested
     if not track:
         return None
     artists = ", ".join([artist['name'] for artist in track.get('artists', [])])
+    # genres are only there once the artists have been hydrated
+    genres = sorted({genre for artist in track.get('artists', []) for genre in artist.get('genres', [])})
     return {
         "name": track.get('name'),
         "artist": artists,
-        "album": track.get('album', {}).get('name')
+        "album": track.get('album', {}).get('name'),
+        "genres": ", ".join(genres)
     }
 
 def process_artist(artist_item):
@@ -101,7 +133,7 @@ def process_soul_data(raw_data):
     # Process Top Tracks
     processed_tracks = {}
     for term, tracks_data in raw_data.get('top_tracks', {}).items():
-        processed_tracks[term] = [process_track(item) for item in tracks_data.get('items', []) if process_track(item) is not None]
+        processed_tracks[term] = [row for item in tracks_data.get('items', []) if (row := process_track(item)) is not None]
     processed['top_tracks'] = processed_tracks
 
     # Process Top Artists
@@ -116,10 +148,10 @@ def process_soul_data(raw_data):
     return processed
 
 def process_top_artists(term, processed_artists, artists_data):
-    processed_artists[term] = [process_artist(item) for item in artists_data.get('items', []) if process_artist(item) is not None]
+    processed_artists[term] = [row for item in artists_data.get('items', []) if (row := process_artist(item)) is not None]
 
 def process_recent_tracks(raw_data, processed):
-    processed['recent_tracks'] = [process_track(item) for item in raw_data.get('recent_tracks', {}).get('items', []) if process_track(item) is not None]
+    processed['recent_tracks'] = [row for item in raw_data.get('recent_tracks', {}).get('items', []) if (row := process_track(item)) is not None]
 
 def ritual():
     extract()
@@ -127,7 +159,7 @@ def ritual():
     write()
     print("Full soul ritual complete.")
 
-def extract():
+def extract(profile=False):
     print("Extracting your soul from Spotify...")
     try:
         # Validate Spotify credentials
@@ -138,24 +170,47 @@ def extract():
         if not sp or not isinstance(sp, Spotify):
             raise RuntimeError("Spotify instance is not properly initialized. Check your authentication flow.")
         
-        data = {
-            "user_profile": sp.current_user(),
-            "top_tracks": {
-                "short_term": sp.current_user_top_tracks(time_range='short_term', limit=50),
-                "medium_term": sp.current_user_top_tracks(time_range='medium_term', limit=50),
-                "long_term": sp.current_user_top_tracks(time_range='long_term', limit=50)
-            },
-            "top_artists": {
-                "short_term": sp.current_user_top_artists(time_range='short_term', limit=50),
-                "medium_term": sp.current_user_top_artists(time_range='medium_term', limit=50),
-                "long_term": sp.current_user_top_artists(time_range='long_term', limit=50)
-            },
-            "recent_tracks": sp.current_user_recently_played(limit=10)
-        }
+        # --profile also cProfiles each stage into data/profiles/
+        profiler = Profiler(Path("data/profiles") / datetime.datetime.now().strftime("%Y%m%d_%H%M%S") if profile else None)
+        # every response is schema-checked as it arrives, bad records end up in data/quarantine/
+        ledger = SectionLedger()
+        with profiler.stage("fetch"):
+            data = {
+                "user_profile": sp.current_user(),
+                "top_tracks": {
+                    time_range: ledger.ingest(f"top_tracks_{time_range}",
+                                              sp.current_user_top_tracks(time_range=time_range, limit=50))
+                    for time_range in ('short_term', 'medium_term', 'long_term')
+                },
+                "top_artists": {
+                    time_range: ledger.ingest(f"top_artists_{time_range}",
+                                              sp.current_user_top_artists(time_range=time_range, limit=50))
+                    for time_range in ('short_term', 'medium_term', 'long_term')
+                },
+                "recent_tracks": ledger.ingest("recent_tracks", sp.current_user_recently_played(limit=50))
+            }
+            ledger.ingest_profile(data["user_profile"])
+        with profiler.stage("hydrate_artists"):
+            try:
+                ArtistHydrator(sp, api_call=best_effort_call).hydrate(data)
+            except Exception as e:
+                print(f"Artist hydration failed, saving without track genres: {e}")
         raw_path.parent.mkdir(exist_ok=True)
-        with open(raw_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        with profiler.stage("save"):
+            payload = write_json(raw_path, data)
+        with profiler.stage("manifest"):
+            ExtractionManifest.for_output_dir("data").record(raw_path, data, len(payload), hashlib.sha256(payload).hexdigest())
         print(f"Soul extracted and saved to {raw_path}")
+        quarantine_file = ledger.write_quarantine(Path("data/quarantine") / f"{raw_path.stem}.jsonl")
+        if quarantine_file:
+            print(f"Quarantined {sum(ledger.quarantined_counts().values())} bad records to {quarantine_file}")
+        with profiler.stage("history"):
+            print(f"{record_extraction(data)} new plays added to listening history")
+        timings = profiler.report()
+        append_timings(Path("data"), timings, kind="soulpull", user_id=(data["user_profile"] or {}).get("id"),
+                       output_file=str(raw_path), timestamp=datetime.datetime.now().isoformat())
+        if profile:
+            print(format_report(timings))
     except ValueError as ve:
         print(f"Validation error: {ve}")
     except RuntimeError as re:
@@ -165,38 +220,50 @@ def extract():
 
 def write():
     landing_folder.mkdir(exist_ok=True)
-    i = 1
-    while (landing_folder / f'the_end_{i}.json').exists():
-        i += 1
-    dest_path = landing_folder / f'the_end_{i}.json'
     if not raw_path.exists():
         print("No extracted soul found. Run with --extract first.")
         return
-    with open(raw_path, 'r') as f:
-        raw_data = json.load(f)
+    raw_data = read_json(raw_path)
     processed_data = process_soul_data(raw_data)
-    with open(dest_path, 'w') as f:
-        json.dump(processed_data, f, indent=2)
+    # claim the next free slot with an exclusive create so two writers can't pick the same number
+    i = 1
+    while True:
+        dest_path = landing_folder / f'the_end_{i}.json'
+        try:
+            os.close(os.open(dest_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            i += 1
+    write_json(dest_path, processed_data)
+    snapshot_store().put(processed_data, label="final_landing", source=str(dest_path))
     print(f"Copied processed soul data to {dest_path}")
 
-def read():
+def read(section=None, limit=None):
     if not raw_path.exists():
         print("No extracted soul found. Run with --extract first.")
         return
-    with open(raw_path, 'r') as f:
-        data = json.load(f)
-    # Display user profile information
-    user_profile = data.get('user_profile', {})
-    print("\n--- User Profile ---")
-    print(f"Display Name: {user_profile.get('display_name', 'N/A')}")
-    print(f"Email: {user_profile.get('email', 'N/A')}")
-    print(f"Spotify URI: {user_profile.get('uri', 'N/A')}")
-    print(f"Profile URL: {user_profile.get('external_urls', {}).get('spotify', 'N/A')}")
-    print("--------------------\n")
-    display_raw_data(data)
-
-def display_raw_data(data):
-    pprint(data)
+    # only the parts we print get parsed - full extractions are too big for json.load + pprint
+    with ExtractionReader(raw_path) as reader:
+        # Display user profile information
+        user_profile = reader.section('user_profile') if 'user_profile' in reader.sections() else {}
+        print("\n--- User Profile ---")
+        print(f"Display Name: {user_profile.get('display_name', 'N/A')}")
+        print(f"Email: {user_profile.get('email', 'N/A')}")
+        print(f"Spotify URI: {user_profile.get('uri', 'N/A')}")
+        print(f"Profile URL: {user_profile.get('external_urls', {}).get('spotify', 'N/A')}")
+        print("--------------------\n")
+        display_raw_data(reader, section, limit)
+
+def display_raw_data(reader, section=None, limit=None):
+    if not section:
+        for name, (start, end) in reader.sections().items():
+            print(f"{name:<22} {end - start:>12,} bytes")
+        print("\nUse --section <name> to print one section")
+        return
+    for count, item in enumerate(reader.iter_items(section), 1):
+        pprint(item)
+        if limit and count >= limit:
+            break
 
 import argparse
 
@@ -205,15 +272,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract and process Spotify soul data.")
     parser.add_argument("--extract", action="store_true", help="Extract soul data from Spotify")
     parser.add_argument("--read", action="store_true", help="Print soul data to terminal")
+    parser.add_argument("--section", help="With --read, print only this section (e.g. recent_tracks)")
+    parser.add_argument("--limit", type=int, help="With --read, stop after N items")
     parser.add_argument("--write", action="store_true", help="Save numbered copy to final_landing")
     parser.add_argument("--ritual", action="store_true", help="Do all 3 steps automatically")
+    parser.add_argument("--profile", action="store_true", help="With --extract, time and cProfile each stage")
 
     args = parser.parse_args()
 
     if args.extract:
-        extract()
+        extract(args.profile)
     if args.read:
-        read()
+        read(args.section, args.limit)
     if args.write:
         write()
     if args.ritual:
@@ -3,24 +3,55 @@
 Spotify data extraction script
 """
 
+import hashlib
 import json
 import os
+import re
 import datetime
 import time
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, List
 from dataclasses import dataclass
 import logging
+import requests
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyOAuth
 from spotipy.exceptions import SpotifyException
 from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from soul_logging import setup_logging
+from soul_manifest import ExtractionManifest, extraction_filename
+from soul_snapshots import SnapshotConfig, SnapshotStore
+from soul_hydration import ArtistHydrator, HydrationConfig
+from soul_history import HistoryConfig, record_extraction
+from soul_persist import dumps, atomic_write, write_text
+from soul_profiling import Profiler, append_timings, format_report
+from soul_checkpoint import CheckpointConfig, ExtractionCheckpoint, LIBRARY_SCOPE
+from soul_schemas import SectionLedger
+from soul_resilience import (Deadline, DeadlineExceeded, CircuitOpenError, RetriesExhausted, breakers, is_transient,
+                             retry_after, spotify_session)
+from soul_cassette import Cassette, attach, replay_client, cassette_from_env, default_cassette_path
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# profile + 3 top track ranges + 3 top artist ranges + recent + saved, then artist hydration if it's on
+EXTRACTION_STEPS = 9
+
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+# span name -> circuit breaker; calls to one family share an endpoint's health
+ENDPOINT_FAMILIES = {
+    "api.user_profile_extraction": "me",
+    "api.top_tracks": "top",
+    "api.top_artists": "top",
+    "api.recent_tracks_extraction": "player",
+    "api.saved_tracks": "library",
+    "api.artist_batch": "artists"
+}
+
 @dataclass
 class ExtractionConfig:
     """Configuration for Spotify data extraction"""
@@ -29,6 +60,21 @@ class ExtractionConfig:
     scope: str = "user-top-read user-read-recently-played user-library-read"
     max_retries: int = 3
     rate_limit_delay: float = 0.5
+    cassette_mode: Optional[str] = None  # "record" or "replay", falls back to SOUL_CASSETTE_MODE
+    cassette_path: Optional[str] = None
+    user_id: Optional[str] = None  # only use this user's tokens, newest token overall if None
+    history_dir: Optional[str] = "history"  # append recent plays to the user's play log, None to skip
+    snapshot_dir: str = "snapshots"  # relative to output_dir
+    hydrate_artists: bool = True  # fetch genres for every track artist, not just top artists
+    artist_cache_path: str = "cache/artists.db"
+    checkpoint_dir: Optional[str] = "checkpoints"  # per-section/page progress, None to disable
+    resume: bool = True  # continue an unfinished run for the same user instead of starting over
+    retry_empty: bool = True  # refetch sections validation flags as empty, once
+    saved_tracks_limit: Optional[int] = 50  # None pages through the whole library
+    profile: bool = False  # cProfile each stage into <output_dir>/profiles/
+    deadline_seconds: Optional[float] = 300.0  # whole extraction, None for no limit
+    call_timeout: float = 10.0  # per request, shrinks as the deadline gets close
+    circuit_breakers: bool = True  # fail fast on endpoint families that keep erroring
 
 class SpotifyTokenManager:
     """Manages Spotify authentication tokens with automatic discovery"""
@@ -37,14 +83,20 @@ class SpotifyTokenManager:
         self.token_dir = Path(token_dir)
         self.token_dir.mkdir(parents=True, exist_ok=True)
     
-    def get_latest_token(self) -> Path:
-        """Find and return the latest token file"""
+    def get_latest_token(self, user_id: Optional[str] = None) -> Path:
+        """Find and return the latest token file, optionally for one user"""
+        # the whole name - a prefix match would hand user "abc" the tokens of "abc_def"
+        user_part = re.escape(user_id) if user_id else ".+"
+        pattern = re.compile(rf"spotify_token_{user_part}_\d{{8}}_\d{{6}}\.json")
         token_files = [
             f for f in self.token_dir.iterdir() 
-            if f.is_file() and f.name.startswith("spotify_token_") and f.suffix == ".json"
+            if f.is_file() and pattern.fullmatch(f.name)
         ]
         
         if not token_files:
+            if user_id:
+                logger.error(f"No Spotify token files found for user {user_id}")
+                raise FileNotFoundError(f"No Spotify token files found for user {user_id}. Please authenticate first.")
             logger.error("No Spotify token files found in tokens/ directory")
             logger.info("Please run the authentication flow first:")
             logger.info("   1. Run server.py to start the auth server")
@@ -89,11 +141,35 @@ class SpotifyTokenManager:
 class SpotifyDataExtractor:
     """pulls spotify data and tries not to break"""
     
-    def __init__(self, config: Optional[ExtractionConfig] = None):
+    def __init__(self, config: Optional[ExtractionConfig] = None,
+                 progress_callback: Optional[ProgressCallback] = None):
         self.config = config or ExtractionConfig()
-        self.token_manager = SpotifyTokenManager(self.config.token_dir)
-        self.sp = self._initialize_spotify_client()
+        self.progress_callback = progress_callback
+        self._steps_done = 0
+        # what 100% means for this run - set by whichever pipeline runs
+        self._total_steps = EXTRACTION_STEPS
+        self.checkpoint: Optional[ExtractionCheckpoint] = None
+        # counts, quarantined records and quality, filled in as each response is validated
+        self.ledger = SectionLedger()
+        self.profiler = Profiler()
+        # the clock starts before connecting - a hung token refresh counts too
+        self.deadline = Deadline(self.config.deadline_seconds)
+        self.breakers = breakers if self.config.circuit_breakers else None
+        # (operation, reason) for every essential call skipped because of the deadline or a circuit
+        self.interrupted: List[tuple] = []
+        self.cassette = self._load_cassette()
         self._setup_output_directory()
+        with self.profiler.stage("connect"):
+            if self.cassette and self.cassette.mode == "replay":
+                # replay never sleeps - nothing to rate limit
+                self.config.rate_limit_delay = 0.0
+                # ...and recorded errors shouldn't trip circuits shared with live extractions
+                self.breakers = None
+                self.token_manager = None
+                self.sp = self._initialize_replay_client()
+            else:
+                self.token_manager = SpotifyTokenManager(self.config.token_dir)
+                self.sp = self._initialize_spotify_client()
     
     def _setup_output_directory(self):
         self.output_path = Path(self.config.output_dir)
@@ -102,10 +178,32 @@ class SpotifyDataExtractor:
         # Create subdirectories for organization
         (self.output_path / "raw").mkdir(exist_ok=True)
         (self.output_path / "processed").mkdir(exist_ok=True)
-        (self.output_path / "backups").mkdir(exist_ok=True)
+        if self.config.profile:
+            run_stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.profiler.profile_dir = self.output_path / "profiles" / f"{self.config.user_id or 'extraction'}_{run_stamp}"
+        # backups and per-extraction snapshots, deduped by content
+        self.manifest = ExtractionManifest.for_output_dir(self.output_path)
+        self.snapshots = SnapshotStore(SnapshotConfig(root=str(self.output_path / self.config.snapshot_dir)))
+    
+    def _load_cassette(self) -> Optional[Cassette]:
+        if not self.config.cassette_mode:
+            return cassette_from_env("extraction")
+        if self.config.cassette_path:
+            path = Path(self.config.cassette_path)
+        else:
+            path = default_cassette_path("extraction")
+        return Cassette(path, self.config.cassette_mode)
+    
+    def _initialize_replay_client(self) -> Spotify:
+        logger.info(f"Replaying Spotify responses from {self.cassette.path}")
+        sp = replay_client(self.cassette)
+        user = sp.current_user()
+        if user:
+            logger.info(f"Replaying as: {user.get('display_name', 'Unknown')} ({user.get('id', 'Unknown')})")
+        return sp
     
     def _initialize_spotify_client(self) -> Spotify:
-        latest_token = self.token_manager.get_latest_token()
+        latest_token = self.token_manager.get_latest_token(self.config.user_id)
         
         # Validate token before using
         if not self.token_manager.validate_token(latest_token):
@@ -118,8 +216,18 @@ class SpotifyDataExtractor:
                 client_id=os.getenv("SPOTIPY_CLIENT_ID"),
                 client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
                 redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI"),
-                cache_path=str(latest_token)
-            ))
+                cache_path=str(latest_token),
+                requests_timeout=self.config.call_timeout
+            ), requests_timeout=self.config.call_timeout, requests_session=spotify_session())
+            # staging / rehearsals point this at a stand-in (see soul_loadtest)
+            if os.getenv("SPOTIFY_API_URL"):
+                sp.prefix = f"{os.getenv('SPOTIFY_API_URL').rstrip('/')}/"
+            # no urllib3 retries: they'd sleep through Retry-After on their own and then
+            # hide the status and headers - retries and backoff happen in _safe_api_call
+            # where the deadline is known
+            if self.cassette:
+                logger.info(f"Recording Spotify responses to {self.cassette.path}")
+                attach(sp, self.cassette)
             
             # Test the connection
             user = sp.current_user()
@@ -135,25 +243,107 @@ class SpotifyDataExtractor:
             logger.error(f"Failed to initialize Spotify client: {e}")
             raise
     
-    def _safe_api_call(self, func, operation_name: str = "API call") -> Optional[Dict[str, Any]]:
+    def _open_checkpoint(self, user_id: Optional[str]) -> Optional[ExtractionCheckpoint]:
+        # replays are benchmarks - they should always make every call
+        if not self.config.checkpoint_dir or not user_id or (self.cassette and self.cassette.mode == "replay"):
+            return None
+        limit = self.config.saved_tracks_limit
+        # full library and daily runs for the same user can overlap - they never share a file
+        checkpoint = ExtractionCheckpoint.for_user(
+            user_id, CheckpointConfig(checkpoint_dir=self.config.checkpoint_dir),
+            scope=LIBRARY_SCOPE if limit is None else None, settings={'saved_tracks_limit': limit})
+        if not self.config.resume:
+            checkpoint.reset()
+        elif checkpoint.completed():
+            logger.info(f"Resuming extraction for {user_id}: {len(checkpoint.completed())} sections already done")
+        return checkpoint
+    
+    def _checkpointed(self, name: str, fetch: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """A finished section from the checkpoint, or fetch it and checkpoint it if the call worked"""
+        if self.checkpoint:
+            stored = self.checkpoint.load_section(name)
+            if stored is not None:
+                logger.info("    %s restored from checkpoint", name)
+                return self.ledger.ingest(name, stored)
+        # validated before it's checkpointed, so a resumed run only ever sees clean sections
+        result = self.ledger.ingest(name, fetch())
+        if result is not None and self.checkpoint:
+            self.checkpoint.save_section(name, result)
+        return result
+    
+    def _report_progress(self, section: str, item_count: Optional[int] = None):
+        # one step per finished section - listeners get a running percentage
+        self._steps_done += 1
+        if not self.progress_callback:
+            return
+        try:
+            self.progress_callback(section, {
+                'step': self._steps_done,
+                'total_steps': self._total_steps,
+                'percent': round(100 * self._steps_done / self._total_steps),
+                'item_count': item_count
+            })
+        except Exception as e:
+            # progress is nice to have - never let it kill an extraction
+            logger.warning("Progress callback failed for %s: %s", section, e)
+    
+    def _give_up(self, operation_name: str, reason: str, essential: bool):
+        logger.warning("Skipping %s: %s", operation_name, reason)
+        self.profiler.count("deadline_skipped" if reason == "deadline" else "short_circuited")
+        if essential:
+            self.interrupted.append((operation_name, reason))
+    
+    def _safe_api_call(self, func, operation_name: str = "API call", essential: bool = True) -> Optional[Dict[str, Any]]:
+        profiler = self.profiler
+        # "saved tracks (offset 150)" -> api.saved_tracks, one span path per kind of call
+        span_name = "api." + operation_name.split(" (")[0].replace(" ", "_")
+        breaker = self.breakers.get(ENDPOINT_FAMILIES.get(span_name, span_name)) if self.breakers else None
         for attempt in range(self.config.max_retries):
+            timeout = self.deadline.call_timeout(self.config.call_timeout)
+            if timeout is None:
+                self._give_up(operation_name, "deadline", essential)
+                return None
+            if breaker and not breaker.allow():
+                self._give_up(operation_name, f"circuit {breaker.name} open", essential)
+                return None
             try:
-                logger.debug(f"Attempting {operation_name} (attempt {attempt + 1})")
-                time.sleep(self.config.rate_limit_delay)  # Rate limiting
-                result = func()
-                logger.debug(f"{operation_name} successful")
+                logger.debug("Attempting %s (attempt %d)", operation_name, attempt + 1)
+                with profiler.span("sleep.rate_limit"):
+                    time.sleep(min(self.config.rate_limit_delay, self.deadline.remaining()))  # Rate limiting
+                # shared by the hydration threads - they all derive it from the same deadline anyway
+                self.sp.requests_timeout = timeout
+                with profiler.span(span_name):
+                    result = func()
+                if breaker:
+                    breaker.record(True)
+                logger.debug("%s successful", operation_name)
                 return result
                 
-            except SpotifyException as e:
-                logger.warning(f"Spotify API error in {operation_name} (attempt {attempt + 1}): {e}")
+            except (SpotifyException, requests.exceptions.RequestException) as e:
+                transient = is_transient(e)
+                if breaker:
+                    # a 404 or 403 still means the endpoint answered
+                    breaker.record(not transient)
+                logger.warning("Spotify API error in %s (attempt %d): %s", operation_name, attempt + 1, e)
+                if not isinstance(e, SpotifyException) and not transient:
+                    return None
                 if attempt == self.config.max_retries - 1:
-                    logger.error(f"{operation_name} failed after {self.config.max_retries} attempts")
+                    logger.error("%s failed after %d attempts", operation_name, self.config.max_retries)
+                    profiler.count("failed_calls")
+                    return None
+                # Exponential backoff, or whatever a 429 asked for
+                delay = retry_after(e) or self.config.rate_limit_delay * (2 ** attempt)
+                if delay >= self.deadline.remaining():
+                    self._give_up(operation_name, "deadline", essential)
                     return None
-                # Exponential backoff
-                time.sleep(self.config.rate_limit_delay * (2 ** attempt))
+                profiler.count("retries")
+                with profiler.span("sleep.backoff"):
+                    time.sleep(delay)
                 
             except Exception as e:
-                logger.error(f"Unexpected error in {operation_name}: {e}")
+                if breaker:
+                    breaker.record(True)
+                logger.error("Unexpected error in %s: %s", operation_name, e)
                 return None
         
         return None
@@ -164,6 +354,9 @@ class SpotifyDataExtractor:
         
         # this takes a while so be patient
         extraction_start = time.time()
+        self._steps_done = 0
+        self._total_steps = EXTRACTION_STEPS + (1 if self.config.hydrate_artists else 0)
+        self.ledger = SectionLedger()
         
         # Initialize data structure with metadata
         data = {
@@ -178,37 +371,51 @@ class SpotifyDataExtractor:
         
         # Get user profile first
         logger.info("Extracting user profile...")
-        user_profile = self._safe_api_call(
-            lambda: self.sp.current_user(),
-            "user profile extraction"
-        )
+        with self.profiler.stage("user_profile"):
+            user_profile = self._safe_api_call(
+                lambda: self.sp.current_user(),
+                "user profile extraction"
+            )
+        user_profile = self.ledger.ingest_profile(user_profile)
         if user_profile:
             data["user_profile"] = user_profile
             data["extraction_metadata"]["spotify_user_id"] = user_profile.get('id') # type: ignore
             logger.info(f"User: {user_profile.get('display_name', 'Unknown')}")
+        self._report_progress("user_profile")
+        
+        # the profile is always fetched fresh - it tells us whose checkpoint to resume
+        self.checkpoint = self._open_checkpoint(data["extraction_metadata"]["spotify_user_id"] or self.config.user_id)
         
         # Extract top items
         logger.info("Extracting top tracks and artists...")
-        data["top_tracks"] = self._extract_top_items('tracks')
-        data["top_artists"] = self._extract_top_items('artists')
+        with self.profiler.stage("top_tracks"):
+            data["top_tracks"] = self._extract_top_items('tracks')
+        with self.profiler.stage("top_artists"):
+            data["top_artists"] = self._extract_top_items('artists')
         
         # Extract recent tracks
         logger.info("Extracting recently played tracks...")
-        recent_tracks = self._safe_api_call(
-            lambda: self.sp.current_user_recently_played(limit=50),
-            "recent tracks extraction"
-        )
+        with self.profiler.stage("recent_tracks"):
+            recent_tracks = self._fetch_recent_tracks()
         # handle None case - api sometimes fails
         data["recent_tracks"] = recent_tracks if recent_tracks else {"items": []}
+        self._report_progress("recent_tracks", len(data["recent_tracks"].get('items', [])))
         
         # Extract saved tracks
         logger.info("Extracting saved tracks...")
-        saved_tracks = self._safe_api_call(
-            lambda: self.sp.current_user_saved_tracks(limit=50),
-            "saved tracks extraction"
-        )
+        with self.profiler.stage("saved_tracks"):
+            saved_tracks = self._extract_saved_tracks()
         # same deal as recent tracks - dont let None break things
         data["saved_tracks"] = saved_tracks if saved_tracks else {"items": []}
+        self._report_progress("saved_tracks", len(data["saved_tracks"].get('items', [])))
+        
+        # Fill genres onto track artists - only artists missing from the shared cache cost an API call
+        # (not worth it for a run that's going to be resumed anyway)
+        if self.config.hydrate_artists and not self.interrupted:
+            logger.info("Hydrating track artists...")
+            with self.profiler.stage("hydrate_artists"):
+                self._hydrate_artists(data)
+            self._report_progress("artist_hydration", data["extraction_metadata"]["artist_hydration"]["unique_artists"])
         
         # Calculate extraction metrics
         extraction_time = time.time() - extraction_start
@@ -219,6 +426,130 @@ class SpotifyDataExtractor:
         
         return data
     
+    def raise_if_interrupted(self, data: Dict[str, Any]):
+        """Stop before saving a run the deadline, an open circuit or failed retries cut short - the checkpoint keeps what we got"""
+        if not self.interrupted:
+            return
+        user_id = data["extraction_metadata"].get("spotify_user_id") or self.config.user_id
+        if self.checkpoint:
+            self.checkpoint.close()
+        if self.cassette:
+            self.cassette.save()
+        append_timings(self.output_path, self.profiler.report(), kind="interrupted", user_id=user_id,
+                       timestamp=datetime.datetime.now().isoformat())
+        reasons = sorted({reason for _, reason in self.interrupted})
+        message = (f"Extraction for {user_id} stopped early ({', '.join(reasons)}), "
+                   f"{len(self.interrupted)} calls skipped"
+                   f"{' - checkpoint kept, the next run resumes' if self.checkpoint else ''}")
+        if "deadline" in reasons:
+            raise DeadlineExceeded(message)
+        if any(reason.startswith("circuit") for reason in reasons):
+            raise CircuitOpenError(message)
+        raise RetriesExhausted(message)
+    
+    def _hydrate_artists(self, data: Dict[str, Any]):
+        # missing genres don't make an extraction incomplete - skipped batches aren't essential
+        hydrator = ArtistHydrator(self.sp, HydrationConfig(cache_path=self.config.artist_cache_path),
+                                  api_call=lambda func, name: self._safe_api_call(func, name, essential=False))
+        data["extraction_metadata"]["artist_hydration"] = hydrator.hydrate(data)
+    
+    def _fetch_top_range(self, item_type: str, time_range: str) -> Optional[Dict[str, Any]]:
+        # api is messing up again figure it out
+        if item_type == 'tracks':
+            api_call = lambda: self.sp.current_user_top_tracks(time_range=time_range, limit=50)
+        else:
+            api_call = lambda: self.sp.current_user_top_artists(time_range=time_range, limit=50)
+        return self._checkpointed(
+            f"top_{item_type}_{time_range}",
+            lambda: self._safe_api_call(api_call, f"top {item_type} ({time_range})")
+        )
+    
+    def _fetch_recent_tracks(self) -> Optional[Dict[str, Any]]:
+        return self._checkpointed(
+            "recent_tracks",
+            lambda: self._safe_api_call(lambda: self.sp.current_user_recently_played(limit=50), "recent tracks extraction")
+        )
+    
+    def _extract_saved_tracks(self) -> Optional[Dict[str, Any]]:
+        """Saved tracks page by page - every page is checkpointed, a resumed run continues at the next offset"""
+        if self.checkpoint:
+            stored = self.checkpoint.load_section("saved_tracks")
+            if stored is not None:
+                logger.info("    saved_tracks restored from checkpoint")
+                return self.ledger.ingest("saved_tracks", stored)
+        
+        limit = self.config.saved_tracks_limit
+        # pages are checkpointed as Spotify sent them (offsets stay right), clean holds the validated copies
+        self.ledger.reset("saved_tracks")
+        pages = self.checkpoint.load_pages("saved_tracks") if self.checkpoint else []
+        clean = [self.ledger.ingest("saved_tracks", page, append=True) for page in pages]
+        offset = sum(len(page.get('items') or []) for page in pages)
+        if pages:
+            logger.info("    Resuming saved tracks at offset %d (%d pages checkpointed)", offset, len(pages))
+        
+        complete = True
+        while True:
+            if pages and (not pages[-1].get('next') or not pages[-1].get('items')):
+                break
+            if limit is not None and offset >= limit:
+                break
+            page_size = 50 if limit is None else min(50, limit - offset)
+            skipped = len(self.interrupted)
+            page = self._safe_api_call(
+                lambda o=offset, n=page_size: self.sp.current_user_saved_tracks(limit=n, offset=o),
+                f"saved tracks (offset {offset})"
+            )
+            if page is None:
+                # the pages so far stay checkpointed for the next run - a truncated
+                # library mustn't be saved as if it were the whole thing
+                if len(self.interrupted) == skipped:
+                    self.interrupted.append((f"saved tracks (offset {offset})", "retries exhausted"))
+                complete = False
+                break
+            if self.checkpoint:
+                self.checkpoint.save_page("saved_tracks", offset, page)
+            pages.append(page)
+            clean.append(self.ledger.ingest("saved_tracks", page, append=True))
+            offset += len(page.get('items') or [])
+        
+        if not pages:
+            return None
+        combined = {**clean[-1], 'items': [item for page in clean for item in page.get('items') or []],
+                    'offset': 0, 'previous': None}
+        if complete and self.checkpoint:
+            self.checkpoint.save_section("saved_tracks", combined)
+        return combined
+    
+    def retry_sections(self, data: Dict[str, Any], sections: List[str]) -> List[str]:
+        """Refetch sections validation flagged as empty - returns the ones that came back with items"""
+        if self.checkpoint:
+            # an empty section is checkpointed like any other - forget it so it's really refetched
+            self.checkpoint.invalidate(sections)
+        recovered = []
+        for name in sections:
+            if name.startswith("top_"):
+                _, item_type, time_range = name.split("_", 2)
+                payload = self._fetch_top_range(item_type, time_range)
+                data.setdefault(f"top_{item_type}", {})[time_range] = payload
+            elif name == "recent_tracks":
+                payload = self._fetch_recent_tracks() or {"items": []}
+                data["recent_tracks"] = payload
+            elif name == "saved_tracks":
+                payload = self._extract_saved_tracks() or {"items": []}
+                data["saved_tracks"] = payload
+            else:
+                continue
+            if payload and payload.get('items'):
+                recovered.append(name)
+        
+        logger.info(f"Retried {len(sections)} empty sections, {len(recovered)} came back with data")
+        if recovered and self.config.hydrate_artists:
+            # cached artists are free, only the new ones cost calls
+            self._hydrate_artists(data)
+        data["extraction_metadata"]["retried_sections"] = {'retried': sections, 'recovered': recovered}
+        data["extraction_metadata"]["data_completeness"] = self._calculate_data_completeness(data)
+        return recovered
+    
     def _extract_top_items(self, item_type: str) -> Dict[str, Any]:
         # gets top tracks or artists - basic stuff
         time_ranges = {
@@ -230,22 +561,12 @@ class SpotifyDataExtractor:
         top_items = {}
         
         for time_range, description in time_ranges.items():
-            logger.info(f"  Extracting top {item_type} ({description})...")
-            
-            # api is messing up again figure it out
-            if item_type == 'tracks':
-                api_call = lambda tr=time_range: self.sp.current_user_top_tracks(time_range=tr, limit=50)
-            else:
-                api_call = lambda tr=time_range: self.sp.current_user_top_artists(time_range=tr, limit=50)
-
-            items = self._safe_api_call(
-                api_call,
-                f"top {item_type} ({time_range})"
-            )
+            logger.info("  Extracting top %s (%s)...", item_type, description)
+            items = self._fetch_top_range(item_type, time_range)
             
             if items and 'items' in items:
                 item_count = len(items['items'])
-                logger.info(f"    Found {item_count} {item_type} for {time_range}")
+                logger.info("    Found %d %s for %s", item_count, item_type, time_range)
                 
                 
                 
@@ -255,70 +576,43 @@ class SpotifyDataExtractor:
                 # dev needs more sleep brb we'll work on this tomrrow
                 
                 if item_count == 0:
-                    logger.warning(f"    No {item_type} found for {time_range} - user might be new or have limited listening history")
+                    logger.warning("    No %s found for %s - user might be new or have limited listening history", item_type, time_range)
             
             top_items[time_range] = items
+            self._report_progress(f"top_{item_type}_{time_range}", len(items['items']) if items and 'items' in items else 0)
         
         return top_items
     
     def _calculate_data_completeness(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        completeness = {}
-        
-        if "top_tracks" in data:
-            for time_range, tracks_data in data["top_tracks"].items():
-                if tracks_data and 'items' in tracks_data:
-                    completeness[f"top_tracks_{time_range}"] = len(tracks_data['items'])
-                else:
-                    completeness[f"top_tracks_{time_range}"] = 0
-        
-        if "top_artists" in data:
-            for time_range, artists_data in data["top_artists"].items():
-                if artists_data and 'items' in artists_data:
-                    completeness[f"top_artists_{time_range}"] = len(artists_data['items'])
-                else:
-                    completeness[f"top_artists_{time_range}"] = 0
-        
-        if "recent_tracks" in data and data["recent_tracks"]:
-            completeness["recent_tracks"] = len(data["recent_tracks"].get('items', []))
-        
-        if "saved_tracks" in data and data["saved_tracks"]:
-            completeness["saved_tracks"] = len(data["saved_tracks"].get('items', []))
-        
-        total_possible = sum(completeness.values())
-        expected_minimum = 50  # Rough estimate of minimum expected data points
-        completeness["overall_score"] = min(total_possible / expected_minimum, 1.0) if expected_minimum > 0 else 0
-        
-        return completeness
+        # counted while each response was validated - no need to walk data again
+        return self.ledger.completeness()
     
     def validate_extracted_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        # checks if the data looks right - sometimes api returns weird stuff
+        # checks if the data looks right - the schemas already did the item-level checking on the way in
+        ledger = self.ledger
         validation_report = {
             "timestamp": datetime.datetime.now().isoformat(),
             "validation_passed": True,
             "warnings": [],
             "errors": [],
-            "data_quality_score": 1.0
+            "data_quality_score": ledger.quality_score()
         }
         
-        empty_sections = []
-        for section_name in ["top_tracks", "top_artists", "recent_tracks"]:
-            if section_name in data:
-                if section_name in ["top_tracks", "top_artists"]:
-                    for time_range, section_data in data[section_name].items():
-                        if not section_data or not section_data.get('items'):
-                            empty_sections.append(f"{section_name}_{time_range}")
-                else:
-                    if not data[section_name] or not data[section_name].get('items'):
-                        empty_sections.append(section_name)
-        
+        empty_sections = ledger.empty_sections()
+        validation_report["empty_sections"] = empty_sections
         if empty_sections:
             validation_report["warnings"].append(f"Empty data sections: {', '.join(empty_sections)}")
-            validation_report["data_quality_score"] *= 0.8
         
-        if "user_profile" not in data or not data["user_profile"]:
+        quarantined = ledger.quarantined_counts()
+        validation_report["quarantined"] = quarantined
+        if quarantined:
+            validation_report["warnings"].append(
+                "Quarantined records: " + ", ".join(f"{section} ({count})" for section, count in quarantined.items())
+            )
+        
+        if not ledger.profile_valid:
             validation_report["errors"].append("Missing user profile data")
             validation_report["validation_passed"] = False
-            validation_report["data_quality_score"] *= 0.5
         
         if validation_report["validation_passed"]:
             logger.info(f"Data validation passed (Quality Score: {validation_report['data_quality_score']:.2f})")
@@ -336,39 +630,49 @@ class SpotifyDataExtractor:
     def save_data(self, data: Dict[str, Any], filename: Optional[str] = None) -> Path:
         # saves data to file - pretty straightforward 
         if filename is None:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"spotify_soul_data_{timestamp}.json"
+            # user id + microseconds - two workers finishing in the same second used to share a name
+            filename = extraction_filename(data.get('extraction_metadata', {}).get('spotify_user_id'))
         
         output_file = self.output_path / "raw" / filename
         
-        # backup old files - dont want to lose anything
+        # old file goes into the snapshot store before we overwrite it - identical content is only kept once
+        profiler = self.profiler
         if output_file.exists():
-            backup_file = self.output_path / "backups" / f"backup_{filename}"
-            # Ensure backup file does not overwrite an existing backup
-            if backup_file.exists():
-                base = backup_file.stem
-                ext = backup_file.suffix
-                i = 1
-                while True:
-                    new_backup_file = backup_file.parent / f"{base}_{i}{ext}"
-                    if not new_backup_file.exists():
-                        backup_file = new_backup_file
-                        break
-                    i += 1
-            output_file.rename(backup_file)
-            logger.info(f"Created backup: {backup_file}")
+            with profiler.span("backup"):
+                entry = self.snapshots.put_file(output_file, label=f"backup_{output_file.stem}")
+            logger.info(f"Created backup: snapshot #{entry['seq']}")
+        
+        # records the schemas rejected sit next to the extraction, not in it
+        quarantine_file = self.ledger.write_quarantine(self.output_path / "quarantine" / f"{output_file.stem}.jsonl")
+        if quarantine_file:
+            data.setdefault("extraction_metadata", {})["quarantine"] = {
+                'file': str(quarantine_file), 'records': self.ledger.quarantined_counts()
+            }
+            logger.warning(f"Quarantined records written to {quarantine_file}")
         
+        # everything up to here - the save itself lands in timings.jsonl
+        data.setdefault("extraction_metadata", {})["timings"] = profiler.report()
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            with profiler.span("encode"):
+                payload = dumps(data)
+            # temp + fsync + rename - a crash never leaves a half-written extraction behind
+            with profiler.span("write"):
+                atomic_write(output_file, payload)
             logger.info(f"Data saved to: {output_file}")
         except Exception as e:
             # file writing messed up
             logger.error(f"Couldn't save file: {e}")
             raise IOError(f"Failed to save data to {output_file}: {e}")
-        file_size = output_file.stat().st_size
+        file_size = len(payload)
         logger.info(f"File size: {file_size:,} bytes ({file_size/1024:.1f} KB)")
         
+        # manifest first - it's what the soulpull CLI uses to find the latest file
+        with profiler.span("manifest"):
+            self.manifest.record(output_file, data, file_size, hashlib.sha256(payload).hexdigest())
+        user_id = data.get('extraction_metadata', {}).get('spotify_user_id') or 'unknown'
+        with profiler.span("snapshot"):
+            self.snapshots.put(data, label=f"extraction_{user_id}", source=str(output_file))
+        
         return output_file
     
     def generate_extraction_summary(self, data: Dict[str, Any], validation_report: Dict[str, Any]) -> str:
@@ -413,24 +717,112 @@ class SpotifyDataExtractor:
         
         return summary
 
-def main():
-    """Main execution function"""
-    try:
-        config = ExtractionConfig()
-        extractor = SpotifyDataExtractor(config)
-        data = extractor.extract_comprehensive_data()
+def run_extraction(config: Optional[ExtractionConfig] = None,
+                   progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Extract, validate, save and summarise - the whole pipeline for one user"""
+    extractor = SpotifyDataExtractor(config, progress_callback)
+    profiler = extractor.profiler
+    data = extractor.extract_comprehensive_data()
+    extractor.raise_if_interrupted(data)
+    with profiler.stage("validate"):
         validation_report = extractor.validate_extracted_data(data)
+    if extractor.config.retry_empty and validation_report["empty_sections"]:
+        logger.info(f"Retrying empty sections: {', '.join(validation_report['empty_sections'])}")
+        with profiler.stage("retry_empty"):
+            extractor.retry_sections(data, validation_report["empty_sections"])
+            validation_report = extractor.validate_extracted_data(data)
+        extractor.raise_if_interrupted(data)
+    with profiler.stage("save"):
         output_file = extractor.save_data(data)
+    if extractor.checkpoint:
+        # saved for real - a rerun should start fresh
+        extractor.checkpoint.discard()
+    if extractor.cassette:
+        extractor.cassette.save()
+    if extractor.config.history_dir:
+        try:
+            with profiler.stage("history"):
+                record_extraction(data, HistoryConfig(history_dir=extractor.config.history_dir))
+        except Exception as e:
+            # history is a nice-to-have, the extraction itself already landed
+            logger.warning(f"Could not update listening history: {e}")
+    with profiler.stage("summary"):
         summary = extractor.generate_extraction_summary(data, validation_report)
-        print(summary)
         summary_file = output_file.parent / f"summary_{output_file.stem}.txt"
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            f.write(summary)
-        logger.info(f"Summary saved to: {summary_file}")
+        write_text(summary_file, summary)
+    logger.info(f"Summary saved to: {summary_file}")
+    
+    user_id = data['extraction_metadata'].get('spotify_user_id')
+    timings = profiler.report()
+    append_timings(extractor.output_path, timings, kind="extraction", user_id=user_id,
+                   output_file=str(output_file), timestamp=datetime.datetime.now().isoformat())
+    
+    return {
+        'user_id': user_id,
+        'output_file': output_file,
+        'summary_file': summary_file,
+        'summary': summary,
+        'quality_score': validation_report['data_quality_score'],
+        'timings': timings
+    }
+
+def run_recent_plays(config: Optional[ExtractionConfig] = None,
+                     progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Just the last 50 plays into the listening history - the cheap, frequent pass"""
+    extractor = SpotifyDataExtractor(config, progress_callback)
+    profiler = extractor.profiler
+    user_id = extractor.config.user_id or (extractor.sp.current_user() or {}).get('id')
+    with profiler.stage("recent_tracks"):
+        recent_tracks = extractor._safe_api_call(
+            lambda: extractor.sp.current_user_recently_played(limit=50),
+            "recent tracks extraction"
+        )
+    if recent_tracks is None:
+        extractor.raise_if_interrupted({"extraction_metadata": {"spotify_user_id": user_id}})
+        raise RuntimeError(f"Could not fetch recent plays for {user_id}")
+
+    data = {"extraction_metadata": {"spotify_user_id": user_id}, "recent_tracks": recent_tracks}
+    with profiler.stage("history"):
+        new_plays = record_extraction(data, HistoryConfig(history_dir=extractor.config.history_dir or "history"))
+    extractor._total_steps = 1
+    extractor._report_progress("recent_tracks", len(recent_tracks.get('items', [])))
+    if extractor.cassette:
+        extractor.cassette.save()
+    logger.info(f"{new_plays} new plays recorded for {user_id}")
+
+    timings = profiler.report()
+    append_timings(extractor.output_path, timings, kind="recent", user_id=user_id,
+                   timestamp=datetime.datetime.now().isoformat())
+    return {'user_id': user_id, 'output_file': None, 'new_plays': new_plays, 'timings': timings}
+
+def main():
+    """Main execution function"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Extract a user's Spotify data")
+    parser.add_argument("--user", help="Use this user's newest token (and resume their checkpoint)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore any checkpoint from an unfinished run")
+    parser.add_argument("--no-retry", action="store_true", help="Don't refetch sections that came back empty")
+    parser.add_argument("--all-saved-tracks", action="store_true", help="Page through the whole saved library")
+    parser.add_argument("--profile", action="store_true", help="cProfile each stage into <output_dir>/profiles/")
+    parser.add_argument("--deadline", type=float, default=ExtractionConfig.deadline_seconds,
+                        help="Give up (keeping the checkpoint) after this many seconds, 0 for no limit")
+    args = parser.parse_args()
+    
+    config = ExtractionConfig(user_id=args.user, resume=not args.fresh, retry_empty=not args.no_retry,
+                              profile=args.profile, deadline_seconds=args.deadline or None)
+    if args.all_saved_tracks:
+        config.saved_tracks_limit = None
+    try:
+        result = run_extraction(config)
+        print(result['summary'])
+        if args.profile:
+            print(format_report(result['timings']))
         logger.info("Extraction completed successfully!")
     except FileNotFoundError as e:
         logger.error(f"Authentication error: {e}")
         logger.info("Please run the authentication flow first")
+    except (DeadlineExceeded, CircuitOpenError, RetriesExhausted) as e:
+        logger.error(f"{e}")
     except Exception as e:
         # something went really wrong here
         logger.error(f"Unexpected error during extraction: {e}")